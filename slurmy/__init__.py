@@ -3,11 +3,13 @@ name = 'slurmy'
 import logging
 logging.basicConfig(level = logging.INFO)
 from .tools.jobhandler import JobHandler
-from .tools.defs import Status, Type, Theme, Mode
+from .tools.defs import Status, Type, Theme, Mode, SnapshotStore
 from .tools import options
 from .tools.wrapper import SingularityWrapper
 from .backends.slurm import Slurm
 from .backends.htcondor import HTCondor
+from .backends.slurmrest import SlurmRest
+from .backends.fake import Fake
 from .tools.utils import SuccessTrigger, FinishedTrigger, LogMover, CmdLineExec, set_docker_mode
 from .tools.profiler import Profiler
 
@@ -4,7 +4,7 @@ import os
 import stat
 from ..tools import options
 from ..tools import dockerhandler
-from ..tools.utils import _prompt_decision, check_return
+from ..tools.utils import _prompt_decision, check_return, parse_mem
 from .defs import bids
 from ..tools.wrapper import Wrapper
 
@@ -21,6 +21,13 @@ class Base(object):
     wrapper = Wrapper()
     run_script = None
     run_args = None
+    ## Resource requests, also used for the local job scheduling
+    cpus = None
+    mem = None
+    ## Backend options which have to match for jobs to be submitted together as one array job (None if array submission is not supported)
+    _array_options = None
+    ## Maximum number of jobs per array job (None if unlimited)
+    _array_max = None
 
     def __init__(self):
         ## If we are in docker_mode, start the docker container relevant for this backend
@@ -58,7 +65,8 @@ class Base(object):
         for key in self.__dict__.keys():
             if key.startswith('_'): continue
             log.debug('({})Synchronising option "{}"'.format(self.name, key))
-            self[key] = self[key] or config[key]
+            ## Options which were added later are only defined as class attributes in old snapshots
+            self[key] = self[key] or getattr(config, key)
 
     def write_script(self, script_folder):
         """@SLURMY
@@ -116,15 +124,88 @@ class Base(object):
 
         return check_return(command)
 
+    def get_array_key(self):
+        """@SLURMY
+        Get the key which identifies backends that can be submitted together as one array job.
+
+        Returns the array key (tuple), or None if array submission is not supported by the backend.
+        """
+        if self._array_options is None:
+            return None
+
+        return tuple(getattr(self, option) for option in self._array_options)
+
+    def get_resources(self):
+        """@SLURMY
+        Get the resources requested by the job.
+
+        Returns the number of CPUs (int) and the memory in MB (float, None if not requested).
+        """
+
+        return int(self.cpus or 1), parse_mem(self.mem)
+
     ## Backend specific implementations
     def submit(self):
         return 0
 
+    @staticmethod
+    def submit_array(backends, name):
+        return [backend.submit() for backend in backends]
+
     def cancel(self):
         return 0
 
+    @staticmethod
+    def cancel_jobs(backends):
+        for backend in backends:
+            backend.cancel()
+
     def status(self):
         return 0
 
+    @staticmethod
+    def update_status_cache(backends):
+        return
+
+    ## Split of the backend commands into building the command and parsing its output, which allows to execute them asynchronously
+    def get_submit_command(self):
+        """@SLURMY
+        Get the submission command of the job.
+
+        Returns the command (list), or None if the backend doesn't submit via a single command, in which case submit() is used.
+        """
+        return None
+
+    def parse_submit_output(self, submit_string):
+        """@SLURMY
+        Parse the output of the submission command and set the job id.
+
+        * `submit_string` Output of the submission command.
+
+        Returns the job id.
+        """
+        return None
+
+    @staticmethod
+    def get_status_queries(backends):
+        """@SLURMY
+        Get the commands of the bulk status query of the given backends (see update_status_cache).
+
+        * `backends` List of backends of the running jobs.
+
+        Returns list of queries as tuples of command and the job ids it queries ([(list, list)]).
+        """
+        return []
+
+    @staticmethod
+    def set_status_cache(queries, outputs):
+        """@SLURMY
+        Fill the status cache from the outputs of the bulk status query commands.
+
+        * `queries` List of queries (see get_status_queries).
+        * `outputs` List of outputs of the query commands, in the same order.
+        """
+        return
+
     def exitcode(self):
         return 0
@@ -3,4 +3,6 @@ bids = {
   'BASE': 'Base',
   'SLURM': 'Slurm',
   'HTCONDOR': 'HTCondor',
+  'SLURMREST': 'SlurmRest',
+  'FAKE': 'Fake',
 }
@@ -0,0 +1,166 @@
+import os
+import time
+import random
+import itertools
+import logging
+from ..tools.defs import Status
+from .base import Base
+from .defs import bids
+log = logging.getLogger('slurmy')
+
+
+class Fake(Base):
+    """@SLURMY
+    Simulated batch system backend, which emulates the submission latency, queue wait, run time, and failures of batch jobs in-process, without running the run_script. The outcome of each submission is determined by the seed, the job name and the number of previous submissions of the job, so that sessions can be reproduced. Meant to measure and profile the overhead of slurmy itself for large numbers of jobs. Inherits from the Base backend class.
+
+    * `name` Name of the parent job.
+    * `log` Log file of the job, next to which the registry of the submitted jobs is written (used by the listener).
+    * `run_script` The script that would be executed by the batch system.
+    * `run_args` Run arguments that would be passed to the run_script.
+
+    Simulation options, times can be given as fixed value or as tuple of minimum and maximum value (uniformly distributed):
+
+    * `submit_latency` Time that each submission takes (in seconds).
+    * `queue_time` Time that the job waits in the queue (in seconds).
+    * `run_time` Time that the job runs (in seconds).
+    * `failure_rate` Fraction of jobs which fail.
+    * `seed` Seed of the simulated outcomes.
+    """
+
+    bid = bids['FAKE']
+    _successcode = '0'
+    _failcode = '1'
+    ## Registry of the submitted jobs, in the log directory
+    _registry_name = '.fake_registry'
+    ## Job ids are unique per process
+    _job_counter = itertools.count()
+    ## Number of submissions of the job so far
+    _n_submits = 0
+    ## Options which were added later are only defined as class attributes in old snapshots
+    submit_latency = 0.
+    queue_time = 0.
+    run_time = 0.
+    failure_rate = 0.
+    seed = None
+
+    def __init__(self, name = None, log = None, run_script = None, run_args = None, submit_latency = None, queue_time = None, run_time = None, failure_rate = None, seed = None):
+        super(Fake, self).__init__()
+        ## Common backend options
+        self.name = name
+        self.log = log
+        self.run_script = run_script
+        self.run_args = run_args
+        ## Simulation options
+        self.submit_latency = submit_latency
+        self.queue_time = queue_time
+        self.run_time = run_time
+        self.failure_rate = failure_rate
+        self.seed = seed
+        ## Internal variables
+        self._job_id = None
+        self._endtime = None
+        self._exitcode = None
+
+    def submit(self):
+        """@SLURMY
+        Submit the job to the simulated batch system. The end time and exitcode of the job are drawn at submission and registered in the registry file.
+
+        Returns the job id (str).
+        """
+        ## Outcome only depends on the seed, the job name and the submission count, so that retries have their own outcome
+        rng = random.Random('{}:{}:{}'.format(self.seed, self.name, self._n_submits))
+        self._n_submits += 1
+        if self.submit_latency: time.sleep(Fake._draw(rng, self.submit_latency))
+        ## The process id is only part of the job id, to keep it unique
+        job_id = '{}.{}'.format(os.getpid(), next(Fake._job_counter))
+        self._endtime = time.time() + Fake._draw(rng, self.queue_time) + Fake._draw(rng, self.run_time)
+        self._exitcode = Fake._failcode if rng.random() < (self.failure_rate or 0.) else Fake._successcode
+        self._job_id = job_id
+        log.debug('({}) Submitted fake job {}, finishing at {} with exitcode {}'.format(self.name, job_id, self._endtime, self._exitcode))
+        self._register('{} {} {}'.format(job_id, self._endtime, self._exitcode))
+
+        return job_id
+
+    @staticmethod
+    def _draw(rng, value):
+        if isinstance(value, (tuple, list)):
+            return rng.uniform(*value)
+
+        return float(value or 0.)
+
+    def _register(self, entry):
+        if self.log is None: return
+        with open(os.path.join(os.path.dirname(self.log), Fake._registry_name), 'a') as out_file:
+            out_file.write(entry + '\n')
+
+    def cancel(self):
+        """@SLURMY
+        Cancel the simulated job.
+        """
+        log.debug('({}) Cancel job'.format(self.name))
+        self._endtime = None
+        self._register('{} cancelled'.format(self._job_id))
+
+    def status(self):
+        """@SLURMY
+        Get the status of the simulated job.
+
+        Returns the job status (Status).
+        """
+        if self._endtime is not None and time.time() >= self._endtime:
+            return Status.FINISHED
+
+        return Status.RUNNING
+
+    def exitcode(self):
+        """@SLURMY
+        Get the exitcode of the simulated job.
+
+        Returns the job exitcode (str).
+        """
+
+        return self._exitcode
+
+    @staticmethod
+    def get_listen_func(starttime = None, names = None, log_dir = None):
+        """@SLURMY
+        Listener function, will be added to listener instance. Reads the registry of the submitted jobs in the log directory incrementally and puts the jobs which finished since the previous interval into the results.
+
+        * `starttime` Timestamp of the earliest job submission of the session, which is still relevant (not used).
+        * `names` Set of job names to consider (not used).
+        * `log_dir` Log directory of the session, in which the registry is written.
+
+        Returns listen function.
+        """
+        registry = os.path.join(log_dir, Fake._registry_name) if log_dir is not None else None
+        ## Define function for Listener
+        def listen(results, interval = 1):
+            import time
+            from collections import OrderedDict
+            offset = 0
+            ## Submitted jobs which didn't finish yet ({job_id: (endtime, exitcode)})
+            pending = {}
+            while True:
+                if registry is not None and os.path.isfile(registry):
+                    with open(registry, 'r') as in_file:
+                        in_file.seek(offset)
+                        data = in_file.read()
+                    ## Only complete lines are read
+                    data = data[:data.rfind('\n')+1]
+                    offset += len(data)
+                    for line in data.splitlines():
+                        entry = line.split()
+                        if entry[1] == 'cancelled':
+                            pending.pop(entry[0], None)
+                        else:
+                            pending[entry[0]] = (float(entry[1]), entry[2])
+                res_dict = OrderedDict()
+                now = time.time()
+                for job_id, (endtime, exitcode) in list(pending.items()):
+                    if endtime > now: continue
+                    del pending[job_id]
+                    res_dict[job_id] = {'status': Status.FINISHED, 'exitcode': exitcode}
+                results.put(res_dict)
+                time.sleep(interval)
+
+        return listen
@@ -1,10 +1,12 @@
 import subprocess
 import os
+import re
 import shlex
 import logging
 from ..tools.defs import Status
 from .base import Base
 from .defs import bids
+from . import htcondor_userlog
 from ..tools.utils import make_dir, find_between
 log = logging.getLogger('slurmy')
 
@@ -20,6 +22,7 @@ class HTCondor(Base):
 
     HTCondor batch submission arguments (see slurm documentation):
 
+    * `cpus` Number of CPUs for the htcondor job.
     * `mem` Memory limit for the slurm job.
     * `time` Time limit for the slurm job.
     * `export` Environment exports that are propagated to the slurm job.
@@ -29,8 +32,22 @@ class HTCondor(Base):
     _commands = ['condor_submit', 'condor_rm', 'condor_history', 'condor_q']
     _successcode = '0'
     _run_states = set([1, 2])  # 1: IDLE, 2: RUNNING
+    ## Maximum number of job ids cancelled with one condor_rm call
+    _condor_rm_max = 500
+    ## Maximum number of cluster ids queried with one condor_q/condor_history call
+    _condor_query_max = 500
+    ## Cache of the job entries of the current status polling cycle ({job_id: job entry or None})
+    _status_cache = {}
+    ## Job states in which the job is not running anymore, even if no exitcode is available
+    _fail_states = set([3, 5, 6])  # 3: REMOVED, 5: HELD, 6: SUBMISSION ERROR
+    ## Backend options which have to match for jobs to be submitted together as one cluster
+    _array_options = ['cpus', 'mem', 'time', 'export']
+    ## Default MAX_JOBS_PER_SUBMISSION of htcondor
+    _array_max = 20000
+    ## Proc entries in the verbose condor_submit output
+    _proc_expression = re.compile(r'\*\* Proc (\d+\.\d+):')
     
-    def __init__(self, name = None, log = None, run_script = None, run_args = None, mem = None, time = None, export = None):
+    def __init__(self, name = None, log = None, run_script = None, run_args = None, mem = None, time = None, export = None, cpus = None):
         super(HTCondor, self).__init__()
         ## Common backend options
         self.name = name
@@ -38,6 +55,7 @@ class HTCondor(Base):
         self.run_script = run_script
         self.run_args = run_args
         ## Batch options
+        self.cpus = cpus
         self.mem = mem
         self.time = time
         self.export = export
@@ -56,11 +74,22 @@ class HTCondor(Base):
 
         log.debug('({}) Writing submission file to {}'.format(self.name, script_folder))
         with open(submissionfile_path, 'w') as f:
-            f.write("""universe                = vanilla
+            f.write(self._get_submission_description(
+                    executable=self.wrapper.get(self.run_script),  # Get run_script setup through wrapper
+                    log_base=self._get_log_base(script_folder),
+                    queue="queue"
+                ))
+        return submissionfile_path
+
+    def _get_log_base(self, script_folder):
+        return os.path.join(os.path.abspath(os.path.join(script_folder, os.pardir, 'logs')), self.name)
+
+    def _get_submission_description(self, executable, log_base, queue):
+        return """universe                = vanilla
 executable              = {executable}
-output                  = {logdir}/{name}.$(ClusterId).$(Process).out
-error                   = {logdir}/{name}.$(ClusterId).$(Process).err
-log                     = {logdir}/{name}.$(ClusterId).$(Process).log
+output                  = {log_base}.$(ClusterId).$(Process).out
+error                   = {log_base}.$(ClusterId).$(Process).err
+log                     = {log_base}.$(ClusterId).$(Process).log
 
 transfer_executable     = True
 
@@ -68,17 +97,15 @@ request_cpus            = {nproc}
 {runtime}
 {memory}
 
-queue
-            """.format(
-                    executable=self.wrapper.get(self.run_script),  # Get run_script setup through wrapper
-                    logdir=os.path.abspath(os.path.join(script_folder, os.pardir, 'logs')),
-                    name=self.name,
-                    nproc="1",
-                    runtime="+RequestRuntime         = {runtime}".format(runtime=self.time) if self.time else "",
-                    memory="RequestMemory           = {memory}".format(memory=self.mem) if self.mem else ""
-                ))
-        return submissionfile_path
-
+{queue}
+""".format(
+                executable=executable,
+                log_base=log_base,
+                nproc=self.cpus or 1,
+                runtime="+RequestRuntime         = {runtime}".format(runtime=self.time) if self.time else "",
+                memory="RequestMemory           = {memory}".format(memory=self.mem) if self.mem else "",
+                queue=queue
+            )
 
     def write_script(self, script_folder):
         """@SLURMY
@@ -97,6 +124,18 @@ queue
         Adds the job id (int) and the absolute path to the log file to this class
         Returns the job id (int).
         """
+        submit_list = self.get_submit_command()
+        log.debug('({}) Submit job with command {}'.format(self.name, submit_list))
+        submit_string = subprocess.check_output(submit_list, universal_newlines = True)
+
+        return self.parse_submit_output(submit_string)
+
+    def get_submit_command(self):
+        """@SLURMY
+        Get the condor_submit command of the job.
+
+        Returns the command (list).
+        """
         submit_list = ['condor_submit', '-verbose']
 
         ## shlex splits run_script in a Popen digestable way
@@ -106,14 +145,72 @@ queue
 
         if self.run_args:
             log.info('({}) Run arguments are not yet supported. Won\'t consider {}'.format(self.name, self.run_args))
-            
-        log.debug('({}) Submit job with command {}'.format(self.name, submit_list))
-        submit_string = subprocess.check_output(submit_list, universal_newlines = True)
-        job_id = find_between(submit_string, '** Proc ', ':')
-        job_log = find_between(submit_string, 'UserLog = "', '"')
+
+        return submit_list
+
+    def parse_submit_output(self, submit_string):
+        """@SLURMY
+        Parse the condor_submit output and set the job id and the job log.
+
+        * `submit_string` Output of condor_submit.
+
+        Returns the job id (str).
+        """
+        job_id, job_log = HTCondor._parse_submit_procs(submit_string)[0]
         self._job_id[job_id] = job_log
         return job_id
 
+    @staticmethod
+    def _parse_submit_procs(submit_string):
+        ## Each proc of the submitted cluster is listed with its job ad, in the order of the ProcIds
+        entries = []
+        chunks = HTCondor._proc_expression.split(submit_string)
+        for job_id, job_ad in zip(chunks[1::2], chunks[2::2]):
+            entries.append((job_id, find_between(job_ad, 'UserLog = "', '"')))
+        if not entries:
+            log.error('Could not find any job id in condor_submit output "{}"'.format(submit_string))
+            raise Exception
+
+        return entries
+
+    @staticmethod
+    def submit_array(backends, name):
+        """@SLURMY
+        Submit several jobs as one htcondor cluster, with one condor_submit call. All backends must have the same array key (see Base.get_array_key). The executable and the log files of each proc are taken from an item file, so that each job keeps its own job event log and output files.
+
+        * `backends` List of HTCondor backends of the jobs.
+        * `name` Name of the cluster (batch name).
+
+        Returns the list of job ids ("<ClusterId>.<ProcId>"), one per backend ([str]).
+        """
+        if len(backends) > HTCondor._array_max:
+            log.error('Cannot submit {} jobs in one cluster, the maximum is {}'.format(len(backends), HTCondor._array_max))
+            raise Exception
+        reference = backends[0]
+        script_folder = os.path.dirname(reference.run_script)
+        ## One line per proc, the executable comes last since it may contain spaces (wrapped run_script)
+        item_file = os.path.join(script_folder, '{}.items'.format(reference.name))
+        with open(item_file, 'w') as out_file:
+            for backend in backends:
+                out_file.write('{} {}\n'.format(backend._get_log_base(os.path.dirname(backend.run_script)), backend.wrapper.get(backend.run_script)))
+        submission_file = os.path.join(script_folder, '{}.cluster.sub'.format(reference.name))
+        with open(submission_file, 'w') as out_file:
+            out_file.write('batch_name              = {}\n'.format(name))
+            out_file.write(reference._get_submission_description(executable = '$(executable)', log_base = '$(log_base)', queue = 'queue log_base, executable from {}'.format(item_file)))
+        submit_list = ['condor_submit', '-verbose', submission_file]
+        log.debug('Submit cluster "{}" of {} jobs with command {}'.format(name, len(backends), submit_list))
+        submit_string = subprocess.check_output(submit_list, universal_newlines = True)
+        entries = HTCondor._parse_submit_procs(submit_string)
+        if len(entries) != len(backends):
+            log.error('Submitted {} jobs in cluster "{}", but {} were requested'.format(len(entries), name, len(backends)))
+            raise Exception
+        job_ids = []
+        for (job_id, job_log), backend in zip(entries, backends):
+            backend._job_id[job_id] = job_log
+            job_ids.append(job_id)
+
+        return job_ids
+
     def cancel(self):
         """@SLURMY
         Cancel the slurm job.
@@ -121,6 +218,21 @@ queue
         log.debug('({}) Cancel job'.format(self.name))
         os.system('condor_rm {}'.format(" ".join(self._job_id.keys())))
 
+    @staticmethod
+    def cancel_jobs(backends):
+        """@SLURMY
+        Cancel the htcondor jobs of the given backends in bulk, with one condor_rm call per chunk of job ids.
+
+        * `backends` List of HTCondor backends of the running jobs.
+        """
+        job_ids = []
+        for backend in backends:
+            job_ids.extend(backend._job_id.keys())
+        for i in range(0, len(job_ids), HTCondor._condor_rm_max):
+            chunk = job_ids[i:i+HTCondor._condor_rm_max]
+            log.debug('Cancel {} jobs'.format(len(chunk)))
+            subprocess.call(['condor_rm'] + [str(job_id) for job_id in chunk])
+
 
     def _get_job_info(self):
         """ @SLURMY
@@ -152,21 +264,90 @@ queue
 
     def status(self):
         """@SLURMY
-        Get the status of slurm job from htcondor job log file (to reduce load on scheduler).
+        Get the status of slurm job from htcondor job log file (to reduce load on scheduler). The job event log is parsed directly, condor_history is only called if the log can't be read.
 
         Returns the job status (Status).
         """
-        jobinfo = self._get_job_info()
+        job_ids = list(self._job_id.keys())
+        jobinfo = None
+        ## Take the job entry from the status cache of the current polling cycle, if the job id was queried
+        if job_ids and job_ids[-1] in HTCondor._status_cache:
+            jobinfo = HTCondor._status_cache[job_ids[-1]]
+        elif job_ids:
+            ## Only the part of the job event log written since the previous call is parsed
+            jobinfo = htcondor_userlog.get_job_entry(self._job_id[job_ids[-1]], job_ids[-1])
+            if jobinfo is None:
+                jobinfo = self._get_job_info()
 
         status = Status.RUNNING
         if jobinfo is not None:
             job_state = jobinfo['finished']
-            if job_state not in HTCondor._run_states and 'success' in jobinfo:
+            if int(job_state) not in HTCondor._run_states and 'success' in jobinfo:
                 status = Status.FINISHED
                 self._exitcode = jobinfo['success']
 
         return status
 
+    @staticmethod
+    def update_status_cache(backends):
+        """@SLURMY
+        Query the job entries of all given HTCondor backends in bulk and cache them for the current status polling cycle. The jobs are looked up in their job event logs first, the remaining ones with one condor_q call per chunk of cluster ids, only the jobs which are not in the queue anymore are looked up with condor_history. HTCondor.status() and HTCondor.exitcode() are served from the cache for all job ids that were queried. Calling it with an empty list clears the cache.
+
+        * `backends` List of HTCondor backends of the running jobs.
+        """
+        status_cache = {}
+        for backend in backends:
+            for job_id, job_log in backend._job_id.items():
+                ## Job ids without entry are cached as well, since condor is asked for them
+                status_cache[job_id] = htcondor_userlog.get_job_entry(job_log, job_id)
+        ## Jobs whose job event log can't be read
+        missing_job_ids = set(job_id for job_id, entry in status_cache.items() if entry is None)
+        cluster_ids = sorted(set(job_id.split('.')[0] for job_id in missing_job_ids))
+        if cluster_ids:
+            log.debug('Query condor_q entries of {} clusters'.format(len(cluster_ids)))
+            status_cache.update(HTCondor._query_jobs('condor_q', cluster_ids, missing_job_ids))
+            ## Jobs which left the queue
+            cluster_ids = sorted(set(job_id.split('.')[0] for job_id, entry in status_cache.items() if entry is None))
+        if cluster_ids:
+            log.debug('Query condor_history entries of {} clusters'.format(len(cluster_ids)))
+            status_cache.update(HTCondor._query_jobs('condor_history', cluster_ids, set(status_cache)))
+        HTCondor._status_cache = status_cache
+
+    @staticmethod
+    def _query_jobs(command_name, cluster_ids, job_ids = None):
+        entries = {}
+        for i in range(0, len(cluster_ids), HTCondor._condor_query_max):
+            chunk = cluster_ids[i:i+HTCondor._condor_query_max]
+            command = HTCondor._get_query_command(command_name, chunk)
+            output = subprocess.check_output(command, universal_newlines = True)
+            for job_id, entry in HTCondor._parse_query_output(output).items():
+                if job_ids is not None and job_id not in job_ids: continue
+                entries[job_id] = entry
+
+        return entries
+
+    @staticmethod
+    def _get_query_command(command_name, cluster_ids):
+        command = [command_name, '-autoformat', 'ClusterId', 'ProcId', 'JobStatus', 'ExitCode']
+        command.extend(['-constraint', 'member(ClusterId, {{{}}})'.format(', '.join([str(cluster_id) for cluster_id in cluster_ids]))])
+
+        return command
+
+    @staticmethod
+    def _parse_query_output(output):
+        entries = {}
+        for line in output.rstrip('\n').split('\n'):
+            if not line.strip(): continue
+            cluster_id, proc_id, state, exitcode = line.split()
+            entry = {'finished': int(state)}
+            if exitcode != 'undefined':
+                entry['success'] = exitcode
+            elif int(state) in HTCondor._fail_states:
+                entry['success'] = '1'
+            entries['{}.{}'.format(cluster_id, proc_id)] = entry
+
+        return entries
+
     def exitcode(self):
         """@SLURMY
         Get the exitcode of slurm job from htcondor job log file. Evaluation is actually done by HTCondor.status(), HTCondor.exitcode() only returns the value. If exitcode at this stage is None, execute HTCondor.status() beforehand.
@@ -180,42 +361,88 @@ queue
         return self._exitcode
 
     @staticmethod
-    def get_listen_func():
+    def get_listen_func(starttime = None, names = None, log_dir = None):
         """@SLURMY
-        Listener function, will be added to listener instance.
-        Limited functionality, updating of jobs not fully functional at the moment.
+        Listener function, will be added to listener instance. If the log directory of the session is given, the job event logs in it are parsed incrementally in each interval, without calling any condor command. This is the default, since the JobHandler always passes its log directory, in which the job event logs of all its HTCondor jobs are written, and it doesn't put any load on the schedd. Otherwise, e.g. if the job event logs are not on a shared file system, polls the queue of the user with one condor_q call per interval, the jobs which left the queue since the previous query are looked up with one condor_history call. Only newly finished jobs are put into the results, with job ids in the "<ClusterId>.<ProcId>" format of the submission.
 
-        It is recommended to use a "non-listening" JobHandler when using HTCondor.
-        Example how to set up a job handler for HTCondor: jh = JobHandler(backend=HTCondor(), listens=False)
+        * `starttime` Timestamp of the earliest job submission of the session, which is still relevant (not used yet).
+        * `names` Set of job names to consider (not used yet).
+        * `log_dir` Log directory of the session, in which the job event logs are written.
 
         Returns listen function.
         """
+        if log_dir is not None:
+            return HTCondor._get_userlog_listen_func(log_dir)
 
         command = ['condor_q']
         user = os.environ['USER']
-        command.extend(['-autoformat', 'ClusterId', 'JobStatus', '-constraint', 'owner == "{}"'.format(user)])
+        command.extend(['-autoformat', 'ClusterId', 'ProcId', 'JobStatus', 'ExitCode', '-constraint', 'owner == "{}"'.format(user)])
         ## Define function for Listener
         def listen(results, interval = 1):
             import subprocess, time
             from collections import OrderedDict
-            job_ids = set()
+            ## Jobs which were seen in the queue and didn't leave it yet
+            queued_job_ids = set()
+            ## Finished jobs which were already reported
+            reported = set()
             while True:
-                result = subprocess.check_output(command, universal_newlines = True).rstrip('\n').split('\n')
-                unfinished_job_ids = set()
-                for res in result:
-                    if not res: continue
-                    job_id, state = res.split()
-                    print(job_id, state)
-                    job_ids.add(job_id)
-                    unfinished_job_ids.add(job_id)
-                ## Generate results dict
+                result = subprocess.check_output(command, universal_newlines = True)
+                entries = HTCondor._parse_query_output(result)
+                ## Jobs which left the queue since the previous query are looked up in the history in one go
+                left_job_ids = queued_job_ids - set(entries)
+                queued_job_ids = set(entries)
+                if left_job_ids:
+                    cluster_ids = sorted(set(job_id.split('.')[0] for job_id in left_job_ids))
+                    entries.update(HTCondor._query_jobs('condor_history', cluster_ids, left_job_ids))
                 res_dict = OrderedDict()
-                for job_id in job_ids:
-                    if job_id not in unfinished_job_ids:
-                        exitcode_cmd = ['condor_history', '-autoformat', 'ExitCode', '-constraint', 'ClusterId == {}'.format(job_id)]
-                        exitcode = subprocess.check_output(exitcode_cmd, universal_newlines = True).rstrip('\n')
-                        res_dict[int(job_id)] = {'status': Status.FINISHED, 'exitcode': int(exitcode)}
+                for job_id, entry in entries.items():
+                    if entry['finished'] in HTCondor._run_states or 'success' not in entry: continue
+                    if job_id in reported: continue
+                    reported.add(job_id)
+                    ## Job ids are reported as "<ClusterId>.<ProcId>", as returned by the submission
+                    res_dict[job_id] = {'status': Status.FINISHED, 'exitcode': entry['success']}
                 results.put(res_dict)
                 time.sleep(interval)
 
         return listen
+
+    @staticmethod
+    def _get_userlog_listen_func(log_dir):
+        ## Define function for Listener
+        def listen(results, interval = 1):
+            import time
+            ## Parsers of the job event logs in the log directory ({path: parser})
+            parsers = {}
+            ## Finished jobs which were already reported
+            reported = set()
+            ## Job event logs whose jobs all finished and were reported
+            done = set()
+            while True:
+                results.put(HTCondor._read_userlogs(log_dir, parsers, reported, done))
+                time.sleep(interval)
+
+        return listen
+
+    @staticmethod
+    def _read_userlogs(log_dir, parsers, reported, done):
+        from collections import OrderedDict
+        if os.path.isdir(log_dir):
+            for file_name in os.listdir(log_dir):
+                path = os.path.join(log_dir, file_name)
+                if not file_name.endswith('.log') or path in parsers or path in done: continue
+                parsers[path] = htcondor_userlog.UserLogParser(path)
+        res_dict = OrderedDict()
+        for path, parser in list(parsers.items()):
+            parser.update()
+            for job_id, entry in parser.jobs.items():
+                if entry['finished'] in HTCondor._run_states or 'success' not in entry: continue
+                if job_id in reported: continue
+                reported.add(job_id)
+                res_dict[job_id] = {'status': Status.FINISHED, 'exitcode': entry['success']}
+            ## The log isn't read anymore once all of its jobs were reported, which also releases their bookkeeping
+            if parser.is_finished():
+                del parsers[path]
+                reported.difference_update(parser.jobs)
+                done.add(path)
+
+        return res_dict
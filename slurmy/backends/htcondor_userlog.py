@@ -0,0 +1,131 @@
+
+## Incremental parser of the HTCondor job event log ("user log"), to track the job status without calling condor_history or condor_q
+
+import re
+import logging
+
+log = logging.getLogger('slurmy')
+
+## Event header, e.g. "005 (123.000.000) 03/14 15:09:26 Job terminated." or with ISO date "005 (123.000.000) 2024-03-14 15:09:26 Job terminated."
+_event_header = re.compile(r'^(\d{3}) \((\d+)\.(\d+)\.\d+\) ')
+_normal_termination = re.compile(r'\(1\) Normal termination \(return value (-?\d+)\)')
+_abnormal_termination = re.compile(r'\(0\) Abnormal termination \(signal (\d+)\)')
+## Event separator
+_event_end = '...'
+
+## Job states (JobStatus of the job ClassAd)
+IDLE = 1
+RUNNING = 2
+REMOVED = 3
+COMPLETED = 4
+HELD = 5
+
+## Job states set by the event codes
+_event_states = {
+    '000': IDLE,       # Job submitted
+    '001': RUNNING,    # Job executing
+    '004': IDLE,       # Job evicted
+    '005': COMPLETED,  # Job terminated
+    '009': REMOVED,    # Job aborted
+    '010': RUNNING,    # Job suspended
+    '011': RUNNING,    # Job unsuspended
+    '012': HELD,       # Job held
+    '013': IDLE,       # Job released
+}
+
+class UserLogParser(object):
+    """@SLURMY
+    Incremental parser of one HTCondor job event log. Each update only reads the part of the log which was written since the previous update, incomplete events at the end of the log are read again in the next update.
+
+    * `path` Path of the job event log.
+    """
+    def __init__(self, path):
+        self.path = path
+        ## Offset up to which the log was parsed
+        self._offset = 0
+        ## Job entries ({"<ClusterId>.<ProcId>": {'finished': int, 'success': str}})
+        self.jobs = {}
+
+    def update(self):
+        """@SLURMY
+        Parse the events which were written since the previous update.
+
+        Returns if the log could be read (bool).
+        """
+        try:
+            with open(self.path, 'rb') as in_file:
+                in_file.seek(self._offset)
+                data = in_file.read()
+        except (IOError, OSError):
+            return False
+        ## Only complete events (terminated by the separator line) are parsed, the offset is moved to the end of the last one
+        event = []
+        n_read = 0
+        ## The last element is an incomplete line (or empty)
+        for line in data.split(b'\n')[:-1]:
+            n_read += len(line) + 1
+            line = line.decode('utf-8', 'replace').rstrip('\r')
+            if line != _event_end:
+                event.append(line)
+                continue
+            self._parse_event(event)
+            self._offset += n_read
+            n_read = 0
+            event = []
+
+        return True
+
+    def is_finished(self):
+        """@SLURMY
+        Check if all jobs of the log are finished, i.e. no more events of interest are expected.
+
+        Returns if events of jobs were read and all of them finished (bool).
+        """
+
+        return bool(self.jobs) and all('success' in entry for entry in self.jobs.values())
+
+    def _parse_event(self, lines):
+        if not lines: return
+        match = _event_header.match(lines[0])
+        if match is None: return
+        code, cluster_id, proc_id = match.groups()
+        if code not in _event_states: return
+        job_id = '{}.{}'.format(int(cluster_id), int(proc_id))
+        entry = {'finished': _event_states[code]}
+        if code == '005':
+            entry['success'] = _get_return_value(lines[1:])
+        elif code in ('009', '012'):
+            ## Same convention as for condor_history: removed and held jobs without exitcode failed
+            entry['success'] = '1'
+        self.jobs[job_id] = entry
+
+def _get_return_value(lines):
+    for line in lines:
+        match = _normal_termination.search(line)
+        if match: return match.group(1)
+        match = _abnormal_termination.search(line)
+        ## Same convention as the shell, for jobs killed by a signal
+        if match: return str(128 + int(match.group(1)))
+
+    return '1'
+
+## Parsers of the logs which were read so far and still have unfinished jobs ({path: parser})
+_parsers = {}
+
+def get_job_entry(path, job_id):
+    """@SLURMY
+    Get the state and exitcode of a job from its job event log, reading only the new part of the log.
+
+    * `path` Path of the job event log.
+    * `job_id` Job id ("<ClusterId>.<ProcId>").
+
+    Returns the job entry ({'finished': int, 'success': str}), or None if the log can't be read or has no events of the job yet.
+    """
+    if not path: return None
+    if path not in _parsers: _parsers[path] = UserLogParser(path)
+    parser = _parsers[path]
+    if not parser.update(): return None
+    ## The parser is released once all jobs of the log finished, the log is parsed from the start if it is requested again
+    if parser.is_finished(): del _parsers[path]
+
+    return parser.jobs.get(job_id)
@@ -2,7 +2,9 @@
 import subprocess
 import os
 import shlex
+import time
 import logging
+from collections import OrderedDict
 from ..tools.defs import Status
 from .base import Base
 from .defs import bids
@@ -26,6 +28,7 @@ class Slurm(Base):
     * `exclude` Worker node(s) that should be excluded.
     * `clusters` Cluster(s) in which the slurm job is running.
     * `qos` Additional quality of service setting.
+    * `cpus` Number of CPUs for the slurm job.
     * `mem` Memory limit for the slurm job.
     * `time` Time limit for the slurm job.
     * `export` Environment exports that are propagated to the slurm job.
@@ -36,8 +39,19 @@ class Slurm(Base):
     _commands = ['sbatch', 'scancel', 'sacct']
     _successcode = '0:0'
     _run_states = set(['PENDING', 'RUNNING'])
+    _array_options = ['partition', 'exclude', 'clusters', 'qos', 'cpus', 'mem', 'time', 'export']
+    ## Default MaxArraySize of slurm is 1001, which allows for array indices up to 1000
+    _array_max = 1000
+    ## Maximum number of job ids queried with one sacct call
+    _sacct_max = 500
+    ## Maximum number of job ids cancelled with one scancel call
+    _scancel_max = 500
+    ## Cache of the sacct entries of the current status polling cycle ({job_id: sacct entry or None})
+    _status_cache = {}
+    ## Margin (in seconds) of the listener starttime
+    _starttime_margin = 300
 
-    def __init__(self, name = None, log = None, run_script = None, run_args = None, partition = None, exclude = None, clusters = None, qos = None, mem = None, time = None, export = None):
+    def __init__(self, name = None, log = None, run_script = None, run_args = None, partition = None, exclude = None, clusters = None, qos = None, mem = None, time = None, export = None, cpus = None):
         super(Slurm, self).__init__()
         ## Common backend options
         self.name = name
@@ -49,6 +63,7 @@ class Slurm(Base):
         self.clusters = clusters
         self.qos = qos
         self.exclude = exclude
+        self.cpus = cpus
         self.mem = mem
         self.time = time
         self.export = export
@@ -62,14 +77,75 @@ class Slurm(Base):
 
         Returns the job id (int).
         """
-        submit_list = self._get_submit_command()
+        submit_list = self.get_submit_command()
         log.debug('({}) Submit job with command {}'.format(self.name, submit_list))
         submit_string = subprocess.check_output(submit_list, universal_newlines = True)
-        job_id = int(submit_string.split(' ')[3].rstrip('\n'))
+
+        return self.parse_submit_output(submit_string)
+
+    def parse_submit_output(self, submit_string):
+        """@SLURMY
+        Parse the sbatch output and set the job id.
+
+        * `submit_string` Output of sbatch.
+
+        Returns the job id (int).
+        """
+        job_id = Slurm._parse_submit_output(submit_string)
         self._job_id = job_id
 
         return job_id
 
+    def get_array_key(self):
+        """@SLURMY
+        Get the key which identifies Slurm backends that can be submitted together as one array job. Besides the batch options, the batch options defined in the run_script have to match as well.
+
+        Returns the array key (tuple), or None if the jobs can't be submitted as array job.
+        """
+        key = super(Slurm, self).get_array_key()
+        ## Subclasses without array submission
+        if key is None: return None
+
+        return key + tuple(self._get_script_options())
+
+    @staticmethod
+    def submit_array(backends, name):
+        """@SLURMY
+        Submit several jobs as one slurm array job. All backends must have the same array key (see Slurm.get_array_key). Each array task executes the run_script of the respective backend and writes its output to the respective log file.
+
+        * `backends` List of Slurm backends of the jobs.
+        * `name` Name of the array job.
+
+        Returns the list of job ids, one per backend ([str]).
+        """
+        if len(backends) > Slurm._array_max:
+            log.error('Cannot submit {} jobs in one array job, the maximum is {}'.format(len(backends), Slurm._array_max))
+            raise Exception
+        reference = backends[0]
+        ## Write the array script, which dispatches the array tasks to the run_scripts of the jobs
+        array_script = os.path.join(os.path.dirname(reference.run_script), '{}.array'.format(reference.name))
+        with open(array_script, 'w') as out_file:
+            out_file.write(Slurm._get_array_script(backends))
+        ## Slurm messages which don't end up in the job logs are written to an array log file
+        array_log = os.path.join(os.path.dirname(reference.log), '{}.array.%A_%a'.format(reference.name))
+        submit_command = 'sbatch -J {} -o {} --array=0-{} '.format(name, array_log, len(backends)-1)
+        submit_command += reference._get_batch_options()
+        submit_command += array_script
+        ## Wrap command
+        submit_command = Base._get_command(submit_command, Slurm.bid)
+        ## Split command string with shlex in a Popen digestable way
+        submit_list = shlex.split(submit_command)
+        log.debug('Submit array job "{}" of {} jobs with command {}'.format(name, len(backends), submit_list))
+        submit_string = subprocess.check_output(submit_list, universal_newlines = True)
+        array_id = Slurm._parse_submit_output(submit_string)
+        job_ids = []
+        for task_id, backend in enumerate(backends):
+            job_id = '{}_{}'.format(array_id, task_id)
+            backend._job_id = job_id
+            job_ids.append(job_id)
+
+        return job_ids
+
     def cancel(self):
         """@SLURMY
         Cancel the slurm job.
@@ -80,13 +156,41 @@ class Slurm(Base):
         cancel_command = Base._get_command(cancel_command, Slurm.bid)
         os.system(cancel_command)
 
+    @staticmethod
+    def cancel_jobs(backends):
+        """@SLURMY
+        Cancel the slurm jobs of the given backends in bulk, with one scancel call per chunk of job ids.
+
+        * `backends` List of Slurm backends of the running jobs.
+        """
+        ## Group job ids by clusters, since this is an option of the scancel call
+        job_ids = OrderedDict()
+        for backend in backends:
+            if backend._job_id is None: continue
+            if backend.clusters not in job_ids: job_ids[backend.clusters] = []
+            job_ids[backend.clusters].append(backend._job_id)
+        for clusters, key_job_ids in job_ids.items():
+            for i in range(0, len(key_job_ids), Slurm._scancel_max):
+                chunk = key_job_ids[i:i+Slurm._scancel_max]
+                cancel_command = 'scancel '
+                if clusters: cancel_command += '-M {} '.format(clusters)
+                cancel_command += ' '.join([str(job_id) for job_id in chunk])
+                ## Wrap command
+                cancel_command = Base._get_command(cancel_command, Slurm.bid)
+                log.debug('Cancel {} jobs'.format(len(chunk)))
+                subprocess.call(shlex.split(cancel_command))
+
     def status(self):
         """@SLURMY
         Get the status of slurm job from sacct entry.
 
         Returns the job status (Status).
         """
-        sacct_return = self._get_sacct_entry('Job,State,ExitCode')
+        ## Take the sacct entry from the status cache of the current polling cycle, if the job id was queried
+        if self._job_id in Slurm._status_cache:
+            sacct_return = Slurm._status_cache[self._job_id]
+        else:
+            sacct_return = self._get_sacct_entry('Job,State,ExitCode')
         status = Status.RUNNING
         if sacct_return is not None:
             job_state = sacct_return['finished']
@@ -97,6 +201,62 @@ class Slurm(Base):
 
         return status
 
+    @staticmethod
+    def update_status_cache(backends):
+        """@SLURMY
+        Query the sacct entries of all given Slurm backends in bulk (one sacct call per chunk of job ids) and cache them for the current status polling cycle. Slurm.status() and Slurm.exitcode() are served from the cache for all job ids that were queried. Calling it with an empty list clears the cache.
+
+        * `backends` List of Slurm backends of the running jobs.
+        """
+        queries = Slurm.get_status_queries(backends)
+        outputs = []
+        for sacct_command, chunk in queries:
+            log.debug('Query sacct entries of {} jobs'.format(len(chunk)))
+            outputs.append(subprocess.check_output(sacct_command, universal_newlines = True))
+        Slurm.set_status_cache(queries, outputs)
+
+    @staticmethod
+    def get_status_queries(backends):
+        """@SLURMY
+        Get the sacct commands of the bulk status query of the given Slurm backends, one per chunk of job ids (see update_status_cache).
+
+        * `backends` List of Slurm backends of the running jobs.
+
+        Returns list of queries as tuples of sacct command and the job ids it queries ([(list, list)]).
+        """
+        queries = []
+        ## Group job ids by partition and clusters, since these are options of the sacct call
+        job_ids = OrderedDict()
+        for backend in backends:
+            if backend._job_id is None: continue
+            key = (backend.partition, backend.clusters)
+            if key not in job_ids: job_ids[key] = []
+            job_ids[key].append(backend._job_id)
+        for (partition, clusters), key_job_ids in job_ids.items():
+            for i in range(0, len(key_job_ids), Slurm._sacct_max):
+                chunk = key_job_ids[i:i+Slurm._sacct_max]
+                job_id_string = ','.join([str(job_id) for job_id in chunk])
+                sacct_command = Slurm._get_sacct_command('JobID,State,ExitCode', job_id = job_id_string, partition = partition, clusters = clusters)
+                queries.append((sacct_command, chunk))
+
+        return queries
+
+    @staticmethod
+    def set_status_cache(queries, outputs):
+        """@SLURMY
+        Fill the status cache from the outputs of the sacct commands of the bulk status query.
+
+        * `queries` List of queries (see get_status_queries).
+        * `outputs` List of sacct outputs, in the same order.
+        """
+        status_cache = {}
+        for (sacct_command, chunk), sacct_output in zip(queries, outputs):
+            ## Job ids without sacct entry are cached as well, since sacct was already asked for them
+            for job_id in chunk:
+                status_cache[job_id] = None
+            status_cache.update(Slurm._parse_sacct_output(sacct_output.rstrip('\n').split('\n')))
+        Slurm._status_cache = status_cache
+
     def exitcode(self):
         """@SLURMY
         Get the exitcode of slurm job from sacct entry. Evaluation is actually done by Slurm.status(), Slurm.exitcode() only returns the value. If exitcode at this stage is None, execute Slurm.status() beforehand.
@@ -109,26 +269,18 @@ class Slurm(Base):
 
         return self._exitcode
 
-    def _get_submit_command(self):
+    def get_submit_command(self):
+        """@SLURMY
+        Get the sbatch command of the job.
+
+        Returns the command (list).
+        """
         submit_command = 'sbatch '
         if self.name: submit_command += '-J {} '.format(self.name)
         if self.log: submit_command += '-o {} '.format(self.log)
-        if self.partition: submit_command += '-p {} '.format(self.partition)
-        if self.exclude: submit_command += '-x {} '.format(self.exclude)
-        if self.clusters: submit_command += '-M {} '.format(self.clusters)
-        if self.qos: submit_command += '--qos={} '.format(self.qos)
-        if self.mem: submit_command += '--mem={} '.format(self.mem)
-        if self.time: submit_command += '--time={} '.format(self.time)
-        if self.export: submit_command += '--export={} '.format(self.export)
-        ## Add run_script setup through wrapper
-        run_script = self.wrapper.get(self.run_script)
-        submit_command += '{} '.format(run_script)
-        ## Add run_args
-        if self.run_args:
-            if isinstance(self.run_args, str):
-                submit_command += self.run_args
-            else:
-                submit_command += ' '.join(self.run_args)
+        submit_command += self._get_batch_options()
+        ## Add run_script setup through wrapper, together with the run_args
+        submit_command += self._get_run_command()
         ## Wrap command
         submit_command = Base._get_command(submit_command, Slurm.bid)
         ## Split command string with shlex in a Popen digestable way
@@ -136,6 +288,63 @@ class Slurm(Base):
 
         return submit_command
 
+    def _get_batch_options(self):
+        batch_options = ''
+        if self.partition: batch_options += '-p {} '.format(self.partition)
+        if self.exclude: batch_options += '-x {} '.format(self.exclude)
+        if self.clusters: batch_options += '-M {} '.format(self.clusters)
+        if self.qos: batch_options += '--qos={} '.format(self.qos)
+        if self.cpus: batch_options += '--cpus-per-task={} '.format(self.cpus)
+        if self.mem: batch_options += '--mem={} '.format(self.mem)
+        if self.time: batch_options += '--time={} '.format(self.time)
+        if self.export: batch_options += '--export={} '.format(self.export)
+
+        return batch_options
+
+    def _get_run_command(self):
+        ## Get run_script setup through wrapper
+        run_command = '{} '.format(self.wrapper.get(self.run_script))
+        ## Add run_args
+        if self.run_args:
+            if isinstance(self.run_args, str):
+                run_command += self.run_args
+            else:
+                run_command += ' '.join(self.run_args)
+
+        return run_command
+
+    def _get_script_options(self):
+        identifier = '#{}'.format(self._script_options_identifier)
+        with open(self.run_script, 'r') as in_file:
+            script_options = [line.strip() for line in in_file if line.startswith(identifier)]
+
+        return script_options
+
+    @staticmethod
+    def _get_array_script(backends):
+        ## Batch options defined in the run_scripts are identical for all backends, take them from the first one
+        array_script = '#!/bin/bash\n'
+        for script_option in backends[0]._get_script_options():
+            array_script += '{}\n'.format(script_option)
+        array_script += 'case $SLURM_ARRAY_TASK_ID in\n'
+        for task_id, backend in enumerate(backends):
+            array_script += '  {}) exec {} > {} 2>&1 ;;\n'.format(task_id, backend._get_run_command().rstrip(), backend.log)
+        array_script += 'esac\n'
+
+        return array_script
+
+    @staticmethod
+    def _parse_submit_output(submit_string):
+        return int(submit_string.split(' ')[3].rstrip('\n'))
+
+    @staticmethod
+    def _parse_job_id(job_string):
+        ## Job ids of array tasks ("<array id>_<task id>") are kept as strings
+        if job_string.isdigit():
+            return int(job_string)
+
+        return job_string
+
     def _get_sacct_entry(self, column):
         sacct_command = Slurm._get_sacct_command(column, job_id = self._job_id, partition = self.partition, clusters = self.clusters)
         sacct_output = subprocess.check_output(sacct_command, universal_newlines = True).rstrip('\n').split('\n')
@@ -154,12 +363,25 @@ class Slurm(Base):
         return sacct_return
 
     @staticmethod
-    def _get_sacct_command(column, job_id = None, user = None, partition = None, clusters = None):
+    def _parse_sacct_output(sacct_output):
+        sacct_returns = {}
+        for entry in sacct_output[1:]:
+            if not entry: continue
+            job_string, state, exitcode = entry.split('|')
+            ## Skip job step entries (e.g. ".batch") and array tasks which are still pending and are reported together ("<array id>_[<task ids>]")
+            if '.' in job_string or '[' in job_string: continue
+            sacct_returns[Slurm._parse_job_id(job_string)] = {'finished': state, 'success': exitcode}
+
+        return sacct_returns
+
+    @staticmethod
+    def _get_sacct_command(column, job_id = None, user = None, partition = None, clusters = None, starttime = None):
         sacct_command = 'sacct '
         if partition: sacct_command += '-r {} '.format(partition)
         if clusters: sacct_command += '-M {} '.format(clusters)
         if job_id: sacct_command += '-j {} '.format(job_id)
         if user: sacct_command += '-u {} '.format(user)
+        if starttime: sacct_command += '-S {} '.format(time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(starttime)))
         sacct_command += '-P -o {}'.format(column)
         ## Wrap command
         sacct_command = Base._get_command(sacct_command, Slurm.bid)
@@ -169,32 +391,45 @@ class Slurm(Base):
         return sacct_command
 
     @staticmethod
-    def get_listen_func(partition = None, clusters = None):
+    def get_listen_func(partition = None, clusters = None, starttime = None, names = None, log_dir = None):
+        """@SLURMY
+        Listener function, will be added to listener instance. The sacct query is restricted to the submission window of the session and only state transitions to finished jobs since the previous query are put into the results.
+
+        * `partition` Partition for which sacct entries are queried.
+        * `clusters` Cluster(s) for which sacct entries are queried.
+        * `starttime` Timestamp of the earliest job submission of the session, which is still relevant.
+        * `names` Set of job names to consider, jobs with other names are ignored.
+        * `log_dir` Log directory of the session (not used).
+
+        Returns listen function.
+        """
         user = options.Main.user
-        command = Slurm._get_sacct_command('JobID,State,ExitCode', user = user, partition = partition, clusters = clusters)
+        ## Allow for a margin to be robust against clock differences to the slurm controller
+        if starttime is not None:
+            starttime -= Slurm._starttime_margin
+        command = Slurm._get_sacct_command('JobID,JobName,State,ExitCode', user = user, partition = partition, clusters = clusters, starttime = starttime)
         ## Define function for Listener
         def listen(results, interval = 1):
             import subprocess, time
             from collections import OrderedDict
+            ## Finished job states which were already reported ({job_id: (state, exitcode)})
+            reported = {}
             while True:
                 result = subprocess.check_output(command, universal_newlines = True).rstrip('\n').split('\n')
-                return_states = {}
-                return_exitcodes = {}
-                job_ids = set()
+                res_dict = OrderedDict()
                 ## Evaluate sacct return values
                 for res in result[1:]:
-                    job_id, state, exitcode = res.split('|')
-                    ## Skip the .batch entries if any exist
-                    if '.batch' in job_id: continue
-                    job_id = int(job_id)
-                    job_ids.add(job_id)
-                    return_states[job_id] = state
-                    return_exitcodes[job_id] = exitcode
-                ## Generate results dict
-                res_dict = OrderedDict()
-                for job_id in job_ids:
-                    if return_states[job_id] in Slurm._run_states: continue
-                    exitcode = return_exitcodes[job_id]
+                    if not res: continue
+                    job_id, job_name, state, exitcode = res.split('|')
+                    ## Skip job step entries (e.g. ".batch") and array tasks which are still pending and are reported together ("<array id>_[<task ids>]")
+                    if '.' in job_id or '[' in job_id: continue
+                    ## Skip jobs which don't belong to the session
+                    if names is not None and job_name not in names: continue
+                    if state in Slurm._run_states: continue
+                    job_id = Slurm._parse_job_id(job_id)
+                    ## Only report state transitions since the previous query
+                    if reported.get(job_id) == (state, exitcode): continue
+                    reported[job_id] = (state, exitcode)
                     res_dict[job_id] = {'status': Status.FINISHED, 'exitcode': exitcode}
                 results.put(res_dict)
                 time.sleep(interval)
@@ -0,0 +1,447 @@
+
+import os
+import re
+import time
+import json
+import socket
+import threading
+import logging
+from collections import OrderedDict
+try:
+    import http.client as http_client
+except ImportError:
+    import httplib as http_client
+from ..tools.defs import Status
+from .slurm import Slurm
+from .defs import bids
+from ..tools import options
+from ..tools.utils import parse_mem
+
+log = logging.getLogger('slurmy')
+
+
+class SlurmRest(Slurm):
+    """@SLURMY
+    Slurm backend class which talks to slurmrestd instead of forking sbatch, scancel and sacct. Inherits from the Slurm backend class. The connections to slurmrestd are kept open and shared by all jobs (one connection per thread).
+
+    * `name` Name of the parent job.
+    * `log` Log file written by slurm.
+    * `run_script` The script that is executed on the worker node.
+    * `run_args` Run arguments that are passed to the run_script.
+
+    Slurm batch submission arguments (see slurm documentation):
+
+    * `partition` Partition on which the slurm job is running.
+    * `exclude` Worker node(s) that should be excluded.
+    * `clusters` Not supported by slurmrestd, use a slurmrestd of the respective cluster instead.
+    * `qos` Additional quality of service setting.
+    * `mem` Memory limit for the slurm job.
+    * `time` Time limit for the slurm job, in minutes or in one of the other formats of sbatch ("MM:SS", "HH:MM:SS", "D-HH", "D-HH:MM", "D-HH:MM:SS").
+    * `export` Environment exports that are propagated to the slurm job ("ALL", "NONE", or comma separated list of variables).
+    * `cpus` Number of CPUs for the slurm job.
+
+    slurmrestd arguments:
+
+    * `url` URL of slurmrestd, either "unix:///path/to/socket" or "http(s)://host:port". If None, the SLURMRESTD_URL environment variable is used.
+    * `api_version` Version of the slurmrestd API (v0.0.40 or newer).
+
+    For TCP connections the token in the SLURM_JWT environment variable is used for the authentication. The url can also be set in the slurmy options file (e.g. "SlurmRest.url = unix:///run/slurmrestd.socket"), which is also the url used by the listener.
+    """
+
+    bid = bids['SLURMREST']
+    _commands = []
+    ## Jobs are always submitted individually via the persistent connection, so that each submission is rate limited, i.e. no array jobs
+    _array_options = None
+    ## Cache of the job entries of the current status polling cycle ({job_id: job entry or None})
+    _status_cache = {}
+    _default_url = 'unix:///run/slurmrestd/slurmrestd.socket'
+    _default_api_version = 'v0.0.40'
+
+    def __init__(self, name = None, log = None, run_script = None, run_args = None, partition = None, exclude = None, clusters = None, qos = None, mem = None, time = None, export = None, cpus = None, url = None, api_version = None):
+        super(SlurmRest, self).__init__(name = name, log = log, run_script = run_script, run_args = run_args, partition = partition, exclude = exclude, clusters = clusters, qos = qos, mem = mem, time = time, export = export, cpus = cpus)
+        ## slurmrestd options
+        self.url = url
+        self.api_version = api_version
+
+    def _get_client(self):
+        return _get_client(self.url, self.api_version)
+
+    def submit(self):
+        """@SLURMY
+        Submit the job via slurmrestd.
+
+        Returns the job id (int).
+        """
+        if self.clusters:
+            log.warning('({}) Clusters option is not supported by the SlurmRest backend, ignoring it'.format(self.name))
+        client = self._get_client()
+        log.debug('({}) Submit job via slurmrestd'.format(self.name))
+        result = client.request('POST', client.get_path('slurm', 'job/submit'), self._get_submit_payload())
+        job_id = int(result['job_id'])
+        self._job_id = job_id
+
+        return job_id
+
+    def get_submit_command(self):
+        ## Submission is done via http, not with a command
+        return None
+
+    def _get_submit_payload(self):
+        job = OrderedDict()
+        job['name'] = self.name
+        job['current_working_directory'] = os.getcwd()
+        job['environment'] = self._get_environment()
+        if self.log:
+            job['standard_output'] = self.log
+            job['standard_error'] = self.log
+        if self.partition: job['partition'] = self.partition
+        if self.exclude: job['excluded_nodes'] = self.exclude.split(',')
+        if self.qos: job['qos'] = self.qos
+        if self.cpus: job['cpus_per_task'] = int(self.cpus)
+        mem = parse_mem(self.mem)
+        if mem is not None: job['memory_per_node'] = {'set': True, 'number': int(mem)}
+        if self.time: job['time_limit'] = {'set': True, 'number': _get_minutes(self.time)}
+
+        return {'script': self._get_rest_script(), 'job': job}
+
+    def _get_rest_script(self):
+        ## The batch options of the run_script are propagated, the run_script is executed in the same way as with sbatch
+        script = '#!/bin/bash\n'
+        for script_option in self._get_script_options():
+            script += '{}\n'.format(script_option)
+        script += 'exec {}\n'.format(self._get_run_command().rstrip())
+
+        return script
+
+    def _get_environment(self):
+        export = self.export or 'ALL'
+        if export == 'NONE':
+            return ['SLURM_EXPORT_ENV=NONE']
+        environment = dict(os.environ)
+        if export != 'ALL':
+            variables = export.split(',')
+            ## Same semantics as sbatch: ALL can be part of the list, otherwise only the listed variables are exported
+            if 'ALL' not in variables: environment = {}
+            for variable in variables:
+                if variable == 'ALL': continue
+                if '=' in variable:
+                    key, val = variable.split('=', 1)
+                    environment[key] = val
+                elif variable in os.environ:
+                    environment[variable] = os.environ[variable]
+
+        return ['{}={}'.format(key, val) for key, val in sorted(environment.items())]
+
+    def cancel(self):
+        """@SLURMY
+        Cancel the slurm job via slurmrestd.
+        """
+        log.debug('({}) Cancel job'.format(self.name))
+        client = self._get_client()
+        client.request('DELETE', client.get_path('slurm', 'job/{}'.format(self._job_id)))
+
+    @staticmethod
+    def cancel_jobs(backends):
+        ## Jobs are cancelled individually via the persistent connection
+        for backend in backends:
+            backend.cancel()
+
+    def status(self):
+        """@SLURMY
+        Get the status of slurm job from slurmrestd.
+
+        Returns the job status (Status).
+        """
+        ## Take the job entry from the status cache of the current polling cycle, if the job id was queried
+        if self._job_id in SlurmRest._status_cache:
+            entry = SlurmRest._status_cache[self._job_id]
+        else:
+            entry = self._get_client().get_job(self._job_id)
+        status = Status.RUNNING
+        if entry is not None:
+            if entry['finished'] not in Slurm._run_states:
+                status = Status.FINISHED
+                self._exitcode = entry['success']
+
+        return status
+
+    @staticmethod
+    def update_status_cache(backends):
+        """@SLURMY
+        Query the job entries of all given SlurmRest backends in bulk (one request per slurmrestd) and cache them for the current status polling cycle. Calling it with an empty list clears the cache.
+
+        * `backends` List of SlurmRest backends of the running jobs.
+        """
+        status_cache = {}
+        job_ids = OrderedDict()
+        for backend in backends:
+            if backend._job_id is None: continue
+            key = (backend.url, backend.api_version)
+            if key not in job_ids: job_ids[key] = []
+            job_ids[key].append(backend._job_id)
+        for (url, api_version), key_job_ids in job_ids.items():
+            ## Job ids without entry are cached as well, since slurmrestd was already asked for them
+            for job_id in key_job_ids:
+                status_cache[job_id] = None
+            log.debug('Query slurmrestd entries of {} jobs'.format(len(key_job_ids)))
+            status_cache.update(_get_client(url, api_version).get_jobs(key_job_ids))
+        SlurmRest._status_cache = status_cache
+
+    @staticmethod
+    def get_status_queries(backends):
+        ## Status is queried via http, not with commands
+        return []
+
+    @staticmethod
+    def get_listen_func(starttime = None, names = None, log_dir = None):
+        """@SLURMY
+        Listener function, will be added to listener instance. Polls the jobs known to the slurm controller via slurmrestd (with the url of the slurmy options file) and only puts state transitions to finished jobs since the previous query into the results.
+
+        * `starttime` Timestamp of the earliest job submission of the session, which is still relevant (not used, the slurm controller only knows recent jobs).
+        * `names` Set of job names to consider, jobs with other names are ignored.
+        * `log_dir` Log directory of the session (not used).
+
+        Returns listen function.
+        """
+        def listen(results, interval = 1):
+            import time
+            from collections import OrderedDict
+            ## Own connection of the listener process
+            client = _RestClient(_get_url(None), _get_api_version(None))
+            ## Finished job states which were already reported ({job_id: (state, exitcode)})
+            reported = {}
+            while True:
+                res_dict = OrderedDict()
+                for job_id, entry in client.get_jobs(names = names).items():
+                    state, exitcode = entry['finished'], entry['success']
+                    if state in Slurm._run_states: continue
+                    ## Only report state transitions since the previous query
+                    if reported.get(job_id) == (state, exitcode): continue
+                    reported[job_id] = (state, exitcode)
+                    res_dict[job_id] = {'status': Status.FINISHED, 'exitcode': exitcode}
+                results.put(res_dict)
+                time.sleep(interval)
+
+        return listen
+
+## Time formats of sbatch, in which the days and the last field are optional ([D-]HH[:MM[:SS]] or MM[:SS])
+_time_expression = re.compile(r'^(?:(\d+)-)?(\d+)(?::(\d+))?(?::(\d+))?$')
+
+def _get_minutes(time_limit):
+    ## Time limit in minutes, seconds are rounded up as done by slurm
+    match = _time_expression.match(str(time_limit).strip())
+    if match is None:
+        log.error('Time limit "{}" is not in one of the formats of sbatch'.format(time_limit))
+        raise Exception
+    days, first, second, third = match.groups()
+    if days is not None:
+        ## With days, the fields are hours, minutes, and seconds
+        seconds = int(days)*86400 + int(first)*3600 + int(second or 0)*60 + int(third or 0)
+    elif third is not None:
+        seconds = int(first)*3600 + int(second)*60 + int(third)
+    else:
+        seconds = int(first)*60 + int(second or 0)
+
+    return (seconds + 59) // 60
+
+def _get_url(url):
+    if url: return url
+    url = options.Main._backend_options.get(bids['SLURMREST'], {}).get('url')
+
+    return url or os.environ.get('SLURMRESTD_URL') or SlurmRest._default_url
+
+def _get_api_version(api_version):
+    if api_version: return api_version
+    api_version = options.Main._backend_options.get(bids['SLURMREST'], {}).get('api_version')
+
+    return api_version or SlurmRest._default_api_version
+
+## Clients shared by all backends ({(url, api_version): client})
+_clients = {}
+_clients_lock = threading.Lock()
+
+def _get_client(url, api_version):
+    key = (_get_url(url), _get_api_version(api_version))
+    with _clients_lock:
+        if key not in _clients: _clients[key] = _RestClient(*key)
+
+    return _clients[key]
+
+class _UnixHTTPConnection(http_client.HTTPConnection):
+    def __init__(self, path, timeout = None):
+        http_client.HTTPConnection.__init__(self, 'localhost', timeout = timeout)
+        self._path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self._path)
+        self.sock = sock
+
+class _RestClient(object):
+    """@SLURMY
+    Client of slurmrestd with persistent connections, one per thread.
+
+    * `url` URL of slurmrestd, either "unix:///path/to/socket" or "http(s)://host:port".
+    * `api_version` Version of the slurmrestd API.
+    """
+    _timeout = 60
+    ## Requests which can be sent again if the response got lost
+    _idempotent_methods = set(['GET'])
+    ## Idle time (in seconds) after which the connection is renewed before sending other requests, since slurmrestd might have closed it already
+    _keepalive = 5.
+
+    def __init__(self, url, api_version):
+        self.url = url
+        self.api_version = api_version
+        self._local = threading.local()
+
+    def _connect(self):
+        if self.url.startswith('unix://'):
+            return _UnixHTTPConnection(self.url[len('unix://'):], timeout = self._timeout)
+        if self.url.startswith('https://'):
+            return http_client.HTTPSConnection(self.url[len('https://'):].rstrip('/'), timeout = self._timeout)
+        if self.url.startswith('http://'):
+            return http_client.HTTPConnection(self.url[len('http://'):].rstrip('/'), timeout = self._timeout)
+        log.error('Unknown slurmrestd url "{}"'.format(self.url))
+        raise Exception
+
+    def _get_headers(self):
+        headers = {'Accept': 'application/json', 'Content-Type': 'application/json'}
+        ## The unix socket is authenticated by the socket credentials
+        if not self.url.startswith('unix://'):
+            headers['X-SLURM-USER-NAME'] = options.Main.user
+            token = os.environ.get('SLURM_JWT')
+            if token: headers['X-SLURM-USER-TOKEN'] = token
+
+        return headers
+
+    def get_path(self, plugin, endpoint):
+        """@SLURMY
+        Returns the request path of an endpoint of the slurm or slurmdb plugin (str).
+        """
+        return '/{}/{}/{}'.format(plugin, self.api_version, endpoint)
+
+    def request(self, method, path, payload = None):
+        """@SLURMY
+        Send a request to slurmrestd, reconnecting once if the persistent connection was closed. Requests which are not idempotent (e.g. submissions) are only sent again if they didn't go out, so that they are never processed twice.
+
+        * `method` HTTP method.
+        * `path` Request path.
+        * `payload` Payload which is sent as json.
+
+        Returns the decoded response (dict).
+        """
+        body = None
+        if payload is not None: body = json.dumps(payload).encode('utf-8')
+        idempotent = method in self._idempotent_methods
+        for attempt in range(2):
+            connection = getattr(self._local, 'connection', None)
+            ## Don't risk that a request which can't be repeated is sent over a connection that was closed by slurmrestd
+            if connection is not None and not idempotent and time.time() - self._local.last_used > self._keepalive:
+                connection.close()
+                connection = None
+            if connection is None:
+                connection = self._connect()
+                self._local.connection = connection
+                self._local.last_used = time.time()
+            sent = False
+            try:
+                connection.request(method, path, body, self._get_headers())
+                sent = True
+                response = connection.getresponse()
+                data = response.read()
+                self._local.last_used = time.time()
+                break
+            except (http_client.HTTPException, socket.error):
+                connection.close()
+                self._local.connection = None
+                if attempt or (sent and not idempotent): raise
+        result = {}
+        if data:
+            try:
+                result = json.loads(data.decode('utf-8'))
+            except ValueError:
+                result = {}
+        errors = [error for error in result.get('errors', []) if error.get('error_number', 1) != 0]
+        if response.status >= 400 or errors:
+            ## Unknown jobs are not an error for the status evaluation
+            if response.status == 404: return result
+            log.error('slurmrestd request {} {} failed with status {}: {}'.format(method, path, response.status, errors or data))
+            raise Exception
+
+        return result
+
+    def get_jobs(self, job_ids = None, names = None):
+        """@SLURMY
+        Get the state and exitcode of jobs from the slurm controller. Jobs which are not known to the controller anymore are looked up in the slurm database.
+
+        * `job_ids` Job ids to get. If None, all jobs known to the controller are returned.
+        * `names` Set of job names to consider, jobs with other names are ignored.
+
+        Returns the state and exitcode per job id ({int: {'finished': str, 'success': str}}).
+        """
+        entries = {}
+        result = self.request('GET', self.get_path('slurm', 'jobs'))
+        for job in result.get('jobs', []):
+            if names is not None and job.get('name') not in names: continue
+            entries[int(job['job_id'])] = _get_entry(job)
+        if job_ids is None: return entries
+        entries = dict((job_id, entries[job_id]) for job_id in job_ids if job_id in entries)
+        for job_id in job_ids:
+            if job_id in entries: continue
+            entry = self._get_db_job(job_id)
+            if entry is not None: entries[job_id] = entry
+
+        return entries
+
+    def get_job(self, job_id):
+        """@SLURMY
+        Get the state and exitcode of a single job from the slurm controller, or from the slurm database if the controller doesn't know the job anymore.
+
+        * `job_id` Job id.
+
+        Returns the state and exitcode ({'finished': str, 'success': str}), or None if the job is unknown.
+        """
+        result = self.request('GET', self.get_path('slurm', 'job/{}'.format(job_id)))
+        for job in result.get('jobs', []):
+            if int(job['job_id']) == job_id: return _get_entry(job)
+
+        return self._get_db_job(job_id)
+
+    def _get_db_job(self, job_id):
+        result = self.request('GET', self.get_path('slurmdb', 'job/{}'.format(job_id)))
+        for job in result.get('jobs', []):
+            if int(job['job_id']) != job_id: continue
+            return {'finished': _get_state(job.get('state', {}).get('current')), 'success': _get_exitcode(job.get('exit_code'))}
+
+        return None
+
+def _get_entry(job):
+    return {'finished': _get_state(job.get('job_state')), 'success': _get_exitcode(job.get('exit_code'))}
+
+def _get_state(state):
+    ## Newer API versions report a list of state flags, the base state comes first
+    if isinstance(state, list):
+        state = state[0] if state else None
+
+    return state
+
+def _get_number(value):
+    if isinstance(value, dict):
+        if not value.get('set', True): return 0
+        value = value.get('number', 0)
+    if isinstance(value, dict):
+        value = value.get('number', 0)
+
+    return int(value or 0)
+
+def _get_exitcode(exit_code):
+    ## Exitcode in the same "<return code>:<signal>" format as sacct
+    if exit_code is None: return None
+    if not isinstance(exit_code, dict):
+        return '{}:0'.format(_get_number(exit_code))
+    signal = exit_code.get('signal', {})
+    signal_id = signal.get('id', 0) if isinstance(signal, dict) else signal
+
+    return '{}:{}'.format(_get_number(exit_code.get('return_code')), _get_number(signal_id))
@@ -10,8 +10,12 @@ backend_list = set([l[1] for l in bids.items() if l[0] != 'BASE'])
 def get_backend_class(bid):
     from .slurm import Slurm
     from .htcondor import HTCondor
+    from .slurmrest import SlurmRest
+    from .fake import Fake
     if bid == bids['SLURM']: return Slurm
     elif bid == bids['HTCONDOR']: return HTCondor
+    elif bid == bids['SLURMREST']: return SlurmRest
+    elif bid == bids['FAKE']: return Fake
     else:
         log.error('Unknown backend bid "{}"'.format(bid))
         return None
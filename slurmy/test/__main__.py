@@ -33,12 +33,19 @@ test_dict = {}
 get_test_names(discover_list, test_dict)
 
 
+## The benchmarks have their own options
+if '--bench' in sys.argv[1:]:
+    from .benchmark import main
+    main([arg for arg in sys.argv[1:] if arg != '--bench'])
+    sys.exit(0)
+
 parser = argparse.ArgumentParser(description = 'Run the slurmy unittests')
 parser.add_argument('tests', nargs = '*', help = 'Only run given tests')
 parser.add_argument('--log', help = 'Logging level')
 parser.add_argument('-l', '--list', dest = 'list', help = 'List test modules and methods', action = 'store_true')
 parser.add_argument('-q', help = 'Set test verbosity to 1 (default 2)', action = 'store_true', default = False)
 parser.add_argument('-d', help = 'Switch to run tests in docker mode', action = 'store_true', default = False)
+parser.add_argument('--bench', help = 'Run the benchmarks instead of the unittests (see "--bench -h" for their options)', action = 'store_true', default = False)
 args = parser.parse_args()
 
 if args.log:
@@ -0,0 +1,231 @@
+
+## Benchmarks of the JobHandler overhead. Run with "python -m slurmy.test --bench" (or "python -m slurmy.test.benchmark").
+## The default run (1k and 10k jobs) takes about two minutes. Sessions with 100k jobs ("-n 100000") take considerably longer, single add_job calls are only measured up to "--single-max" jobs, since they grow faster than linear (about 30s for 10k jobs).
+
+import argparse
+import os
+import shutil
+import time
+import json
+import platform
+import logging
+from ..tools import options
+
+log = logging.getLogger('slurmy')
+
+
+def _get_jobhandler(name, work_dir, backend = None, **kwargs):
+    from slurmy import JobHandler, Slurm, test_mode
+    ## Test mode turns off the backend command checks, jobs are only submitted with the simulated Fake backend
+    test_mode(True)
+    jh = JobHandler(name = name, work_dir = work_dir, backend = backend or Slurm(), verbosity = 0, printer_bar_mode = False, **kwargs)
+
+    return jh
+
+def _get_job_definitions(n_jobs, topology, depth = 100):
+    """Get the job definitions (see JobHandler.add_jobs) of n_jobs jobs with the given dependency topology: "flat" without dependencies, "chain" with depth levels that each depend on the previous level, "fanout" with one root job, on which all other jobs depend, and one sink job, which depends on all of them."""
+    run_script = 'echo "bench"'
+    if topology == 'flat':
+        return [{'run_script': run_script} for i in range(n_jobs)]
+    elif topology == 'chain':
+        definitions = []
+        for i in range(n_jobs):
+            level = i * depth // n_jobs
+            definition = {'run_script': run_script, 'tags': 'level_{}'.format(level)}
+            if level > 0: definition['parent_tags'] = 'level_{}'.format(level-1)
+            definitions.append(definition)
+        return definitions
+    elif topology == 'fanout':
+        definitions = [{'run_script': run_script, 'tags': 'root'}]
+        definitions += [{'run_script': run_script, 'tags': 'leaf', 'parent_tags': 'root'} for i in range(n_jobs-2)]
+        definitions.append({'run_script': run_script, 'parent_tags': 'leaf'})
+        return definitions
+    log.error('Unknown topology "{}"'.format(topology))
+    raise Exception
+
+def _remove_session(jh):
+    base_dir = os.path.dirname(jh.config.snapshot_dir)
+    if os.path.isdir(base_dir): shutil.rmtree(base_dir)
+
+def bench_add_job(n_jobs, work_dir, bulk = False):
+    """Measure the time to register n_jobs jobs with snapshots activated, either one by one or in bulk."""
+    run_script = 'echo "bench"'
+    jh = _get_jobhandler('bench_add_job_{}'.format(n_jobs), work_dir)
+    start = time.time()
+    if bulk:
+        jh.add_jobs([{'run_script': run_script} for i in range(n_jobs)])
+    else:
+        for i in range(n_jobs):
+            jh.add_job(run_script = run_script)
+    time_spent = time.time() - start
+    _remove_session(jh)
+
+    return time_spent
+
+def bench_snapshot(n_jobs, work_dir, snapshot_store):
+    """Measure the time to save and reload the snapshot of a session with n_jobs jobs for the given snapshot store."""
+    from slurmy import JobHandler
+    jh = _get_jobhandler('bench_snapshot_{}'.format(n_jobs), work_dir, snapshot_store = snapshot_store)
+    jh.add_jobs([{'run_script': 'echo "bench"'} for i in range(n_jobs)])
+    ## Tag all jobs for an update to measure a full snapshot write
+    for job in jh.jobs.values():
+        job.config.update = True
+    start = time.time()
+    jh.update_snapshot()
+    time_save = time.time() - start
+    start = time.time()
+    JobHandler(name = jh.config.name, work_dir = work_dir, use_snapshot = True, verbosity = 0, printer_bar_mode = False)
+    time_load = time.time() - start
+    _remove_session(jh)
+
+    return time_save, time_load
+
+def bench_submit_cycle(n_jobs, work_dir, n_active = 100):
+    """Measure the time of one submission cycle of a session with n_jobs jobs, of which all but n_active are already in SUCCESS."""
+    from slurmy import Status
+    jh = _get_jobhandler('bench_submit_cycle_{}'.format(n_jobs), work_dir, do_snapshot = False)
+    ## Jobs which are not finished yet wait for their starttime, so that nothing is submitted
+    starttime = time.time() + 3600
+    jh.add_jobs([{'run_script': 'echo "bench"', 'starttime': starttime} for i in range(n_jobs)])
+    for job in list(jh.jobs.values())[n_active:]:
+        job.config.status = Status.SUCCESS
+        jh.jobs._update_job_status(job, skip_eval = True)
+    start = time.time()
+    jh.submit_jobs(make_snapshot = False, wait = False)
+    time_spent = time.time() - start
+    _remove_session(jh)
+
+    return time_spent
+
+def _get_fake_jobhandler(name, work_dir, n_jobs, topology, run_time = 0., listens = False):
+    from slurmy import Fake
+    ## Without listeners, the job status is polled from the backend in each submission cycle
+    jh = _get_jobhandler(name, work_dir, do_snapshot = False, listens = listens, backend = Fake(run_time = run_time, seed = 0))
+    jh.add_jobs(_get_job_definitions(n_jobs, topology))
+    ## Status changes are not delayed, so that each cycle makes progress
+    jh.set_jobs_config_attr('delaytimes', {})
+
+    return jh
+
+def bench_session(n_jobs, work_dir, topology):
+    """Run a session of n_jobs jobs with the given topology (see _get_job_definitions) on the simulated Fake backend, with jobs finishing right after their submission. Measure the latency of each submission cycle and of the final check."""
+    from slurmy import Status
+    jh = _get_fake_jobhandler('bench_session_{}_{}'.format(topology, n_jobs), work_dir, n_jobs, topology)
+    cycle_times = []
+    while len(jh.jobs._states[Status.SUCCESS]) + len(jh.jobs._states[Status.FAILED]) < n_jobs:
+        start = time.time()
+        jh.submit_jobs(make_snapshot = False, wait = False)
+        cycle_times.append(time.time() - start)
+    start = time.time()
+    jh.check(print_summary = False)
+    time_check = time.time() - start
+    _remove_session(jh)
+
+    return cycle_times, time_check
+
+def bench_listener(n_jobs, work_dir, topology):
+    """Measure the time of one listener update which reports n_jobs running jobs of the given topology as finished, including the transfer through the result queue."""
+    from slurmy import Status
+    from slurmy.tools.listener import Listener, _TimestampQueue
+    jh = _get_fake_jobhandler('bench_listener_{}_{}'.format(topology, n_jobs), work_dir, n_jobs, topology, run_time = 3600., listens = True)
+    ## Jobs without dependencies are running
+    jh.submit_jobs(make_snapshot = False, wait = False)
+    running = [jh.jobs[name] for name in jh.jobs._states[Status.RUNNING]]
+    listener = Listener(jh, None, Status.RUNNING, 'id')
+    _TimestampQueue(listener._results).put(dict((job.id, {'status': Status.FINISHED, 'exitcode': '0'}) for job in running))
+    start = time.time()
+    listener.update_jobs(timeout = 60)
+    time_spent = time.time() - start
+    _remove_session(jh)
+
+    return len(running), time_spent
+
+def bench_printer(n_jobs, work_dir, topology, n_updates = 10):
+    """Measure the time of a printer refresh for n_jobs jobs with the given topology, i.e. the collection of the job counts for all tracked tags and the status line, without the terminal output."""
+    jh = _get_fake_jobhandler('bench_printer_{}_{}'.format(topology, n_jobs), work_dir, n_jobs, topology)
+    printer = jh._printer
+    start = time.time()
+    printer._tags.setup(jh.jobs.values())
+    time_setup = time.time() - start
+    start = time.time()
+    for i in range(n_updates):
+        printer._get_updates()
+        printer._get_print_string()
+    time_update = (time.time() - start) / n_updates
+    _remove_session(jh)
+
+    return time_setup, time_update
+
+def _print_results(name, rows):
+    if not rows: return
+    keys = list(rows[0].keys())
+    print('== {}'.format(name))
+    print(' '.join('{:>14}'.format(key) for key in keys))
+    for row in rows:
+        print(' '.join('{:>14.4g}'.format(row[key]) if isinstance(row[key], float) else '{:>14}'.format('-' if row[key] is None else row[key]) for key in keys))
+
+_benchmarks = ['add_job', 'snapshot', 'submit_cycle', 'session', 'listener', 'printer']
+_topologies = ['flat', 'chain', 'fanout']
+
+def main(argv = None):
+    from collections import OrderedDict
+    parser = argparse.ArgumentParser(description = 'Run the slurmy benchmarks')
+    parser.add_argument('-n', dest = 'sizes', nargs = '+', type = int, default = [1000, 10000], help = 'Numbers of jobs to benchmark with')
+    parser.add_argument('--single-max', dest = 'single_max', type = int, default = 10000, help = 'Maximum number of jobs for which add_job is measured with single calls, which grows faster than linear (larger sizes only measure add_jobs)')
+    parser.add_argument('-b', '--benchmarks', dest = 'benchmarks', nargs = '+', choices = _benchmarks, default = _benchmarks, help = 'Benchmarks to run')
+    parser.add_argument('-t', '--topologies', dest = 'topologies', nargs = '+', choices = _topologies, default = _topologies, help = 'Job dependency topologies of the session, listener, and printer benchmarks')
+    parser.add_argument('--json', dest = 'json', help = 'Store the results in the given JSON file, to compare them between versions')
+    parser.add_argument('--work-dir', dest = 'work_dir', default = os.path.join(options.Main.workdir, 'slurmy_benchmark'), help = 'Directory where the benchmark sessions are created')
+    args = parser.parse_args(argv)
+    results = OrderedDict()
+    if 'add_job' in args.benchmarks:
+        rows = results['add_job'] = []
+        for n_jobs in args.sizes:
+            ## Single calls are skipped for large sizes, unless requested
+            time_single = bench_add_job(n_jobs, args.work_dir) if n_jobs <= args.single_max else None
+            time_bulk = bench_add_job(n_jobs, args.work_dir, bulk = True)
+            rows.append(OrderedDict([('jobs', n_jobs), ('single_s', time_single), ('single_us_job', 1e6*time_single/n_jobs if time_single is not None else None), ('bulk_s', time_bulk), ('bulk_us_job', 1e6*time_bulk/n_jobs)]))
+        _print_results('add_job', rows)
+    if 'snapshot' in args.benchmarks:
+        from slurmy import SnapshotStore
+        rows = results['snapshot'] = []
+        for n_jobs in args.sizes:
+            for snapshot_store in SnapshotStore:
+                time_save, time_load = bench_snapshot(n_jobs, args.work_dir, snapshot_store)
+                rows.append(OrderedDict([('jobs', n_jobs), ('store', snapshot_store.name), ('save_s', time_save), ('load_s', time_load)]))
+        _print_results('snapshot', rows)
+    if 'submit_cycle' in args.benchmarks:
+        rows = results['submit_cycle'] = []
+        for n_jobs in args.sizes:
+            time_spent = bench_submit_cycle(n_jobs, args.work_dir)
+            rows.append(OrderedDict([('jobs', n_jobs), ('active', 100), ('cycle_ms', 1e3*time_spent)]))
+        _print_results('submit_cycle', rows)
+    if 'session' in args.benchmarks:
+        rows = results['session'] = []
+        for topology in args.topologies:
+            for n_jobs in args.sizes:
+                cycle_times, time_check = bench_session(n_jobs, args.work_dir, topology)
+                rows.append(OrderedDict([('jobs', n_jobs), ('topology', topology), ('cycles', len(cycle_times)), ('total_s', sum(cycle_times)), ('mean_cycle_ms', 1e3*sum(cycle_times)/len(cycle_times)), ('max_cycle_ms', 1e3*max(cycle_times)), ('check_ms', 1e3*time_check)]))
+        _print_results('session', rows)
+    if 'listener' in args.benchmarks:
+        rows = results['listener'] = []
+        for topology in args.topologies:
+            for n_jobs in args.sizes:
+                n_updates, time_spent = bench_listener(n_jobs, args.work_dir, topology)
+                rows.append(OrderedDict([('jobs', n_jobs), ('topology', topology), ('updates', n_updates), ('update_ms', 1e3*time_spent)]))
+        _print_results('listener', rows)
+    if 'printer' in args.benchmarks:
+        rows = results['printer'] = []
+        for topology in args.topologies:
+            for n_jobs in args.sizes:
+                time_setup, time_update = bench_printer(n_jobs, args.work_dir, topology)
+                rows.append(OrderedDict([('jobs', n_jobs), ('topology', topology), ('setup_ms', 1e3*time_setup), ('refresh_ms', 1e3*time_update)]))
+        _print_results('printer', rows)
+    if args.json:
+        output = OrderedDict([('timestamp', time.time()), ('python', platform.python_version()), ('platform', platform.platform()), ('sizes', args.sizes), ('results', results)])
+        with open(args.json, 'w') as out_file:
+            json.dump(output, out_file, indent = 2)
+        print('Results stored in {}'.format(args.json))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+import unittest
+import os
+from ..tools import options
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = os.path.join(options.Main.workdir, 'slurmy_unittest/fake')
+        self.run_script = 'echo "test"'
+
+    def _run_session(self, name, **kwargs):
+        from slurmy import JobHandler, Fake
+        jh = JobHandler(work_dir = self.test_dir, verbosity = 0, name = name, do_snapshot = False, backend = Fake(run_time = (0., 0.2), failure_rate = 0.5, seed = 1))
+        for i in range(50):
+            jh.add_job(run_script = self.run_script, name = 'test_{}'.format(i))
+        jh.run_jobs(interval = 0.05, **kwargs)
+
+        return jh
+
+    def test_session(self):
+        from slurmy import Status
+        jh_1 = self._run_session('test_fake_1')
+        jh_2 = self._run_session('test_fake_2')
+        failed = set(jh_1.jobs._states[Status.FAILED])
+        self.assertEqual(len(failed) + len(jh_1.jobs._states[Status.SUCCESS]), 50)
+        self.assertTrue(0 < len(failed) < 50)
+        ## Outcomes are reproducible
+        self.assertEqual(failed, set(jh_2.jobs._states[Status.FAILED]))
+        self.assertEqual(jh_1.jobs.get(states = Status.FAILED)[0].exitcode, '1')
+
+    def test_routines(self):
+        from slurmy import Status
+        failed = set(self._run_session('test_fake_routine').jobs._states[Status.FAILED])
+        ## The event-driven and the asyncio-based routine end with the same outcomes
+        for i, kwargs in enumerate([{'event_driven': True}, {'concurrency': 4}]):
+            jh = self._run_session('test_fake_routine_{}'.format(i), **kwargs)
+            self.assertEqual(len(jh.jobs._states[Status.FAILED]) + len(jh.jobs._states[Status.SUCCESS]), 50)
+            self.assertEqual(set(jh.jobs._states[Status.FAILED]), failed)
+
+    def test_async_rate(self):
+        from slurmy import JobHandler, Fake, Status
+        jh = JobHandler(work_dir = self.test_dir, verbosity = 0, name = 'test_fake_async_rate', do_snapshot = False, backend = Fake(), submit_rate = 20)
+        for i in range(5):
+            jh.add_job(run_script = self.run_script, name = 'test_{}'.format(i))
+        jh.run_jobs(interval = 0.05, concurrency = 4)
+        ## Backends without submission command are rate limited as well
+        submit_times = [job.config.timestamps[Status.RUNNING] for job in jh.jobs.values()]
+        self.assertGreaterEqual(max(submit_times) - min(submit_times), 0.19)
+
+    def test_processes(self):
+        import subprocess
+        import sys
+        ## Outcomes of the same jobs, submitted in separate processes
+        script = 'from slurmy import Fake\nbackends = [Fake(name = "test_{}".format(i), failure_rate = 0.5, seed = 3) for i in range(20)]\nprint(" ".join(backend.submit() and backend.exitcode() for backend in backends))\n'
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))] + sys.path)
+        outputs = [subprocess.check_output([sys.executable, '-c', script], env = env, universal_newlines = True) for i in range(2)]
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertEqual(set(outputs[0].split()), set(['0', '1']))
+
+    def test_listen_func(self):
+        import multiprocessing
+        from slurmy import Fake, Status
+        log_dir = os.path.join(self.test_dir, 'logs')
+        if not os.path.isdir(log_dir): os.makedirs(log_dir)
+        registry = os.path.join(log_dir, Fake._registry_name)
+        if os.path.isfile(registry): os.remove(registry)
+        backends = [Fake(name = 'test_{}'.format(i), log = os.path.join(log_dir, 'test_{}'.format(i)), run_time = 0.5 * i) for i in range(3)]
+        job_ids = [backend.submit() for backend in backends]
+        backends[2].cancel()
+        results = multiprocessing.Queue()
+        process = multiprocessing.Process(target = Fake.get_listen_func(log_dir = log_dir), args = (results, 0.1))
+        process.start()
+        try:
+            reported = {}
+            while job_ids[1] not in reported:
+                reported.update(results.get(timeout = 10))
+            self.assertEqual(reported, {job_id: {'status': Status.FINISHED, 'exitcode': '0'} for job_id in job_ids[:2]})
+        finally:
+            process.terminate()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,224 @@
+import unittest
+import os
+import stat
+from ..tools import options
+
+## Recorded job event log of job 10.0, which succeeded, and job 10.1, which was killed by a signal
+_userlog = ["""000 (010.000.000) 2024-03-14 15:09:20 Job submitted from host: <10.0.0.1:9618?addrs=10.0.0.1-9618&noUDP&sock=schedd_1_1>
+...
+000 (010.001.000) 2024-03-14 15:09:20 Job submitted from host: <10.0.0.1:9618?addrs=10.0.0.1-9618&noUDP&sock=schedd_1_1>
+...
+001 (010.000.000) 2024-03-14 15:09:25 Job executing on host: <10.0.0.2:9618?addrs=10.0.0.2-9618&noUDP&sock=startd_1_1>
+...
+""", """006 (010.000.000) 2024-03-14 15:09:33 Image size of job updated: 2500
+	3  -  MemoryUsage of job (MB)
+	2500  -  ResidentSetSize of job (KB)
+...
+005 (010.000.000) 2024-03-14 15:09:35 Job terminated.
+	(1) Normal termination (return value 0)
+		Usr 0 00:00:00, Sys 0 00:00:00  -  Run Remote Usage
+	0  -  Run Bytes Sent By Job
+...
+001 (010.001.000) 2024-03-14 15:09:36 Job executing on host: <10.0.0.2:9618?addrs=10.0.0.2-9618&noUDP&sock=startd_1_1>
+...
+005 (010.001.000) 2024-03-14 15:09:40 Job terminated.
+	(0) Abnormal termination (signal 9)
+	(0) No core file
+...
+"""]
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        from slurmy import test_mode
+        test_mode(True)
+        self.test_dir = os.path.join(options.Main.workdir, 'slurmy_unittest/htcondor')
+        ## Stub condor commands, which record their arguments and print the content of the respective output file
+        self.bin_dir = os.path.join(self.test_dir, 'bin')
+        if not os.path.isdir(self.bin_dir): os.makedirs(self.bin_dir)
+        self.files = {}
+        for command in ['condor_q', 'condor_history']:
+            args_file = os.path.join(self.bin_dir, '{}_args'.format(command))
+            output_file = os.path.join(self.bin_dir, '{}_output'.format(command))
+            self.files[command] = (args_file, output_file)
+            for file_name in [args_file, output_file]:
+                if os.path.isfile(file_name): os.remove(file_name)
+            with open(os.path.join(self.bin_dir, command), 'w') as out_file:
+                out_file.write('#!/bin/bash\necho "$@" >> {}\ncat {} 2>/dev/null\n'.format(args_file, output_file))
+            os.chmod(os.path.join(self.bin_dir, command), stat.S_IRWXU)
+        ## The condor_submit stub submits cluster 20, with one proc per line of the item file (or a single proc)
+        self.submit_args = os.path.join(self.bin_dir, 'condor_submit_args')
+        if os.path.isfile(self.submit_args): os.remove(self.submit_args)
+        condor_submit = '#!/bin/bash\necho "$@" >> SUBMIT_ARGS\nsub="${@: -1}"\nitems=$(sed -n "s/^queue .* from //p" "$sub")\nif [[ -z "$items" ]]; then echo "** Proc 20.0:"; echo "UserLog = \\"single.log\\""; exit 0; fi\ni=0\nwhile read -r log_base executable; do\n  echo "** Proc 20.$i:"\n  echo "Cmd = \\"$executable\\""\n  echo "UserLog = \\"$log_base.20.$i.log\\""\n  echo\n  i=$((i+1))\ndone < "$items"\n'
+        with open(os.path.join(self.bin_dir, 'condor_submit'), 'w') as out_file:
+            out_file.write(condor_submit.replace('SUBMIT_ARGS', self.submit_args))
+        os.chmod(os.path.join(self.bin_dir, 'condor_submit'), stat.S_IRWXU)
+        self.path = os.environ['PATH']
+        os.environ['PATH'] = '{}:{}'.format(self.bin_dir, self.path)
+
+    def tearDown(self):
+        from slurmy import test_mode
+        test_mode(False)
+        os.environ['PATH'] = self.path
+
+    def _set_output(self, command, output):
+        with open(self.files[command][1], 'w') as out_file:
+            out_file.write(output)
+
+    def _get_args(self, command):
+        if not os.path.isfile(self.files[command][0]): return []
+        with open(self.files[command][0], 'r') as in_file:
+            return in_file.readlines()
+
+    def test_status_cache(self):
+        from slurmy import HTCondor, Status
+        backends = []
+        for job_id in ['10.0', '10.1', '11.0', '12.0']:
+            backend = HTCondor(name = 'test')
+            backend._job_id = {job_id: 'log'}
+            backends.append(backend)
+        self._set_output('condor_q', '10 0 2 undefined\n')
+        self._set_output('condor_history', '10 1 4 0\n11 0 4 1\n')
+        HTCondor.update_status_cache(backends)
+        self.assertEqual([backend.status() for backend in backends], [Status.RUNNING, Status.FINISHED, Status.FINISHED, Status.RUNNING])
+        self.assertEqual([backend.exitcode() for backend in backends[1:3]], ['0', '1'])
+        ## One condor_q for all clusters, one condor_history for the jobs which left the queue
+        self.assertEqual(len(self._get_args('condor_q')), 1)
+        self.assertIn('member(ClusterId, {10, 11, 12})', self._get_args('condor_q')[0])
+        self.assertEqual(len(self._get_args('condor_history')), 1)
+        self.assertIn('member(ClusterId, {10, 11, 12})', self._get_args('condor_history')[0])
+        HTCondor.update_status_cache([])
+        self.assertEqual(HTCondor._status_cache, {})
+
+    def test_listen_func(self):
+        import multiprocessing
+        from slurmy import HTCondor, Status
+        listen_func = HTCondor.get_listen_func()
+        self._set_output('condor_q', '10 0 2 undefined\n10 1 2 undefined\n')
+        self._set_output('condor_history', '10 0 4 0\n')
+        results = multiprocessing.Queue()
+        process = multiprocessing.Process(target = listen_func, args = (results, 0.1))
+        process.start()
+        try:
+            self.assertEqual(dict(results.get(timeout = 10)), {})
+            ## Job 10.0 left the queue
+            self._set_output('condor_q', '10 1 2 undefined\n')
+            result = {}
+            while not result:
+                result = dict(results.get(timeout = 10))
+            self.assertEqual(result, {'10.0': {'status': Status.FINISHED, 'exitcode': '0'}})
+        finally:
+            process.terminate()
+
+    def test_cluster_submission(self):
+        from slurmy import JobHandler, HTCondor, Status
+        jh = JobHandler(work_dir = self.test_dir, verbosity = 0, name = 'test_cluster_submission', do_snapshot = False, listens = False, array_submission = True, backend = HTCondor())
+        for i in range(3):
+            jh.add_job(run_script = '#!/bin/bash\necho "test"\n', name = 'test_{}'.format(i))
+        jh.add_job(run_script = '#!/bin/bash\necho "test"\n', name = 'test_mem', backend = HTCondor(mem = 4000))
+        jh.submit_jobs(make_snapshot = False)
+        ## Jobs with the same resource requests are submitted with one condor_submit call
+        with open(self.submit_args, 'r') as in_file:
+            submit_calls = in_file.readlines()
+        self.assertEqual(len(submit_calls), 2)
+        for i in range(3):
+            job = jh['test_{}'.format(i)]
+            backend = job.config.backend
+            self.assertEqual(job.id, '20.{}'.format(i))
+            self.assertIs(jh.jobs['20.{}'.format(i)], job)
+            self.assertIs(job.status, Status.RUNNING)
+            ## Each proc keeps its own job event log
+            self.assertEqual(backend._job_id, {'20.{}'.format(i): '{}.20.{}.log'.format(backend._get_log_base(os.path.dirname(backend.run_script)), i)})
+        self.assertEqual(jh.jobs.test_mem.config.backend._job_id, {'20.0': 'single.log'})
+        cluster_file = [call.split()[-1] for call in submit_calls if call.rstrip().endswith('.cluster.sub')]
+        self.assertEqual(len(cluster_file), 1)
+        with open(cluster_file[0], 'r') as in_file:
+            description = in_file.read()
+        self.assertIn('batch_name              = {}\n'.format(jh.config.name), description)
+        self.assertIn('log                     = $(log_base).$(ClusterId).$(Process).log\n', description)
+        self.assertIn('queue log_base, executable from ', description)
+
+    def _write_userlog(self, path, data, mode = 'a'):
+        with open(path, mode) as out_file:
+            out_file.write(data)
+
+    def test_userlog_parser(self):
+        from slurmy.backends.htcondor_userlog import UserLogParser
+        path = os.path.join(self.test_dir, 'test_userlog_parser.log')
+        self._write_userlog(path, _userlog[0], 'w')
+        parser = UserLogParser(path)
+        self.assertTrue(parser.update())
+        self.assertEqual(parser.jobs, {'10.0': {'finished': 2}, '10.1': {'finished': 1}})
+        ## Incomplete events are parsed once they are completed
+        split = _userlog[1].index('\t0  -  Run Bytes')
+        self._write_userlog(path, _userlog[1][:split])
+        parser.update()
+        self.assertEqual(parser.jobs['10.0'], {'finished': 2})
+        self._write_userlog(path, _userlog[1][split:])
+        parser.update()
+        self.assertEqual(parser.jobs, {'10.0': {'finished': 4, 'success': '0'}, '10.1': {'finished': 4, 'success': '137'}})
+        ## Nothing is read again
+        self.assertEqual(parser._offset, os.path.getsize(path))
+        self.assertFalse(UserLogParser(os.path.join(self.test_dir, 'missing.log')).update())
+
+    def test_userlog_status(self):
+        from slurmy import HTCondor, Status
+        path = os.path.join(self.test_dir, 'test_userlog_status.log')
+        self._write_userlog(path, _userlog[0], 'w')
+        backend = HTCondor(name = 'test')
+        backend._job_id = {'10.0': path}
+        self.assertIs(backend.status(), Status.RUNNING)
+        self._write_userlog(path, _userlog[1])
+        HTCondor.update_status_cache([backend])
+        self.assertIs(backend.status(), Status.FINISHED)
+        self.assertEqual(backend.exitcode(), '0')
+        HTCondor.update_status_cache([])
+        ## No condor command was called
+        self.assertEqual(self._get_args('condor_q'), [])
+        self.assertEqual(self._get_args('condor_history'), [])
+
+    def test_userlog_listen_func(self):
+        import multiprocessing
+        from slurmy import HTCondor, Status
+        log_dir = os.path.join(self.test_dir, 'logs')
+        if not os.path.isdir(log_dir): os.makedirs(log_dir)
+        path = os.path.join(log_dir, 'test.10.0.log')
+        self._write_userlog(path, _userlog[0], 'w')
+        listen_func = HTCondor.get_listen_func(log_dir = log_dir)
+        results = multiprocessing.Queue()
+        process = multiprocessing.Process(target = listen_func, args = (results, 0.1))
+        process.start()
+        try:
+            self.assertEqual(dict(results.get(timeout = 10)), {})
+            self._write_userlog(path, _userlog[1])
+            result = {}
+            while not result:
+                result = dict(results.get(timeout = 10))
+            self.assertEqual(result, {'10.0': {'status': Status.FINISHED, 'exitcode': '0'}, '10.1': {'status': Status.FINISHED, 'exitcode': '137'}})
+        finally:
+            process.terminate()
+        self.assertEqual(self._get_args('condor_q'), [])
+
+    def test_userlog_release(self):
+        from slurmy import HTCondor
+        from slurmy.backends import htcondor_userlog
+        log_dir = os.path.join(self.test_dir, 'logs_release')
+        if not os.path.isdir(log_dir): os.makedirs(log_dir)
+        path = os.path.join(log_dir, 'test.10.0.log')
+        self._write_userlog(path, _userlog[0], 'w')
+        ## The parser of the status evaluation is released once all jobs of the log finished
+        self.assertEqual(htcondor_userlog.get_job_entry(path, '10.0'), {'finished': 2})
+        self.assertIn(path, htcondor_userlog._parsers)
+        parsers, reported, done = {}, set(), set()
+        self.assertEqual(dict(HTCondor._read_userlogs(log_dir, parsers, reported, done)), {})
+        self._write_userlog(path, _userlog[1])
+        self.assertEqual(htcondor_userlog.get_job_entry(path, '10.0'), {'finished': 4, 'success': '0'})
+        self.assertNotIn(path, htcondor_userlog._parsers)
+        ## The listener drops the log once its jobs were reported, and doesn't read it again
+        self.assertEqual(set(HTCondor._read_userlogs(log_dir, parsers, reported, done)), set(['10.0', '10.1']))
+        self.assertEqual((parsers, reported, done), ({}, set(), set([path])))
+        self.assertEqual(dict(HTCondor._read_userlogs(log_dir, parsers, reported, done)), {})
+        self.assertEqual(parsers, {})
+
+if __name__ == '__main__':
+    unittest.main()
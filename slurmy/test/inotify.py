@@ -0,0 +1,44 @@
+
+import unittest
+import os
+import shutil
+from ..tools import options
+from ..tools.inotify import is_available, is_local_fs
+
+
+@unittest.skipUnless(is_available(), 'inotify is not available')
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = os.path.join(options.Main.workdir, 'slurmy_unittest/inotify')
+        if os.path.isdir(self.test_dir): shutil.rmtree(self.test_dir)
+        os.makedirs(self.test_dir)
+
+    def test_watcher(self):
+        from slurmy.tools.inotify import InotifyWatcher, IN_DELETE
+        watcher = InotifyWatcher()
+        self.assertTrue(watcher.add_folder(self.test_dir))
+        file_name = os.path.join(self.test_dir, 'test')
+        open(file_name, 'w').close()
+        self.assertTrue(watcher.wait(5))
+        self.assertIn((self.test_dir, 'test'), [(folder, name) for folder, name, mask in watcher.read()])
+        os.remove(file_name)
+        self.assertTrue(watcher.wait(5))
+        self.assertTrue(any(mask & IN_DELETE for folder, name, mask in watcher.read()))
+        watcher.close()
+
+    @unittest.skipUnless(is_local_fs(options.Main.workdir), 'work dir is not on a local file system')
+    def test_directory_cache(self):
+        from slurmy.tools.utils import _DirectoryCache
+        directory_cache = _DirectoryCache()
+        directory_cache.set_watch(True)
+        file_name = os.path.join(self.test_dir, 'test')
+        self.assertFalse(directory_cache.exists(file_name)[0])
+        self.assertTrue(directory_cache._watched[self.test_dir])
+        ## The listing is updated by the events, within the same cycle
+        open(file_name, 'w').close()
+        directory_cache.wait(5)
+        self.assertTrue(directory_cache.exists(file_name)[0])
+        directory_cache.set_watch(False)
+
+if __name__ == '__main__':
+    unittest.main()
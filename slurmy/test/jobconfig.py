@@ -72,6 +72,179 @@ class Test(unittest.TestCase):
         self.assertIn('hans', job.parent_tags)
         self.assertIn('horst', job.parent_tags)
 
+    def test_add_jobs(self):
+        jobs = self.jh.add_jobs([{'run_script': self.run_script, 'name': 'test_bulk_{}'.format(i)} for i in range(3)])
+        self.assertEqual(len(jobs), 3)
+        for i, job in enumerate(jobs):
+            self.assertIn('test_bulk_{}'.format(i), self.jh.jobs)
+        self.assertIsNone(self.jh._deferred_jobs)
+
+    def test_get(self):
+        from slurmy import Status
+        job_1 = self.jh.add_job(run_script = self.run_script, tags = 'hans')
+        job_2 = self.jh.add_job(run_script = self.run_script, tags = ['hans', 'horst'])
+        job_3 = self.jh.add_job(run_script = self.run_script, tags = 'horst')
+        job_2.config.status = Status.SUCCESS
+        self.jh.jobs._update_job_status(job_2, skip_eval = True)
+        self.assertEqual(self.jh.jobs.get(tags = 'hans'), [job_1, job_2])
+        self.assertEqual(self.jh.jobs.get(tags = ['hans', 'horst'], states = Status.CONFIGURED), [job_1, job_3])
+        self.assertEqual(self.jh.jobs.get(states = Status.SUCCESS), [job_2])
+        self.assertEqual(self.jh.jobs.get(tags = 'horst', states = Status.SUCCESS, evaluate = True), [job_2])
+
+    def test_success_trigger(self):
+        import time
+        from slurmy import Status
+        from slurmy.tools.utils import _DirectoryCache, _directory_cache
+        output = os.path.join(self.jh.config.output_dir, 'test_success_trigger')
+        job = self.jh.add_job(run_script = self.run_script, output = output)
+        job.config.timestamps[Status.FINISHED] = time.time()
+        success_func = job.config.success_func
+        refresh_interval = _DirectoryCache._refresh_interval
+        _DirectoryCache._refresh_interval = 0.
+        def check():
+            ## Directories are scanned again in each cycle
+            _directory_cache.new_cycle()
+            return success_func._check_pending(job.config)
+        try:
+            ## The check doesn't block and is pending until the attempts are exhausted
+            for i in range(self.jh.config.output_max_attempts-1):
+                self.assertIsNone(check())
+            self.assertFalse(check())
+            ## Attempts are counted again when the job finished again
+            job.config.timestamps[Status.FINISHED] = time.time() + 1.
+            self.assertIsNone(check())
+            open(output, 'w').close()
+            self.assertTrue(check())
+        finally:
+            _DirectoryCache._refresh_interval = refresh_interval
+
+    def test_success_trigger_shared(self):
+        import time
+        from slurmy import Status, SuccessTrigger
+        from slurmy.tools.utils import _DirectoryCache
+        output = os.path.join(self.jh.config.output_dir, 'test_success_trigger_shared')
+        success_func = SuccessTrigger(output, 2)
+        job_1 = self.jh.add_job(run_script = self.run_script, success_func = success_func)
+        job_2 = self.jh.add_job(run_script = self.run_script, success_func = success_func)
+        job_1.config.timestamps[Status.FINISHED] = time.time()
+        job_2.config.timestamps[Status.FINISHED] = time.time()
+        refresh_interval = _DirectoryCache._refresh_interval
+        _DirectoryCache._refresh_interval = 0.
+        try:
+            ## The attempts are counted per job
+            self.assertIsNone(success_func._check_pending(job_1.config))
+            self.assertIsNone(success_func._check_pending(job_2.config))
+            ## The blocking check gives the final result
+            self.assertFalse(success_func(job_1.config))
+            job_1.config.status = Status.FINISHED
+            self.assertIs(job_1.get_status(force_success_check = True), Status.FAILED)
+            open(output, 'w').close()
+            self.assertTrue(success_func(job_2.config))
+        finally:
+            _DirectoryCache._refresh_interval = refresh_interval
+
+    def test_local_resources(self):
+        from slurmy import JobHandler, Type
+        from slurmy.backends.slurm import Slurm
+        from slurmy.tools.utils import parse_mem
+        self.assertEqual(parse_mem('4G'), 4096.)
+        self.assertEqual(parse_mem(500), 500.)
+        self.assertIsNone(parse_mem(None))
+        jh = JobHandler(work_dir = self.test_dir, verbosity = 0, name = 'test_jobconfig_local_resources', do_snapshot = False, local_max = 10, local_resources = True)
+        ## Machine with 4 CPUs and 8 GB of memory
+        jh._local_capacity = (4, 8192.)
+        job_big = jh.add_job(backend = Slurm(cpus = 3, mem = '2G'), run_script = self.run_script, job_type = Type.LOCAL)
+        job_cpus = jh.add_job(backend = Slurm(cpus = 2), run_script = self.run_script, job_type = Type.LOCAL)
+        job_mem = jh.add_job(backend = Slurm(mem = '7G'), run_script = self.run_script, job_type = Type.LOCAL)
+        job_small = jh.add_job(backend = Slurm(mem = '1G'), run_script = self.run_script, job_type = Type.LOCAL)
+        self.assertTrue(jh._local_slot_free(job_mem))
+        jh.jobs._local.add(job_big.name)
+        self.assertFalse(jh._local_slot_free(job_cpus))
+        self.assertFalse(jh._local_slot_free(job_mem))
+        self.assertTrue(jh._local_slot_free(job_small))
+
+    def _get_fake_jobhandler(self, name):
+        from slurmy import JobHandler, Fake
+        return JobHandler(work_dir = self.test_dir, verbosity = 0, name = name, do_snapshot = False, listens = False, backend = Fake())
+
+    def test_late_tags(self):
+        from slurmy import Status
+        jh = self._get_fake_jobhandler('test_jobconfig_late_tags')
+        parent = jh.add_job(run_script = self.run_script, name = 'parent')
+        ## Tag is added after the job was registered
+        parent.add_tag('hans')
+        child = jh.add_job(run_script = self.run_script, name = 'child', parent_tags = 'hans')
+        child.add_tag('horst')
+        jh.add_job(run_script = self.run_script, name = 'grandchild').add_tag('horst', is_parent = True)
+        self.assertEqual(jh.jobs.get(tags = 'hans'), [parent])
+        jh.set_jobs_config_attr('delaytimes', {})
+        jh.submit_jobs(make_snapshot = False, wait = False)
+        self.assertIs(parent.status, Status.RUNNING)
+        self.assertIs(child.status, Status.CONFIGURED)
+        for i in range(3):
+            jh.submit_jobs(make_snapshot = False, wait = False)
+        for job in jh.jobs.values():
+            self.assertIs(job.status, Status.SUCCESS)
+        self.assertTrue(jh.jobs._is_tag_success('hans'))
+        self.assertTrue(jh.jobs._is_tag_success('horst'))
+
+    def test_tag_cycle(self):
+        from slurmy import Status
+        jh = self._get_fake_jobhandler('test_jobconfig_tag_cycle')
+        parent = jh.add_job(run_script = self.run_script, name = 'parent', tags = 'parent')
+        child = jh.add_job(run_script = self.run_script, name = 'child', tags = 'child', parent_tags = 'parent')
+        jh.set_jobs_config_attr('delaytimes', {})
+        jh.submit_jobs(tags = 'parent', make_snapshot = False, wait = False)
+        self.assertIs(parent.status, Status.RUNNING)
+        ## The parent job is not in the cycle, but its status is evaluated for the child
+        jh.submit_jobs(tags = 'child', make_snapshot = False, wait = False)
+        self.assertIs(jh.jobs.get(tags = 'parent', states = Status.SUCCESS)[0], parent)
+        self.assertIs(child.status, Status.RUNNING)
+
+    def test_reset(self):
+        from slurmy import Status
+        jh = self._get_fake_jobhandler('test_jobconfig_reset')
+        job = jh.add_job(run_script = self.run_script, name = 'job')
+        jh.set_jobs_config_attr('delaytimes', {})
+        jh.run_jobs(interval = 0.05)
+        self.assertIs(job.status, Status.SUCCESS)
+        job.reset()
+        self.assertEqual(jh.jobs._states[Status.CONFIGURED], set(['job']))
+        ## The reset job is submitted again
+        jh.run_jobs(interval = 0.05)
+        self.assertIs(job.status, Status.SUCCESS)
+        self.assertEqual(job.config.backend._n_submits, 2)
+
+    def test_local_affinity(self):
+        from slurmy import JobHandler, Fake, Type
+        from slurmy.tools.executor import LocalExecutor
+        n_cpus = {}
+        for local_resources in [False, True]:
+            jh = JobHandler(work_dir = self.test_dir, verbosity = 0, name = 'test_jobconfig_local_affinity', do_snapshot = False, listens = False, backend = Fake(), local_max = 2, local_affinity = True, local_resources = local_resources)
+            job = jh.add_job(run_script = self.run_script, name = 'job', job_type = Type.LOCAL)
+            job.config.backend.cpus = 8
+            n_cpus_list = []
+            job.submit = lambda n_cpus = None: n_cpus_list.append(n_cpus)
+            jh._submit_job(job)
+            n_cpus[local_resources] = n_cpus_list[0]
+        ## With local_resources, the job is pinned to the CPUs it requests, otherwise to its share of the available CPUs
+        self.assertEqual(n_cpus, {False: max(1, len(LocalExecutor.get_available_cpus()) // 2), True: 8})
+
+    def test_job_waiting(self):
+        from slurmy import Status
+        jh = self._get_fake_jobhandler('test_jobconfig_job_waiting')
+        jh.config.max_retries = 1
+        job = jh.add_job(run_script = self.run_script, name = 'job')
+        self.assertTrue(jh._job_waiting(job))
+        ## Failed jobs wait for a free slot as long as they are to be retried
+        job.config.status = Status.FAILED
+        self.assertTrue(jh._job_waiting(job))
+        job.config.n_retries = 1
+        self.assertFalse(jh._job_waiting(job))
+        self.assertTrue(jh._job_waiting(job, retry = True))
+        job.config.status = Status.RUNNING
+        self.assertFalse(jh._job_waiting(job))
+
     def test_variable_substitution(self):
         from slurmy import Status
         job = self.jh.add_job(run_script = self.run_script, output = '@SLURMY.output_dir/test')
@@ -0,0 +1,64 @@
+
+import unittest
+import os
+import time
+from ..tools import options
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        from slurmy import test_mode
+        test_mode(True)
+        self.test_dir = os.path.join(options.Main.workdir, 'slurmy_unittest/listener')
+        self.run_script = 'echo "test"'
+
+    def tearDown(self):
+        from slurmy import test_mode
+        test_mode(False)
+
+    def _get_listener(self, name):
+        from slurmy import JobHandler, Status
+        from slurmy.tools.listener import Listener, _TimestampQueue
+        jh = JobHandler(work_dir = self.test_dir, verbosity = 0, name = name, do_snapshot = False)
+        for i in range(2):
+            job = jh.add_job(run_script = self.run_script, name = 'test_{}'.format(i), output = 'output_{}'.format(i))
+            job.status = Status.FINISHED
+            jh.jobs._update_job_status(job, skip_eval = True)
+        listener = Listener(jh, None, Status.FINISHED, 'output', max_attempts = 2)
+        results = _TimestampQueue(listener._results)
+
+        return jh, listener, results
+
+    def test_drain(self):
+        from slurmy import Status
+        jh, listener, results = self._get_listener('test_drain')
+        results.put({})
+        results.put({'output_0': {'status': Status.SUCCESS}})
+        ## Wait for the queue feeder thread
+        time.sleep(0.1)
+        listener.update_jobs()
+        self.assertEqual(listener.get_metrics()['n_results'], 2)
+        self.assertIs(jh.jobs.test_0.status, Status.SUCCESS)
+        self.assertIs(jh.jobs.test_1.status, Status.FINISHED)
+        ## Results of unknown keys are dropped
+        results.put({'output_x': {'status': Status.SUCCESS}})
+        listener.update_jobs(timeout = 5)
+        self.assertNotIn('output_x', listener._updates)
+
+    def test_non_blocking(self):
+        from slurmy import Status
+        jh, listener, results = self._get_listener('test_non_blocking')
+        start = time.time()
+        for i in range(3):
+            listener.update_jobs()
+        self.assertLess(time.time() - start, 1.)
+        ## Attempts are only counted if the listener provided new results
+        self.assertIs(jh.jobs.test_1.status, Status.FINISHED)
+        results.put({})
+        listener.update_jobs(timeout = 5)
+        results.put({})
+        listener.update_jobs(timeout = 5)
+        self.assertIs(jh.jobs.test_1.status, Status.FAILED)
+
+if __name__ == '__main__':
+    unittest.main()
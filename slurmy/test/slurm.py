@@ -0,0 +1,175 @@
+
+import unittest
+import os
+import stat
+from ..tools import options
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        from slurmy import test_mode
+        test_mode(True)
+        self.test_dir = os.path.join(options.Main.workdir, 'slurmy_unittest/slurm')
+        ## Stub slurm commands, which just record their arguments
+        self.bin_dir = os.path.join(self.test_dir, 'bin')
+        if not os.path.isdir(self.bin_dir): os.makedirs(self.bin_dir)
+        self.sbatch_args = os.path.join(self.bin_dir, 'sbatch_args')
+        self.sacct_args = os.path.join(self.bin_dir, 'sacct_args')
+        job_id_file = os.path.join(self.bin_dir, 'job_id')
+        ## Job ids are counted under a lock, since sbatch might be called concurrently
+        sbatch = '#!/bin/bash\nexec 9>JOB_ID.lock\nflock 9\necho "$@" >> SBATCH_ARGS\nn=$(cat JOB_ID 2>/dev/null || echo 41)\nn=$((n+1))\necho $n > JOB_ID\necho "Submitted batch job $n"\n'
+        sbatch = sbatch.replace('SBATCH_ARGS', self.sbatch_args).replace('JOB_ID', job_id_file)
+        ## The sacct stub reports all requested jobs as completed, or in the state given by SACCT_STATE
+        ## Without "-j", the content of the sacct_listen file is reported
+        self.sacct_listen = os.path.join(self.bin_dir, 'sacct_listen')
+        sacct = '#!/bin/bash\necho "$@" >> SACCT_ARGS\nwhile [[ $# -gt 0 ]]; do\n  if [[ "$1" == "-j" ]]; then ids="$2"; shift; fi\n  shift\ndone\nif [[ -z "$ids" ]]; then cat SACCT_LISTEN; exit 0; fi\necho "JobID|State|ExitCode"\nfor id in ${ids//,/ }; do\n  echo "$id|${SACCT_STATE:-COMPLETED}|0:0"\n  echo "$id.batch|${SACCT_STATE:-COMPLETED}|0:0"\ndone\n'
+        sacct = sacct.replace('SACCT_ARGS', self.sacct_args).replace('SACCT_LISTEN', self.sacct_listen)
+        self.scancel_args = os.path.join(self.bin_dir, 'scancel_args')
+        scancel = '#!/bin/bash\necho "$@" >> {}\n'.format(self.scancel_args)
+        for command, script in [['sbatch', sbatch], ['sacct', sacct], ['scancel', scancel]]:
+            with open(os.path.join(self.bin_dir, command), 'w') as out_file:
+                out_file.write(script)
+            os.chmod(os.path.join(self.bin_dir, command), stat.S_IRWXU)
+        for file_name in [self.sbatch_args, self.sacct_args, self.scancel_args, job_id_file]:
+            if os.path.isfile(file_name): os.remove(file_name)
+        self.path = os.environ['PATH']
+        os.environ['PATH'] = '{}:{}'.format(self.bin_dir, self.path)
+        self.run_script = 'echo "test"'
+
+    def tearDown(self):
+        from slurmy import test_mode
+        test_mode(False)
+        os.environ['PATH'] = self.path
+        os.environ.pop('SACCT_STATE', None)
+
+    def test_array_key(self):
+        from slurmy import JobHandler, Slurm
+        jh = JobHandler(work_dir = self.test_dir, verbosity = 0, name = 'test_array_key', do_snapshot = False)
+        job_1 = jh.add_job(backend = Slurm(mem = '1000'), run_script = self.run_script)
+        job_2 = jh.add_job(backend = Slurm(mem = '1000'), run_script = self.run_script)
+        job_3 = jh.add_job(backend = Slurm(mem = '2000'), run_script = self.run_script)
+        job_4 = jh.add_job(backend = Slurm(mem = '1000'), run_script = '#SBATCH --gres=gpu:1\n'+self.run_script)
+        self.assertEqual(job_1.config.backend.get_array_key(), job_2.config.backend.get_array_key())
+        self.assertNotEqual(job_1.config.backend.get_array_key(), job_3.config.backend.get_array_key())
+        self.assertNotEqual(job_1.config.backend.get_array_key(), job_4.config.backend.get_array_key())
+
+    def test_array_submission(self):
+        from slurmy import JobHandler, Status
+        jh = JobHandler(work_dir = self.test_dir, verbosity = 0, name = 'test_array_submission', do_snapshot = False, listens = False, array_submission = True)
+        for i in range(3):
+            jh.add_job(run_script = self.run_script, name = 'test_{}'.format(i))
+        jh.submit_jobs(make_snapshot = False)
+        ## All jobs are submitted with one sbatch call
+        with open(self.sbatch_args, 'r') as in_file:
+            sbatch_calls = in_file.readlines()
+        self.assertEqual(len(sbatch_calls), 1)
+        self.assertIn('--array=0-2', sbatch_calls[0])
+        for i in range(3):
+            job = jh['test_{}'.format(i)]
+            self.assertEqual(job.id, '42_{}'.format(i))
+            self.assertIs(jh.jobs['42_{}'.format(i)], job)
+            self.assertIs(job.status, Status.RUNNING)
+        ## Array tasks are dispatched to the run_scripts of the jobs
+        array_script = sbatch_calls[0].split()[-1]
+        with open(array_script, 'r') as in_file:
+            array_script = in_file.read()
+        self.assertIn('2) exec {} > {} 2>&1 ;;'.format(jh.jobs.test_2.config.backend.run_script, jh.jobs.test_2.config.backend.log), array_script)
+
+    def test_status_polling(self):
+        from slurmy import JobHandler, Status
+        jh = JobHandler(work_dir = self.test_dir, verbosity = 0, name = 'test_status_polling', do_snapshot = False, listens = False)
+        for i in range(3):
+            jh.add_job(run_script = self.run_script, name = 'test_{}'.format(i))
+        jh.submit_jobs(make_snapshot = False)
+        ## Skip the delaytime for RUNNING
+        jh.set_jobs_config_attr('delaytimes', {})
+        jh.submit_jobs(make_snapshot = False)
+        ## The status of all jobs is queried with one sacct call
+        with open(self.sacct_args, 'r') as in_file:
+            sacct_calls = in_file.readlines()
+        self.assertEqual(len(sacct_calls), 1)
+        job_ids = sacct_calls[0].split()[sacct_calls[0].split().index('-j')+1]
+        self.assertEqual(set(job_ids.split(',')), set(['42', '43', '44']))
+        for i in range(3):
+            self.assertIs(jh['test_{}'.format(i)].status, Status.SUCCESS)
+
+    def test_async(self):
+        import sys
+        from slurmy import JobHandler, Status
+        if sys.version_info.major == 2: return
+        jh = JobHandler(work_dir = self.test_dir, verbosity = 0, name = 'test_async', do_snapshot = False, listens = False)
+        for i in range(3):
+            jh.add_job(run_script = self.run_script, name = 'test_{}'.format(i))
+        ## Skip the delaytime for RUNNING
+        jh.set_jobs_config_attr('delaytimes', {})
+        jh.run_jobs(interval = 0.1, concurrency = 2)
+        with open(self.sbatch_args, 'r') as in_file:
+            self.assertEqual(len(in_file.readlines()), 3)
+        with open(self.sacct_args, 'r') as in_file:
+            self.assertEqual(len(in_file.readlines()), 1)
+        self.assertEqual(set(job.id for job in jh.jobs.values()), set([42, 43, 44]))
+        for i in range(3):
+            self.assertIs(jh['test_{}'.format(i)].status, Status.SUCCESS)
+
+    def test_submit_threads(self):
+        import time
+        from slurmy import JobHandler, Status
+        from slurmy.tools.utils import RateLimiter
+        ## Submissions are spread out according to the rate
+        rate_limiter = RateLimiter(10)
+        delays = [rate_limiter.reserve() for i in range(3)]
+        self.assertAlmostEqual(delays[0], 0., places = 2)
+        self.assertAlmostEqual(delays[2], 0.2, places = 2)
+        jh = JobHandler(work_dir = self.test_dir, verbosity = 0, name = 'test_submit_threads', do_snapshot = False, listens = False, submit_threads = 3, submit_rate = 20)
+        for i in range(4):
+            jh.add_job(run_script = self.run_script, name = 'test_{}'.format(i))
+        start = time.time()
+        jh.submit_jobs(make_snapshot = False)
+        self.assertGreaterEqual(time.time() - start, 0.15)
+        with open(self.sbatch_args, 'r') as in_file:
+            self.assertEqual(len(in_file.readlines()), 4)
+        for job_id in [42, 43, 44, 45]:
+            job = jh.jobs[job_id]
+            self.assertEqual(job.id, job_id)
+            self.assertIs(job.status, Status.RUNNING)
+        self.assertEqual(len(jh.jobs._states[Status.RUNNING]), 4)
+
+    def test_cancel_jobs(self):
+        from slurmy import JobHandler, Status
+        jh = JobHandler(work_dir = self.test_dir, verbosity = 0, name = 'test_cancel_jobs', do_snapshot = False, listens = False)
+        for i in range(3):
+            jh.add_job(run_script = self.run_script, name = 'test_{}'.format(i))
+        jh.submit_jobs(make_snapshot = False)
+        ## Skip the delaytime for RUNNING
+        jh.set_jobs_config_attr('delaytimes', {})
+        os.environ['SACCT_STATE'] = 'RUNNING'
+        jh.cancel_jobs(make_snapshot = False)
+        ## The status is queried and all jobs are cancelled with one call each
+        with open(self.sacct_args, 'r') as in_file:
+            self.assertEqual(len(in_file.readlines()), 1)
+        with open(self.scancel_args, 'r') as in_file:
+            scancel_calls = in_file.readlines()
+        self.assertEqual(len(scancel_calls), 1)
+        self.assertEqual(set(scancel_calls[0].split()), set(['42', '43', '44']))
+        for i in range(3):
+            self.assertIs(jh['test_{}'.format(i)].status, Status.CANCELLED)
+        self.assertEqual(len(jh.jobs._states[Status.CANCELLED]), 3)
+
+    def test_listen_func(self):
+        import multiprocessing, time
+        from slurmy import Slurm, Status
+        with open(self.sacct_listen, 'w') as out_file:
+            out_file.write('JobID|JobName|State|ExitCode\n42|test_0|COMPLETED|0:0\n42.batch|batch|COMPLETED|0:0\n43|test_1|RUNNING|0:0\n44|other|FAILED|1:0\n45_[1-3]|test_0|PENDING|0:0\n')
+        listen_func = Slurm.get_listen_func(starttime = time.time(), names = set(['test_0', 'test_1']))
+        results = multiprocessing.Queue()
+        process = multiprocessing.Process(target = listen_func, args = (results, 0.1))
+        process.start()
+        ## Only finished jobs of the session are reported, and only once
+        self.assertEqual(dict(results.get(timeout = 10)), {42: {'status': Status.FINISHED, 'exitcode': '0:0'}})
+        self.assertEqual(dict(results.get(timeout = 10)), {})
+        process.terminate()
+        with open(self.sacct_args, 'r') as in_file:
+            self.assertIn('-S ', in_file.readline())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,203 @@
+import unittest
+import os
+import json
+import threading
+from ..tools import options
+
+
+def _get_stub_server(path = None):
+    ## Stub of slurmrestd, which reports all submitted jobs as completed
+    try:
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        from socketserver import ThreadingMixIn, UnixStreamServer
+    except ImportError:
+        from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+        from SocketServer import ThreadingMixIn, UnixStreamServer
+
+    class Handler(BaseHTTPRequestHandler):
+        ## Keep connections alive
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            BaseHTTPRequestHandler.setup(self)
+            self.server.n_connections += 1
+
+        def log_message(self, format, *args):
+            pass
+
+        def _respond(self, status, result):
+            data = json.dumps(result).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+            job_id = 100 + len(self.server.jobs)
+            self.server.jobs[job_id] = {'job_id': job_id, 'name': payload['job']['name'], 'job_state': ['COMPLETED'], 'exit_code': {'status': ['SUCCESS'], 'return_code': {'set': True, 'infinite': False, 'number': 0}}}
+            self.server.payloads.append(payload)
+            self._respond(200, {'job_id': job_id, 'errors': []})
+
+        def do_GET(self):
+            self.server.requests.append(self.path)
+            job_id = self.path.rsplit('/', 1)[-1]
+            if self.path.endswith('/jobs'):
+                self._respond(200, {'jobs': list(self.server.jobs.values()), 'errors': []})
+            elif '/slurm/' in self.path and job_id.isdigit() and int(job_id) in self.server.jobs:
+                self._respond(200, {'jobs': [self.server.jobs[int(job_id)]], 'errors': []})
+            else:
+                self._respond(404, {'jobs': [], 'errors': [{'error_number': 2017, 'error': 'Invalid job id specified'}]})
+
+        def do_DELETE(self):
+            job_id = int(self.path.rsplit('/', 1)[-1])
+            self.server.jobs[job_id]['job_state'] = ['CANCELLED']
+            self._respond(200, {'errors': []})
+
+    if path is None:
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+        server = Server(('127.0.0.1', 0), Handler)
+    else:
+        class Server(ThreadingMixIn, UnixStreamServer):
+            daemon_threads = True
+            def get_request(self):
+                ## Unix sockets have no client address, which the request handler expects
+                request, client_address = UnixStreamServer.get_request(self)
+                return request, ('local', 0)
+        server = Server(path, Handler)
+    server.jobs = {}
+    server.payloads = []
+    server.requests = []
+    server.n_connections = 0
+    thread = threading.Thread(target = server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    return server
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        from slurmy import test_mode
+        from slurmy.backends import slurmrest
+        test_mode(True)
+        self.test_dir = os.path.join(options.Main.workdir, 'slurmy_unittest/slurmrest')
+        if not os.path.isdir(self.test_dir): os.makedirs(self.test_dir)
+        self.run_script = 'echo "test"'
+        ## Don't reuse connections of other tests
+        slurmrest._clients.clear()
+
+    def tearDown(self):
+        from slurmy import test_mode
+        test_mode(False)
+
+    def _run(self, server, url):
+        from slurmy import JobHandler, Status, SlurmRest
+        jh = JobHandler(work_dir = self.test_dir, verbosity = 0, name = 'test_slurmrest', do_snapshot = False, listens = False, backend = SlurmRest(url = url))
+        for i in range(3):
+            jh.add_job(backend = SlurmRest(url = url, mem = '2G', cpus = 2), run_script = self.run_script, name = 'test_{}'.format(i))
+        jh.submit_jobs(make_snapshot = False)
+        self.assertEqual(set(job.id for job in jh.jobs.values()), set([100, 101, 102]))
+        self.assertEqual(server.payloads[0]['job']['memory_per_node'], {'set': True, 'number': 2048})
+        self.assertEqual(server.payloads[0]['job']['cpus_per_task'], 2)
+        self.assertIn(jh.jobs.test_0.config.backend.run_script, server.payloads[0]['script'])
+        ## Skip the delaytime for RUNNING
+        jh.set_jobs_config_attr('delaytimes', {})
+        jh.submit_jobs(make_snapshot = False)
+        for i in range(3):
+            self.assertIs(jh['test_{}'.format(i)].status, Status.SUCCESS)
+            self.assertEqual(jh['test_{}'.format(i)].exitcode, '0:0')
+        ## The status of all jobs is queried with one request
+        self.assertEqual(server.requests, ['/slurm/v0.0.40/jobs'])
+        ## All requests went through one persistent connection
+        self.assertEqual(server.n_connections, 1)
+
+    def test_tcp(self):
+        server = _get_stub_server()
+        try:
+            self._run(server, 'http://127.0.0.1:{}'.format(server.server_address[1]))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_unix(self):
+        path = os.path.join(self.test_dir, 'slurmrestd.socket')
+        if os.path.exists(path): os.remove(path)
+        server = _get_stub_server(path)
+        try:
+            self._run(server, 'unix://{}'.format(path))
+        finally:
+            server.shutdown()
+            server.server_close()
+            os.remove(path)
+
+    def test_cancel(self):
+        from slurmy.backends.slurmrest import _get_client
+        from slurmy import SlurmRest
+        server = _get_stub_server()
+        url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+        try:
+            backend = SlurmRest(name = 'test', url = url)
+            backend.run_script = self.run_script
+            backend._job_id = 100
+            server.jobs[100] = {'job_id': 100, 'name': 'test', 'job_state': ['RUNNING'], 'exit_code': 0}
+            backend.cancel()
+            self.assertEqual(_get_client(url, None).get_jobs([100, 101]), {100: {'finished': 'CANCELLED', 'success': '0:0'}})
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_status(self):
+        from slurmy import SlurmRest, Status
+        server = _get_stub_server()
+        url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+        try:
+            server.jobs[100] = {'job_id': 100, 'name': 'test', 'job_state': ['RUNNING'], 'exit_code': 0}
+            server.jobs[101] = {'job_id': 101, 'name': 'other', 'job_state': ['COMPLETED'], 'exit_code': 0}
+            backend = SlurmRest(name = 'test', url = url)
+            backend._job_id = 100
+            self.assertIs(backend.status(), Status.RUNNING)
+            ## Only the job itself is queried
+            self.assertEqual(server.requests, ['/slurm/v0.0.40/job/100'])
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_no_array(self):
+        from slurmy import SlurmRest
+        ## Jobs are never grouped into array jobs, which would be submitted one by one without rate limit
+        self.assertIsNone(SlurmRest(name = 'test', url = 'http://127.0.0.1:1').get_array_key())
+
+    def test_time(self):
+        from slurmy.backends.slurmrest import _get_minutes
+        for time_limit, minutes in [(90, 90), ('90', 90), ('10:30', 11), ('2:00:00', 120), ('1-2', 1560), ('1-02:30', 1590), ('1-00:00:01', 1441)]:
+            self.assertEqual(_get_minutes(time_limit), minutes)
+        with self.assertRaises(Exception):
+            _get_minutes('2h')
+
+    def test_retry(self):
+        import socket
+        from slurmy.backends.slurmrest import _get_client
+        ## Connection which sends the request, but loses the response
+        class Connection(object):
+            n_requests = 0
+            def request(self, *args):
+                Connection.n_requests += 1
+            def getresponse(self):
+                raise socket.error('Connection reset by peer')
+            def close(self):
+                pass
+        client = _get_client('http://127.0.0.1:1', None)
+        client._connect = Connection
+        with self.assertRaises(socket.error):
+            client.request('GET', client.get_path('slurm', 'jobs'))
+        self.assertEqual(Connection.n_requests, 2)
+        ## Submissions are not sent again, since they might have been processed already
+        Connection.n_requests = 0
+        with self.assertRaises(socket.error):
+            client.request('POST', client.get_path('slurm', 'job/submit'), {})
+        self.assertEqual(Connection.n_requests, 1)
+
+if __name__ == '__main__':
+    unittest.main()
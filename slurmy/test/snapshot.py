@@ -0,0 +1,49 @@
+
+import unittest
+import os
+from ..tools import options
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        from slurmy import test_mode
+        test_mode(True)
+        self.test_dir = os.path.join(options.Main.workdir, 'slurmy_unittest/snapshot')
+        self.run_script = 'echo "test"'
+
+    def tearDown(self):
+        from slurmy import test_mode
+        test_mode(False)
+
+    def test_pickle(self):
+        from slurmy import JobHandler, SnapshotStore
+        jh = JobHandler(work_dir = self.test_dir, verbosity = 0, name = 'test_snapshot_pickle')
+        jh.add_job(run_script = self.run_script, name = 'test', tags = 'hans')
+        self.assertTrue(os.path.isfile(jh.jobs.test.config.path))
+        jh_loaded = JobHandler(work_dir = self.test_dir, verbosity = 0, name = jh.config.name, use_snapshot = True)
+        self.assertIs(jh_loaded.config.snapshot_store, SnapshotStore.PICKLE)
+        self.assertIn('hans', jh_loaded.jobs.test.tags)
+
+    def test_sqlite(self):
+        from slurmy import JobHandler, SnapshotStore
+        jh = JobHandler(work_dir = self.test_dir, verbosity = 0, name = 'test_snapshot_sqlite', snapshot_store = SnapshotStore.SQLITE)
+        jh.add_jobs([{'run_script': self.run_script, 'name': 'test_{}'.format(i), 'tags': 'hans'} for i in range(3)])
+        self.assertFalse(os.path.isfile(jh.jobs.test_0.config.path))
+        jh_loaded = JobHandler(work_dir = self.test_dir, verbosity = 0, name = jh.config.name, use_snapshot = True)
+        self.assertIs(jh_loaded.config.snapshot_store, SnapshotStore.SQLITE)
+        self.assertEqual(list(jh_loaded.jobs.keys()), ['test_0', 'test_1', 'test_2'])
+        self.assertIn('hans', jh_loaded.jobs.test_2.tags)
+
+    def test_migration(self):
+        from slurmy import JobHandler, SnapshotStore
+        jh = JobHandler(work_dir = self.test_dir, verbosity = 0, name = 'test_snapshot_migration')
+        jh.add_job(run_script = self.run_script, name = 'test')
+        path = jh.jobs.test.config.path
+        jh_migrated = JobHandler(work_dir = self.test_dir, verbosity = 0, name = jh.config.name, use_snapshot = True, snapshot_store = SnapshotStore.SQLITE)
+        self.assertFalse(os.path.isfile(path))
+        jh_loaded = JobHandler(work_dir = self.test_dir, verbosity = 0, name = jh.config.name, use_snapshot = True)
+        self.assertIs(jh_loaded.config.snapshot_store, SnapshotStore.SQLITE)
+        self.assertIn('test', jh_loaded.jobs)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -77,6 +77,91 @@ class Test(unittest.TestCase):
         self.assertIs(status_fail, Status.FAILED)
         self.assertIs(status_success, Status.SUCCESS)
 
+    def test_local_events(self):
+        from slurmy import JobHandler, Status, Type, test_mode
+        test_mode(True)
+        jh = JobHandler(work_dir = self.test_dir, verbosity = 0, name = 'test_local_events', local_max = 2)
+        jh.add_job(run_script = self.run_script_touch_file, name = 'test_parent', tags = 'parent', output = self.output_file, job_type = Type.LOCAL)
+        jh.add_job(run_script = self.run_script_ls_file, name = 'test_child', parent_tags = 'parent', job_type = Type.LOCAL)
+        jh.add_job(run_script = self.run_script_fail, name = 'test_fail', tags = 'fail', job_type = Type.LOCAL)
+        jh.add_job(run_script = self.run_script, name = 'test_cancel', parent_tags = 'fail', job_type = Type.LOCAL)
+        jh.run_jobs(event_driven = True)
+        test_mode(False)
+        self.assertIs(jh.jobs.test_parent.status, Status.SUCCESS)
+        self.assertIs(jh.jobs.test_child.status, Status.SUCCESS)
+        self.assertIs(jh.jobs.test_fail.status, Status.FAILED)
+        self.assertIs(jh.jobs.test_cancel.status, Status.CANCELLED)
+
+    def test_local_chain_fail(self):
+        from slurmy import JobHandler, Status, Type, test_mode
+        test_mode(True)
+        jh = JobHandler(work_dir = self.test_dir, verbosity = 0, name = 'test_local_chain_fail', listens = False, local_max = 1)
+        jh.add_job(run_script = self.run_script_fail, name = 'test_parent', tags = 'parent', job_type = Type.LOCAL)
+        jh.add_job(run_script = self.run_script, name = 'test_child', tags = 'child', parent_tags = 'parent', job_type = Type.LOCAL)
+        jh.add_job(run_script = self.run_script, name = 'test_grandchild', parent_tags = 'child', job_type = Type.LOCAL)
+        jh.run_jobs()
+        test_mode(False)
+        self.assertIs(jh.jobs.test_parent.status, Status.FAILED)
+        self.assertIs(jh.jobs.test_child.status, Status.CANCELLED)
+        self.assertIs(jh.jobs.test_grandchild.status, Status.CANCELLED)
+
+    def test_local_log(self):
+        from slurmy import JobHandler, Status, Type, test_mode
+        test_mode(True)
+        jh = JobHandler(work_dir = self.test_dir, verbosity = 0, name = 'test_local_log', listens = False, local_max = 2, local_affinity = True)
+        ## Output larger than a pipe buffer
+        jh.add_job(run_script = '#!/bin/bash\nfor i in $(seq 20000); do echo "line $i"; done', name = 'test_1', job_type = Type.LOCAL)
+        jh.add_job(run_script = self.run_script, name = 'test_2', job_type = Type.LOCAL)
+        jh.run_jobs()
+        test_mode(False)
+        self.assertIs(jh.jobs.test_1.status, Status.SUCCESS)
+        self.assertIs(jh.jobs.test_2.status, Status.SUCCESS)
+        with open(jh.jobs.test_1.config.backend.log, 'r') as in_file:
+            lines = in_file.read().splitlines()
+        self.assertEqual(len(lines), 20000)
+        self.assertEqual(lines[-1], 'line 20000')
+
+    def test_local_executor(self):
+        import time
+        import subprocess
+        from slurmy.tools.executor import LocalExecutor
+        from slurmy.tools.events import is_sigchld_handled
+        if not hasattr(os, 'sched_setaffinity'): self.skipTest('CPU affinity is not supported')
+        executor = LocalExecutor()
+        log_file = os.path.join(self.test_dir, 'test_local_executor.log')
+        cpus = executor._get_free_cpus(1)
+        process = executor.submit(['bash', '-c', 'grep Cpus_allowed_list /proc/self/status'], log_file, n_cpus = 1)
+        ## Child of someone else, which must not be reaped by the executor
+        other = subprocess.Popen(['true'])
+        while executor.poll(process) is None:
+            time.sleep(0.1)
+        self.assertEqual(process.returncode, 0)
+        self.assertEqual(other.wait(), 0)
+        self.assertEqual(executor._processes, {})
+        ## The process was pinned before it started
+        with open(log_file, 'r') as in_file:
+            self.assertEqual(in_file.read().split()[-1], str(list(cpus)[0]))
+        executor.close()
+        self.assertFalse(is_sigchld_handled())
+
+    def test_local_wakeup(self):
+        import subprocess
+        from slurmy.tools.executor import LocalExecutor
+        from slurmy.tools.events import Wakeup
+        executor = LocalExecutor()
+        wakeup = Wakeup(executor.has_exited)
+        wakeup.start()
+        try:
+            ## Exiting child processes which are not local jobs, e.g. status queries, don't wake up the loop
+            subprocess.check_output(['true'])
+            self.assertFalse(wakeup.wait(0.2))
+            process = executor.submit(['true'], os.path.join(self.test_dir, 'test_local_wakeup.log'))
+            self.assertTrue(wakeup.wait(10))
+            executor.wait(process)
+        finally:
+            wakeup.stop()
+            executor.close()
+
     def test_batch(self):
         from slurmy import JobHandler, Status
         jh = JobHandler(work_dir = self.test_dir, verbosity = 0, name = 'test_batch', listens = False)
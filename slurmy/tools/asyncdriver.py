@@ -0,0 +1,140 @@
+
+## Asyncio-based submission routine of the JobHandler, only compatible with python 3
+
+import asyncio
+import subprocess
+import logging
+from ..backends.utils import get_backend_class
+
+log = logging.getLogger('slurmy')
+
+
+class AsyncDriver(object):
+    """@SLURMY
+    Asyncio-based driver of the JobHandler submission routine. The submission commands of the batch jobs and the bulk status query commands of the backends are executed as asyncio subprocesses, so that their latencies overlap instead of adding up. Backends which don't provide their commands (see Base.get_submit_command and Base.get_status_queries) are processed synchronously as usual.
+
+    * `jh` JobHandler to drive.
+    * `concurrency` Maximum number of backend commands running at a time.
+    """
+    def __init__(self, jh, concurrency = 10):
+        self._jh = jh
+        self._concurrency = max(1, concurrency)
+        ## Semaphore which limits the number of running commands, created in the event loop
+        self._semaphore = None
+
+    def run_loop(self, listeners, interval, retry = False):
+        """@SLURMY
+        Run the submission routine in a new event loop, until all jobs have been processed.
+
+        * `listeners` Started listeners.
+        * `interval` The interval at which the job submission will be done (in seconds).
+        * `retry` Retry jobs in status FAILED or CANCELLED.
+        """
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self.run(listeners, interval, retry = retry))
+        finally:
+            loop.close()
+
+    async def run(self, listeners, interval, retry = False):
+        """@SLURMY
+        Submission routine, until all jobs have been processed.
+
+        * `listeners` Started listeners.
+        * `interval` The interval at which the job submission will be done (in seconds).
+        * `retry` Retry jobs in status FAILED or CANCELLED.
+        """
+        while True:
+            ## Update jobs with listeners
+            for listener in listeners:
+                listener.update_jobs()
+            await self.submit_jobs(retry = retry, make_snapshot = False)
+            if self._jh._finish_cycle(): break
+            await asyncio.sleep(interval)
+
+    async def submit_jobs(self, retry = False, make_snapshot = True):
+        """@SLURMY
+        One submission cycle, see JobHandler.submit_jobs.
+
+        * `retry` Retry jobs in status FAILED or CANCELLED.
+        * `make_snapshot` Make a snapshot of the jobs and the JobHandler after the submission cycle.
+        """
+        jh = self._jh
+        backends = jh._get_polled_backends()
+        await self._update_status_caches(backends)
+        batch_jobs = []
+        with jh._status_polling(backends):
+            for job in jh.jobs._get_actionable(retry = retry):
+                jh._process_job(job, batch_jobs, retry = retry)
+        await self._submit_batch_jobs(batch_jobs)
+        if make_snapshot: jh.update_snapshot()
+
+    async def _run_command(self, command):
+        if self._semaphore is None: self._semaphore = asyncio.Semaphore(self._concurrency)
+        async with self._semaphore:
+            process = await asyncio.create_subprocess_exec(*command, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+            stdout, stderr = await process.communicate()
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, command, output = stdout, stderr = stderr)
+
+        return stdout.decode()
+
+    async def _wait_rate_limit(self):
+        ## Honour the submission rate limit of the JobHandler
+        delay = self._jh._rate_limiter.reserve()
+        if delay > 0: await asyncio.sleep(delay)
+
+    async def _run_submit_command(self, command):
+        await self._wait_rate_limit()
+
+        return await self._run_command(command)
+
+    async def _update_status_caches(self, backends):
+        """@SLURMY
+        Fill the status caches of the backends, with the query commands of all backends running concurrently.
+
+        * `backends` Backends per backend id (see JobHandler._get_polled_backends).
+        """
+        for bid, bid_backends in backends.items():
+            backend_class = get_backend_class(bid)
+            queries = backend_class.get_status_queries(bid_backends)
+            ## Backend doesn't provide its query commands
+            if not queries:
+                backend_class.update_status_cache(bid_backends)
+                continue
+            log.debug('Run {} status queries of backend "{}"'.format(len(queries), bid))
+            outputs = await asyncio.gather(*[self._run_command(command) for command, job_ids in queries])
+            backend_class.set_status_cache(queries, outputs)
+
+    async def _submit_batch_jobs(self, jobs):
+        """@SLURMY
+        Submit batch jobs which are ready for submission, with the submission commands running concurrently. If array submission is activated, the jobs are submitted synchronously as array jobs instead.
+
+        * `jobs` List of batch jobs to be submitted.
+        """
+        jh = self._jh
+        if jh.config.array_submission:
+            jh._submit_batch_jobs(jobs)
+            return
+        commands = []
+        for job in jobs:
+            command = job.config.backend.get_submit_command()
+            ## Backend doesn't provide its submission command
+            if command is None:
+                await self._wait_rate_limit()
+                jh._submit_job(job)
+                continue
+            commands.append((job, command))
+        if not commands: return
+        log.debug('Submit {} batch jobs'.format(len(commands)))
+        outputs = await asyncio.gather(*[self._run_submit_command(command) for job, command in commands], return_exceptions = True)
+        ## Register all successful submissions before raising, so that these jobs are cancelled as well
+        error = None
+        for (job, command), output in zip(commands, outputs):
+            if isinstance(output, Exception):
+                log.error('({}) Submission failed: {}'.format(job.name, output))
+                error = error or output
+                continue
+            job._set_submitted(job.config.backend.parse_submit_output(output))
+            jh._set_submitted(job)
+        if error is not None: raise error
@@ -18,6 +18,10 @@ class Mode(Enum):
     ACTIVE = 0
     PASSIVE = 1
 
+class SnapshotStore(Enum):
+    PICKLE = 0
+    SQLITE = 1
+
 class Theme(Enum):
     Boring = 0
     Lovecraft = 1
@@ -0,0 +1,142 @@
+
+import os
+import select
+import signal
+import errno
+import logging
+
+log = logging.getLogger('slurmy')
+
+## Callbacks which are called on SIGCHLD
+_sigchld_callbacks = []
+## SIGCHLD handler which was installed before the dispatcher
+_sigchld_previous = None
+
+def _on_sigchld(signum, frame):
+    for callback in list(_sigchld_callbacks):
+        callback()
+    ## Chain previous handler
+    if callable(_sigchld_previous): _sigchld_previous(signum, frame)
+
+def is_sigchld_handled():
+    """@SLURMY
+    Check if the SIGCHLD dispatcher is installed.
+
+    Returns if SIGCHLD callbacks are called (bool).
+    """
+
+    return signal.getsignal(signal.SIGCHLD) is _on_sigchld
+
+def add_sigchld_callback(callback):
+    """@SLURMY
+    Register a function to be called on SIGCHLD. A single dispatcher handler is installed for all callbacks, which is only possible in the main thread.
+
+    * `callback` Function without arguments.
+
+    Returns if the SIGCHLD dispatcher is installed (bool).
+    """
+    global _sigchld_previous
+    if callback not in _sigchld_callbacks: _sigchld_callbacks.append(callback)
+    if not is_sigchld_handled():
+        try:
+            _sigchld_previous = signal.signal(signal.SIGCHLD, _on_sigchld)
+        except ValueError:
+            log.debug('Not in the main thread, cannot install SIGCHLD handler')
+            return False
+
+    return True
+
+def remove_sigchld_callback(callback):
+    """@SLURMY
+    Unregister a SIGCHLD callback. The previous SIGCHLD handler is restored if no callbacks are left.
+
+    * `callback` Function which was registered.
+    """
+    global _sigchld_previous
+    if callback in _sigchld_callbacks: _sigchld_callbacks.remove(callback)
+    if _sigchld_callbacks or not is_sigchld_handled(): return
+    try:
+        signal.signal(signal.SIGCHLD, _sigchld_previous if _sigchld_previous is not None else signal.SIG_DFL)
+        _sigchld_previous = None
+    except ValueError:
+        pass
+
+
+class Wakeup(object):
+    """@SLURMY
+    Wakeup channel of the event-driven submission loop, based on a pipe. Listener subprocesses write to it when they report job updates and exiting local processes write to it via a SIGCHLD handler.
+
+    * `is_relevant` Function without arguments, which checks if an exited child process should wake up the loop (e.g. only local job processes). If None, every exited child process wakes up the loop.
+    """
+    def __init__(self, is_relevant = None):
+        self._is_relevant = is_relevant
+        ## Process which owns the loop, forked processes (e.g. listeners) inherit the SIGCHLD handler
+        self._pid = os.getpid()
+        self._read_fd, self._write_fd = os.pipe()
+        for fd in [self._read_fd, self._write_fd]:
+            _set_non_blocking(fd)
+
+    @property
+    def fd(self):
+        """@SLURMY
+        Returns the file descriptor to write to in order to wake up the loop (int).
+        """
+        return self._write_fd
+
+    def start(self):
+        """@SLURMY
+        Install the SIGCHLD handler, so that exiting local processes wake up the loop. Only possible in the main thread, otherwise the loop just wakes up at the latest after the timeout.
+        """
+        add_sigchld_callback(self._on_sigchld)
+
+    def _on_sigchld(self):
+        ## Child processes of forked processes and irrelevant child processes (e.g. status queries of the backends) don't wake up the loop
+        if os.getpid() != self._pid: return
+        if self._is_relevant is not None and not self._is_relevant(): return
+        self.notify()
+
+    def notify(self):
+        """@SLURMY
+        Wake up the loop.
+        """
+        try:
+            os.write(self._write_fd, b'x')
+        except OSError:
+            ## Pipe is full, the loop will wake up anyway
+            pass
+
+    def wait(self, timeout = None):
+        """@SLURMY
+        Wait until the loop is woken up or the timeout is reached.
+
+        * `timeout` Maximum time to wait (in seconds). If None, wait until woken up.
+
+        Returns if the loop was woken up (bool).
+        """
+        try:
+            ready = select.select([self._read_fd], [], [], timeout)[0]
+        except (select.error, OSError) as e:
+            ## Interrupted by a signal (only in python 2, python 3 retries the select)
+            if e.args[0] != errno.EINTR: raise
+            ready = [self._read_fd]
+        if not ready: return False
+        ## Drain the pipe
+        try:
+            while os.read(self._read_fd, 4096): pass
+        except OSError:
+            pass
+
+        return True
+
+    def stop(self):
+        """@SLURMY
+        Unregister from SIGCHLD and close the pipe.
+        """
+        remove_sigchld_callback(self._on_sigchld)
+        os.close(self._read_fd)
+        os.close(self._write_fd)
+
+def _set_non_blocking(fd):
+    import fcntl
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
@@ -0,0 +1,206 @@
+
+import os
+import signal
+import subprocess as sp
+import logging
+from .events import add_sigchld_callback, remove_sigchld_callback, is_sigchld_handled
+
+log = logging.getLogger('slurmy')
+
+
+class LocalExecutor(object):
+    """@SLURMY
+    Executor of local job processes. The output of the processes is written directly to their log files. Finished processes are reaped whenever a SIGCHLD was received, by asking the kernel which children exited instead of polling every process in every submission cycle. Processes can be pinned to a set of CPUs, which are not shared with other local processes of the executor.
+    """
+    def __init__(self):
+        ## Running processes ({pid: process})
+        self._processes = {}
+        ## Log file handles of the running processes ({process: file})
+        self._log_files = {}
+        ## CPUs assigned to the running processes ({process: set(cpus)})
+        self._cpus = {}
+        ## Flag which is set on SIGCHLD, starts set to do a first reaping pass
+        self._sigchld = True
+
+    def _on_sigchld(self):
+        ## Only do a reaping pass if one of the processes of the executor exited
+        if self.has_exited(): self._sigchld = True
+
+    def has_exited(self):
+        """@SLURMY
+        Check if one of the running processes of the executor exited, without reaping it. Exited child processes which are not managed by the executor are ignored.
+
+        Returns if a process exited (bool).
+        """
+        ## Without waitid (python 2), it can't be checked without reaping
+        if not hasattr(os, 'waitid'): return True
+        for pid in list(self._processes):
+            try:
+                if os.waitid(os.P_PID, pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is not None: return True
+            except ChildProcessError:
+                ## Already reaped, e.g. by the process object itself
+                return True
+
+        return False
+
+    @staticmethod
+    def get_available_cpus():
+        """@SLURMY
+        Returns the CPUs the slurmy process is allowed to run on (set(int)).
+        """
+        if hasattr(os, 'sched_getaffinity'):
+            return set(os.sched_getaffinity(0))
+
+        return set(range(os.cpu_count() or 1))
+
+    @staticmethod
+    def get_available_memory():
+        """@SLURMY
+        Returns the total memory of the machine in MB, according to /proc/meminfo (float), or None if it can't be determined.
+        """
+        try:
+            with open('/proc/meminfo', 'r') as in_file:
+                for line in in_file:
+                    if not line.startswith('MemTotal:'): continue
+                    ## Given in kB
+                    return float(line.split()[1]) / 1024.
+        except (IOError, IndexError, ValueError):
+            pass
+
+        return None
+
+    def _get_free_cpus(self, n_cpus):
+        used_cpus = set()
+        for cpus in self._cpus.values():
+            used_cpus |= cpus
+        free_cpus = sorted(LocalExecutor.get_available_cpus() - used_cpus)
+        if len(free_cpus) < n_cpus: return None
+
+        return set(free_cpus[:n_cpus])
+
+    def submit(self, command, log_file, n_cpus = None):
+        """@SLURMY
+        Start a local process.
+
+        * `command` Command to execute (list).
+        * `log_file` Path of the log file, stdout and stderr of the process are written to it.
+        * `n_cpus` Number of CPUs the process is pinned to. If None, or not enough CPUs are free, the process is not pinned.
+
+        Returns the process (subprocess.Popen).
+        """
+        add_sigchld_callback(self._on_sigchld)
+        cpus = None
+        if n_cpus and hasattr(os, 'sched_setaffinity'):
+            cpus = self._get_free_cpus(n_cpus)
+            if cpus is None: log.debug('Not enough free CPUs to pin process to {} CPUs'.format(n_cpus))
+        out_file = open(log_file, 'w')
+        try:
+            ## The affinity is set in the child before the command is executed, so that the process and all its children inherit it
+            process = sp.Popen(command, stdout = out_file, stderr = sp.STDOUT, start_new_session = True, preexec_fn = _get_set_affinity(cpus))
+        except:
+            out_file.close()
+            raise
+        self._processes[process.pid] = process
+        self._log_files[process] = out_file
+        if cpus is not None: self._cpus[process] = cpus
+
+        return process
+
+    def close(self):
+        """@SLURMY
+        Unregister the SIGCHLD callback of the executor, which is registered again with the next submission. Processes which are still running are reaped by polling in the meantime.
+        """
+        remove_sigchld_callback(self._on_sigchld)
+        self._sigchld = True
+
+    def _reap(self):
+        ## Reset flag first, so that SIGCHLDs during the pass are not lost
+        self._sigchld = False
+        ## Ask the kernel for exited children without reaping them, since other children of the slurmy process (e.g. listeners or batch commands) must be reaped by their owners
+        while hasattr(os, 'waitid'):
+            try:
+                result = os.waitid(os.P_ALL, 0, os.WEXITED | os.WNOHANG | os.WNOWAIT)
+            except ChildProcessError:
+                return
+            ## No exited children left
+            if result is None: return
+            process = self._processes.get(result.si_pid)
+            ## Exited child of someone else, which blocks the queue until it is reaped, fall back to polling all processes
+            if process is None or process.poll() is None: break
+            self._release(process)
+        for process in list(self._processes.values()):
+            if process.poll() is None: continue
+            self._release(process)
+
+    def _release(self, process):
+        self._processes.pop(process.pid, None)
+        self._cpus.pop(process, None)
+        out_file = self._log_files.pop(process, None)
+        if out_file is not None: out_file.close()
+
+    def poll(self, process):
+        """@SLURMY
+        Get the exitcode of a process, if it finished.
+
+        * `process` Process started by the executor.
+
+        Returns the exitcode (int), or None if the process is still running.
+        """
+        ## Without SIGCHLD handler (e.g. outside of the main thread or replaced by someone else), every call reaps
+        if self._sigchld or not is_sigchld_handled():
+            self._reap()
+        if self._processes.get(process.pid) is process: return None
+
+        return process.returncode
+
+    def wait(self, process):
+        """@SLURMY
+        Wait for a process to finish.
+
+        * `process` Process started by the executor.
+
+        Returns the exitcode (int).
+        """
+        exitcode = process.wait()
+        self._release(process)
+
+        return exitcode
+
+    def terminate(self, process):
+        """@SLURMY
+        Terminate a process, together with all processes in its process group.
+
+        * `process` Process started by the executor.
+        """
+        self.terminate_all([process])
+
+    def terminate_all(self, processes):
+        """@SLURMY
+        Terminate processes in one sweep, together with all processes in their process groups (each process is started in its own session).
+
+        * `processes` List of processes started by the executor.
+        """
+        for process in processes:
+            if process.poll() is not None: continue
+            try:
+                os.killpg(process.pid, signal.SIGTERM)
+            except OSError:
+                ## Process group might already be gone
+                pass
+        ## Processes which didn't exit yet stay tracked, so that they are reaped in one of the next reaping passes
+        for process in processes:
+            if process.poll() is None: continue
+            self._release(process)
+
+def _get_set_affinity(cpus):
+    if cpus is None: return None
+    def set_affinity():
+        try:
+            os.sched_setaffinity(0, cpus)
+        except OSError:
+            pass
+
+    return set_affinity
+
+## Executor instance shared by all local jobs
+Local = LocalExecutor()
@@ -0,0 +1,183 @@
+
+## Minimal inotify bindings via ctypes, used to watch output and label file directories on local file systems
+
+import os
+import sys
+import struct
+import select
+import errno
+import logging
+
+log = logging.getLogger('slurmy')
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+## Events of files appearing in or disappearing from a directory
+_watch_mask = IN_CREATE | IN_MOVED_TO | IN_ATTRIB | IN_CLOSE_WRITE | IN_DELETE | IN_MOVED_FROM | IN_DELETE_SELF | IN_MOVE_SELF
+_event_header = struct.Struct('iIII')
+
+## File systems on which inotify doesn't see changes made on other hosts
+_network_fstypes = set(['nfs', 'nfs4', 'cifs', 'smbfs', 'smb3', 'afs', 'gpfs', 'lustre', 'ceph', 'glusterfs', 'beegfs', 'fuse', 'fuse.sshfs', 'fuse.glusterfs', 'fuse.ceph', 'fuse.gcsfuse', 'panfs', 'pvfs2', '9p'])
+
+_libc = None
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        import ctypes, ctypes.util
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno = True)
+
+    return _libc
+
+def is_available():
+    """@SLURMY
+    Check if inotify can be used on this system.
+
+    Returns if inotify is available (bool).
+    """
+    if not sys.platform.startswith('linux'): return False
+    try:
+        libc = _get_libc()
+        return hasattr(libc, 'inotify_init1') and hasattr(libc, 'inotify_add_watch')
+    except (OSError, ImportError):
+        return False
+
+def get_fstype(path):
+    """@SLURMY
+    Get the file system type of a path, according to /proc/mounts.
+
+    * `path` Path to get the file system type for.
+
+    Returns the file system type (str), or None if it can't be determined.
+    """
+    path = os.path.realpath(path)
+    fstype = None
+    mount_length = -1
+    try:
+        with open('/proc/mounts', 'r') as in_file:
+            for line in in_file:
+                fields = line.split()
+                if len(fields) < 3: continue
+                ## Spaces in mount points are escaped as \040
+                mount_point = fields[1].replace('\\040', ' ')
+                if not (path == mount_point or path.startswith(mount_point.rstrip('/')+'/')): continue
+                if len(mount_point) <= mount_length: continue
+                mount_length = len(mount_point)
+                fstype = fields[2]
+    except IOError:
+        return None
+
+    return fstype
+
+def is_local_fs(path):
+    """@SLURMY
+    Check if a path is on a file system which delivers inotify events for all changes, i.e. not a network file system.
+
+    * `path` Path to check.
+
+    Returns if the file system is local (bool).
+    """
+    fstype = get_fstype(path)
+    if fstype is None: return False
+
+    return (fstype not in _network_fstypes and not fstype.startswith('fuse.'))
+
+class InotifyWatcher(object):
+    """@SLURMY
+    Watcher of directories, which collects the file creation and deletion events via inotify.
+    """
+    def __init__(self):
+        libc = _get_libc()
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            err = _get_errno()
+            raise OSError(err, os.strerror(err))
+        ## Watched directories ({watch descriptor: folder})
+        self._folders = {}
+
+    @property
+    def fd(self):
+        return self._fd
+
+    def add_folder(self, folder):
+        """@SLURMY
+        Watch a directory.
+
+        * `folder` Path of the directory.
+
+        Returns if the directory is watched (bool).
+        """
+        path = folder.encode(sys.getfilesystemencoding()) if not isinstance(folder, bytes) else folder
+        wd = _get_libc().inotify_add_watch(self._fd, path, _watch_mask)
+        if wd < 0:
+            log.debug('Could not watch folder {}: {}'.format(folder, os.strerror(_get_errno())))
+            return False
+        self._folders[wd] = folder
+
+        return True
+
+    def wait(self, timeout = None):
+        """@SLURMY
+        Wait for events.
+
+        * `timeout` Maximum time to wait (in seconds). If None, wait until events arrive.
+
+        Returns if events are available (bool).
+        """
+        try:
+            ready = select.select([self._fd], [], [], timeout)[0]
+        except (select.error, OSError) as e:
+            if e.args[0] != errno.EINTR: raise
+            return False
+
+        return bool(ready)
+
+    def read(self):
+        """@SLURMY
+        Read all available events, without blocking.
+
+        Returns list of events as tuples of directory, file name and event mask ([(str, str, int)]). The directory is None for queue overflow events.
+        """
+        events = []
+        while True:
+            try:
+                buf = os.read(self._fd, 65536)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK): break
+                raise
+            if not buf: break
+            offset = 0
+            while offset + _event_header.size <= len(buf):
+                wd, mask, cookie, length = _event_header.unpack_from(buf, offset)
+                offset += _event_header.size
+                name = buf[offset:offset+length].rstrip(b'\0').decode(sys.getfilesystemencoding())
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    events.append((None, None, mask))
+                    continue
+                folder = self._folders.get(wd)
+                if mask & IN_IGNORED:
+                    self._folders.pop(wd, None)
+                if folder is None: continue
+                events.append((folder, name, mask))
+
+        return events
+
+    def close(self):
+        os.close(self._fd)
+
+def _get_errno():
+    import ctypes
+
+    return ctypes.get_errno()
@@ -1,11 +1,11 @@
 
-import subprocess as sp
 import os
-import pickle
 import logging
 import time
 from .defs import Status, Type, Mode
 from .utils import set_update_properties, update_decorator
+from .snapshot import PickleStore
+from .executor import Local as local_executor
 from . import options
 
 log = logging.getLogger('slurmy')
@@ -112,12 +112,16 @@ class Job(object):
     Job class that holds the job configuration and status information. Internally stores most information in the JobConfig class, which is stored on disk as a snapshot of the Job. Jobs are not meant to be set up directly but rather via JobHandler.add_job().
 
     * `config` The JobConfig instance that defines the initial job setup.
+    * `snapshot_store` Snapshot store the job snapshot is written to. By default, the snapshot is written into its own pickle file.
     """
 
-    def __init__(self, config):
+    def __init__(self, config, snapshot_store = None):
         self.config = config
         ## Variables that are not picklable
         self._local_process = None
+        self._snapshot_store = snapshot_store or PickleStore()
+        ## JobContainer the job is registered in, which keeps track of the tags
+        self._container = None
 
     def __repr__(self):
         print_string = 'Job "{}"\n'.format(self.name)
@@ -149,11 +153,6 @@ class Job(object):
         if os.path.isfile(self.config.backend.log): os.remove(self.config.backend.log)
         self.update_snapshot()
 
-    def _write_log(self):
-        log.debug('({}) Write log file'.format(self.name))
-        with open(self.config.backend.log, 'w') as out_file:
-            out_file.write(self._local_process.stdout.read())
-
     def wait(self):
         """@SLURMY
         If job is locally processing, wait for the process to finish.
@@ -161,7 +160,7 @@ class Job(object):
         if self._local_process is None:
             log.warning('({}) No local process present to wait for...'.format(self.name))
             return
-        self._local_process.wait()
+        local_executor.wait(self._local_process)
 
     def update_snapshot(self):
         """@SLURMY
@@ -176,8 +175,7 @@ class Job(object):
         log.debug('({}) Update snapshot'.format(self.name))
         ## Check status again
         self.get_status()
-        with open(self.config.path, 'wb') as out_file:
-            pickle.dump(self.config, out_file)
+        self._snapshot_store.write(self.config)
         ## Reset update flag
         self.config.update = False
 
@@ -189,6 +187,7 @@ class Job(object):
         * `is_parent` Mark tag as parent.
         """
         self.config.add_tag(tag, is_parent)
+        if self._container is not None: self._container._sync_tags(self)
 
     def add_tags(self, tags, is_parent = False):
         """@SLURMY
@@ -198,6 +197,7 @@ class Job(object):
         * `is_parent` Mark tags as parent.
         """
         self.config.add_tags(tags, is_parent)
+        if self._container is not None: self._container._sync_tags(self)
 
     def has_tag(self, tag):
         """@SLURMY
@@ -221,10 +221,12 @@ class Job(object):
 
         return bool(self.tags & tags)
 
-    def submit(self):
+    def submit(self, n_cpus = None):
         """@SLURMY
         Submit the job.
 
+        * `n_cpus` Number of CPUs a local process is pinned to. If None, the process is not pinned.
+
         Returns the job status (Status).
         """
         if self.status != Status.CONFIGURED:
@@ -233,13 +235,23 @@ class Job(object):
         if self.type == Type.LOCAL:
             command = self._get_local_command()
             log.debug('({}) Submit local process with command {}'.format(self.name, command))
-            self._local_process = sp.Popen(command, stdout = sp.PIPE, stderr = sp.STDOUT, start_new_session = True, universal_newlines = True)
+            ## Output is written directly to the log file
+            self._local_process = local_executor.submit(command, self.config.backend.log, n_cpus = n_cpus)
+            self.status = Status.RUNNING
         else:
-            self.config.job_id = self.config.backend.submit()
-        self.status = Status.RUNNING
+            self._set_submitted(self.config.backend.submit())
 
         return self.status
 
+    def _set_submitted(self, job_id):
+        """@SLURMY
+        Set the batch job to submitted. Used directly if the job was submitted together with other jobs, e.g. in an array job.
+
+        * `job_id` ID of the submitted batch job.
+        """
+        self.config.job_id = job_id
+        self.status = Status.RUNNING
+
     def cancel(self, clear_retry = False):
         """@SLURMY
         Cancel the job.
@@ -257,16 +269,25 @@ class Job(object):
                 self._stop_local()
             else:
                 self.config.backend.cancel()
+
+        return self._set_cancelled(clear_retry = clear_retry)
+
+    def _set_cancelled(self, clear_retry = False):
+        """@SLURMY
+        Set the job to cancelled. Used directly if the job was stopped together with other jobs, e.g. in a bulk cancellation.
+
+        * `clear_retry` Deactivate automatic retry mechanism
+
+        Returns the job status (Status).
+        """
         self.status = Status.CANCELLED
         if clear_retry: self.config.max_retries = 0
 
         return self.status
 
     def _stop_local(self):
-        ## Close stdout streaming
-        self._local_process.stdout.close()
-        ## Terminate process
-        self._local_process.terminate()
+        ## Terminate process and close the log file
+        local_executor.terminate(self._local_process)
 
     def _retry(self, force = False, submit = True, ignore_max_retries = False, job_type = None):
         """@SLURMY
@@ -345,8 +366,11 @@ class Job(object):
             if self.mode == Mode.PASSIVE:
                 log.debug('({}) Job in PASSIVE mode, skip FINISHED evaluation and return current status'.format(self.name))
                 return self.status
-            ## Success evaluation
-            if self._is_success():
+            ## Success evaluation, which can be pending if the success file of the output isn't found yet, unless the check is forced
+            success = self._is_success(pending = not force_success_check)
+            if success is None:
+                log.debug('({}) Success evaluation is pending'.format(self.name))
+            elif success:
                 self.status = Status.SUCCESS
             else:
                 self.status = Status.FAILED
@@ -354,20 +378,22 @@ class Job(object):
         return self.status
 
     def _get_local_status(self):
-        exitcode = self._local_process.poll()
+        exitcode = local_executor.poll(self._local_process)
         if exitcode is not None:
             self.status = Status.FINISHED
             self.exitcode = exitcode
 
-    def _is_success(self):
+    def _is_success(self, pending = False):
         success = False
         if self.config.success_func is None:
             if self.type == Type.LOCAL:
                 success = (self.exitcode == 0)
             else:
                 success = (self.exitcode == self.config.backend._successcode)
+        elif pending and hasattr(self.config.success_func, '_check_pending'):
+            success = self.config.success_func._check_pending(self.config)
         else:
-            success = self.config.success_func(self.config)
+            success = bool(self.config.success_func(self.config))
 
         return success
 
@@ -377,9 +403,8 @@ class Job(object):
         """
         if self.config.post_func is not None:
             self.config.post_func(self.config)
-        ## Write local job log
-        if self.type == Type.LOCAL:
-            self._write_log()
+        ## Make sure the local process is stopped and its log file is closed, if the local job was submitted
+        if self.type == Type.LOCAL and self._local_process is not None:
             self._stop_local()
 
     def edit_script(self, editor = None):
@@ -462,7 +487,7 @@ class Job(object):
     @property
     def id(self):
         """@SLURMY
-        Returns the ID of the job (int).
+        Returns the ID of the job (int or str).
         """
 
         return self.config.job_id
@@ -505,6 +530,8 @@ class Job(object):
             self.complete()
         ## Set status
         self.config.status = status
+        ## Keep the status bookkeeping of the container in sync, also for changes outside of the submission cycle (e.g. a reset)
+        if self._container is not None: self._container._update_job_status(self, skip_eval = True)
 
     @property
     def exitcode(self):
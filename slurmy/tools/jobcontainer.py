@@ -14,50 +14,124 @@ class JobContainer(dict, object):
         self._tags[Type.LOCAL] = set()
         self._local = set()
         self._ids = {}
+        self._outputs = {}
+        ## Jobs which have the tag as parent tag ({tag: [job names]})
+        self._children = {}
+        ## Names of the jobs with a tag per status ({tag: {Status: set(job names)}})
+        self._tag_states = {}
+        ## Tags and parent tags of the jobs, as registered in the tag bookkeeping ({job name: set(tags)})
+        self._job_tags = {}
+        self._job_parent_tags = {}
+        ## Position of the jobs in the container, to process subsets of jobs in order
+        self._index = {}
+        ## Names of jobs which changed their status, only recorded if set to a set
+        self._changed = None
 
     def add_id(self, job_id, job_name):
         self._ids[job_id] = job_name
 
+    def _get_mapped_jobs(self, map_property, key):
+        """@SLURMY
+        Get the jobs which are mapped to key by the job property map_property, using the job id and output indexes.
+
+        * `map_property` Property name of the jobs (e.g. "id" or "output").
+        * `key` Value of the property.
+
+        Returns list of jobs ([Job]).
+        """
+        if map_property == 'id':
+            if key not in self._ids: return []
+            return [super(JobContainer, self).__getitem__(self._ids[key])]
+        elif map_property == 'output':
+            return [super(JobContainer, self).__getitem__(name) for name in self._outputs.get(key, [])]
+        else:
+            return [job for job in self.values() if getattr(job, map_property) == key]
+
     def add(self, job):
         ## Add job to respective tag list
-        tags = job.tags
-        for tag in tags:
-            if tag not in self._tags:
-                ## Add tag entry in tags dictionary
-                self._tags[tag] = []
-            self._tags[tag].append(job)
+        self._job_tags[job.name] = set()
+        self._job_parent_tags[job.name] = set()
+        self._sync_tags(job)
+        ## Add job to output index
+        self._add_output(job)
+        self._index[job.name] = len(self._index)
+        ## Tag changes of the job are passed on to the container
+        job._container = self
+        ## Register the job in the status bookkeeping with its current status
+        self._update_job_status(job, skip_eval = True)
         ## Add job to internal dictionary and as a property
         self[job.name] = job
 
-    def get(self, tags = None, states = None):
+    def get(self, tags = None, states = None, evaluate = False):
         """@SLURMY
-        Get the list of jobs.
+        Get the list of jobs. By default, the selection is done on the tag and status bookkeeping of the container, without evaluating the job status.
 
         * `tags` Tags that the jobs must match to (single string or list of strings).
         * `states` Job states that the jobs must match to (single Status object or list of Status objects).
+        * `evaluate` Evaluate the status of each job for the states selection (might query the batch system or run the success_func of the jobs).
 
         Returns list of jobs ([Job]).
         """
-        if tags is not None:
-            if not (isinstance(tags, list) or isinstance(tags, tuple) or isinstance(tags, set)):
-                tags = [tags]
-            if not isinstance(tags, set):
-                tags = set(tags)
-        if states is not None:
-            if not (isinstance(states, list) or isinstance(states, tuple) or isinstance(states, set)):
-                states = [states]
-            if not isinstance(states, set):
-                states = set(states)
-        job_list = []
-        for job in self.values():
-            if tags is not None and not job.has_tags(tags): continue
-            if states is not None and job.get_status() not in states: continue
-            job_list.append(job)
+        if tags is not None: tags = _get_set(tags)
+        if states is not None: states = _get_set(states)
+        if evaluate:
+            job_list = []
+            for job in self.values():
+                if tags is not None and not job.has_tags(tags): continue
+                if states is not None and job.get_status() not in states: continue
+                job_list.append(job)
+
+            return job_list
+        if tags is None and states is None:
+            return list(self.values())
+        states = states or list(Status)
+        names = set()
+        if tags is None:
+            for status in states:
+                names |= self._states[status]
+        else:
+            for tag in tags:
+                if tag not in self._tag_states: continue
+                for status in states:
+                    names |= self._tag_states[tag][status]
+
+        return self._get_ordered(names)
+
+    def _sync_tags(self, job):
+        """@SLURMY
+        Register the tags and parent tags of a job in the tag bookkeeping, which were added since the job was registered (e.g. with Job.add_tag).
 
-        return job_list
+        * `job` Job to synchronise.
+        """
+        name = job.name
+        job_tags = self._job_tags[name]
+        job_parent_tags = self._job_parent_tags[name]
+        if job.tags == job_tags and job.parent_tags == job_parent_tags: return
+        ## Status of the job in the bookkeeping (None if not registered yet)
+        current_status = None
+        for status in Status:
+            if name in self._states[status]:
+                current_status = status
+                break
+        for tag in job.tags - job_tags:
+            if tag not in self._tags:
+                ## Add tag entry in tags dictionary
+                self._tags[tag] = []
+                self._tag_states[tag] = dict((status, set()) for status in Status)
+            self._tags[tag].append(job)
+            if current_status is not None: self._tag_states[tag][current_status].add(name)
+            job_tags.add(tag)
+        ## Add job to the children of its parent tags
+        for tag in job.parent_tags - job_parent_tags:
+            if tag not in self._children:
+                self._children[tag] = []
+            self._children[tag].append(name)
+            job_parent_tags.add(tag)
 
     def _update_job_status(self, job, skip_eval = False, force_success_check = False):
         name = job.name
+        ## Tags might have been added to the job config directly
+        self._sync_tags(job)
         new_status = job.get_status(skip_eval = skip_eval, force_success_check = force_success_check)
         ## If old and new status are the same, do nothing
         if name in self._states[new_status]: return
@@ -65,8 +139,68 @@ class JobContainer(dict, object):
         for status in Status:
             if name not in self._states[status]: continue
             self._states[status].remove(name)
+            for tag in job.tags:
+                self._tag_states[tag][status].discard(name)
         ## Add new one
         self._states[new_status].add(name)
+        for tag in job.tags:
+            self._tag_states[tag][new_status].add(name)
+        if self._changed is not None: self._changed.add(name)
+
+    def _get_actionable(self, tags = None, retry = False):
+        """@SLURMY
+        Get the jobs which can still be processed in the submission cycle, according to the status bookkeeping. These are the jobs in CONFIGURED, RUNNING and FINISHED, and the jobs in FAILED and CANCELLED which will be retried.
+
+        * `tags` Tags that the jobs must match to (single string or list of strings).
+        * `retry` Consider all jobs in FAILED and CANCELLED, regardless of their retry configuration.
+
+        Returns list of jobs in the order they were added ([Job]).
+        """
+        names = self._states[Status.CONFIGURED] | self._states[Status.RUNNING] | self._states[Status.FINISHED]
+        for status in [Status.FAILED, Status.CANCELLED]:
+            for name in self._states[status]:
+                job = self[name]
+                ## Also take jobs whose status was changed outside of the bookkeeping
+                if retry or job._do_retry() or job.status != status:
+                    names.add(name)
+        jobs = self._get_ordered(names)
+        if tags is not None:
+            tags = _get_set(tags)
+            jobs = [job for job in jobs if job.has_tags(tags)]
+
+        return jobs
+
+    def _is_tag_success(self, tag):
+        """@SLURMY
+        Check if all jobs with the tag are in status SUCCESS, according to the status bookkeeping.
+
+        * `tag` Tag of the jobs.
+
+        Returns if all jobs are in SUCCESS (bool).
+        """
+        return len(self._tag_states[tag][Status.SUCCESS]) == len(self._tags[tag])
+
+    def _get_tag_failed(self, tag):
+        """@SLURMY
+        Get the jobs with the tag which are in status FAILED or CANCELLED, according to the status bookkeeping.
+
+        * `tag` Tag of the jobs.
+
+        Returns list of jobs ([Job]).
+        """
+        tag_states = self._tag_states[tag]
+
+        return [self[name] for name in tag_states[Status.FAILED] | tag_states[Status.CANCELLED]]
+
+    def _get_ordered(self, names):
+        """@SLURMY
+        Get the jobs for the given job names, in the order they were added to the container.
+
+        * `names` Job names.
+
+        Returns list of jobs ([Job]).
+        """
+        return [self[name] for name in sorted(names, key = self._index.__getitem__)]
 
     def _update_job_states(self, **kwargs):
         for job in self.values():
@@ -84,6 +218,19 @@ class JobContainer(dict, object):
             if name not in self._tags[Type.LOCAL]: return
             self._tags[Type.LOCAL].remove(name)
 
+    def _add_output(self, job):
+        output = job.output
+        if output is None: return
+        if output not in self._outputs:
+            self._outputs[output] = []
+        self._outputs[output].append(job.name)
+
+    def _update_job_outputs(self):
+        ## Rebuild the output index, since job outputs can be changed in the job configs
+        self._outputs = {}
+        for job in self.values():
+            self._add_output(job)
+
     def _update_job_tags(self):
         for job in self.values():
             self._update_tags(job)
@@ -137,6 +284,14 @@ class JobContainer(dict, object):
         ## Check own dict as well as the job ids dict for the key
         return (super(JobContainer, self).__contains__(key) or (key in self._ids))
         
+def _get_set(arg):
+    if not (isinstance(arg, list) or isinstance(arg, tuple) or isinstance(arg, set)):
+        arg = [arg]
+    if not isinstance(arg, set):
+        arg = set(arg)
+
+    return arg
+
 ## Property for status printing
 def _get_status_property(status, docstring):
     def getter(self):
@@ -2,19 +2,25 @@
 from __future__ import print_function
 import os
 import time
+import heapq
 from sys import stdout, version_info
 import pickle
 import logging
-from .defs import Status, Type, Theme, Mode
+from contextlib import contextmanager
+from collections import OrderedDict
+from .defs import Status, Type, Theme, Mode, SnapshotStore
 from .job import Job, JobConfig
 from .namegenerator import NameGenerator
 from . import options
 from ..backends.utils import get_backend, get_backend_class
 from .parser import Parser
-from .utils import SuccessTrigger, FinishedTrigger, get_input_func, set_update_properties, make_dir, remove_content
-from .jobcontainer import JobContainer
+from .executor import LocalExecutor, Local as local_executor
+from .utils import SuccessTrigger, FinishedTrigger, RateLimiter, get_input_func, set_update_properties, make_dir, remove_content, _directory_cache
+from .jobcontainer import JobContainer, _get_set
 from .utils import update_decorator
 from .listener import Listener
+from .events import Wakeup
+from .snapshot import get_snapshot_store
 from .printer import Printer
 
 log = logging.getLogger('slurmy')
@@ -30,9 +36,18 @@ class JobHandlerConfig(object):
     ## Properties for which custom getter/setter will be defined (without prepending "_") which incorporate the update tagging
     _properties = ['_name_gen', '_name', '_script_dir', '_log_dir', '_output_dir', '_snapshot_dir', '_tmp_dir', '_path',
                    '_success_func', '_finished_func', '_local_max', '_local_dynamic', '_max_retries', '_run_max', '_backend',
-                   '_do_snapshot', '_wrapper', '_job_config_paths', '_listens', '_output_max_attempts']
+                   '_do_snapshot', '_wrapper', '_job_config_paths', '_listens', '_output_max_attempts', '_snapshot_store',
+                   '_array_submission', '_inotify', '_local_affinity', '_local_resources', '_submit_threads', '_submit_rate']
+    ## Default for sessions which were stored before the snapshot store was configurable
+    _snapshot_store = SnapshotStore.PICKLE
+    _array_submission = False
+    _inotify = False
+    _local_affinity = False
+    _local_resources = False
+    _submit_threads = 0
+    _submit_rate = None
 
-    def __init__(self, name = None, backend = None, work_dir = None, local_max = 0, local_dynamic = False, success_func = None, finished_func = None, max_retries = 0, theme = Theme.Lovecraft, run_max = None, do_snapshot = True, wrapper = None, listens = True, output_max_attempts = 5):
+    def __init__(self, name = None, backend = None, work_dir = None, local_max = 0, local_dynamic = False, success_func = None, finished_func = None, max_retries = 0, theme = Theme.Lovecraft, run_max = None, do_snapshot = True, wrapper = None, listens = True, output_max_attempts = 5, snapshot_store = SnapshotStore.PICKLE, array_submission = False, inotify = False, local_affinity = False, local_resources = False, submit_threads = 0, submit_rate = None):
         ## Static variables
         self._name_gen = NameGenerator(name = name, theme = theme)
         self._name = self._name_gen.name
@@ -54,6 +69,13 @@ class JobHandlerConfig(object):
         self._wrapper = wrapper
         self._listens = listens
         self._output_max_attempts = output_max_attempts
+        self._snapshot_store = snapshot_store
+        self._array_submission = array_submission
+        self._inotify = inotify
+        self._local_affinity = local_affinity
+        self._local_resources = local_resources
+        self._submit_threads = submit_threads
+        self._submit_rate = submit_rate
         ## Dynamic variables
         self._job_config_paths = []
 
@@ -108,9 +130,16 @@ class JobHandler(object):
     * `wrapper` Default run script wrapper used for the job setup.
     * `profiler` Profiler to be used for profiling.
     * `printer_bar_mode` Turn bar mode of the printer on/off.
+    * `snapshot_store` Snapshot store (SnapshotStore) used for the job snapshots. SnapshotStore.PICKLE writes one pickle file per job, SnapshotStore.SQLITE stores all jobs of the session in a single SQLite file. If a snapshot is loaded with a different snapshot store, it is migrated to it.
+    * `array_submission` Submit batch jobs which are ready at the same time and share the same batch options together as array jobs, if supported by the backend.
+    * `inotify` Detect output files and FINISHED/SUCCESS label files with inotify instead of scanning their directories. Only used for directories on local file systems, falls back to scanning otherwise.
+    * `local_affinity` Pin each local job to its own share of the available CPUs (available CPUs divided by local_max), so that local jobs don't compete for the same cores.
+    * `local_resources` Only run jobs locally as long as the CPUs and memory requested by their backends (cpus and mem options) fit into the CPUs and memory of the machine, in addition to the local_max limit.
+    * `submit_threads` Number of threads which submit batch jobs concurrently. If 0 or 1, batch jobs are submitted one after the other.
+    * `submit_rate` Maximum number of batch submissions per second, to protect the scheduler of the batch system. If None, the rate is not limited.
     """
 
-    def __init__(self, name = None, backend = None, work_dir = None, local_max = 0, local_dynamic = False, verbosity = 1, success_func = None, finished_func = None, max_retries = 0, theme = Theme.Lovecraft, run_max = None, do_snapshot = True, use_snapshot = False, description = None, wrapper = None, profiler = None, listens = True, output_max_attempts = 5, printer_bar_mode = True):
+    def __init__(self, name = None, backend = None, work_dir = None, local_max = 0, local_dynamic = False, verbosity = 1, success_func = None, finished_func = None, max_retries = 0, theme = Theme.Lovecraft, run_max = None, do_snapshot = True, use_snapshot = False, description = None, wrapper = None, profiler = None, listens = True, output_max_attempts = 5, printer_bar_mode = True, snapshot_store = None, array_submission = False, inotify = False, local_affinity = False, local_resources = False, submit_threads = 0, submit_rate = None):
         ## Set debug mode
         self._debug = False
         if log.level == 10: self._debug = True
@@ -128,6 +157,8 @@ class JobHandler(object):
             work_dir = options.Main.workdir
         ## Variables that are not picklable
         self.jobs = JobContainer()
+        ## Jobs whose snapshot is deferred during bulk registration (None if not in bulk registration mode)
+        self._deferred_jobs = None
         ## Snapshot loading
         if use_snapshot:
             if not name:
@@ -140,14 +171,23 @@ class JobHandler(object):
             log.debug('Load JobHandler snapshot from {}'.format(path))
             with open(path, 'rb') as in_file:
                 self.config = pickle.load(in_file)
+            self._snapshot_store = get_snapshot_store(self.config.snapshot_store, self.config.snapshot_dir)
             log.debug('Load job snapshots')
-            for job_config_path in self.config.job_config_paths:
-                with open(job_config_path, 'rb') as in_file:
-                    job_config = pickle.load(in_file)
+            for job_config in self._snapshot_store.load(self.config.job_config_paths):
+                ## The job config on disk is identical to the one just loaded, no update needed
+                job_config.update = False
                 self._add_job_with_config(job_config)
+            ## Migrate snapshot to another snapshot store, if requested
+            if snapshot_store is not None and snapshot_store != self.config.snapshot_store:
+                self.migrate_snapshot(snapshot_store)
         else:
             ## Make new JobHandler config
-            self.config = JobHandlerConfig(name = name, backend = backend, work_dir = work_dir, local_max = local_max, local_dynamic = local_dynamic, success_func = success_func, finished_func = finished_func, max_retries = max_retries, theme = theme, run_max = run_max, do_snapshot = do_snapshot, wrapper = wrapper, listens = listens, output_max_attempts = output_max_attempts)
+            snapshot_store = snapshot_store or SnapshotStore.PICKLE
+            self.config = JobHandlerConfig(name = name, backend = backend, work_dir = work_dir, local_max = local_max, local_dynamic = local_dynamic, success_func = success_func, finished_func = finished_func, max_retries = max_retries, theme = theme, run_max = run_max, do_snapshot = do_snapshot, wrapper = wrapper, listens = listens, output_max_attempts = output_max_attempts, snapshot_store = snapshot_store, array_submission = array_submission, inotify = inotify, local_affinity = local_affinity, local_resources = local_resources, submit_threads = submit_threads, submit_rate = submit_rate)
+            ## Make folders if they don't exist yet, the snapshot store might need them
+            for folder in self.config.dirs:
+                make_dir(folder)
+            self._snapshot_store = get_snapshot_store(self.config.snapshot_store, self.config.snapshot_dir)
             self.reset(skip_jobs = True)
             ## Add this session to the slurmy bookkeeping only if snapshot making is activated
             if do_snapshot:
@@ -158,6 +198,14 @@ class JobHandler(object):
         self._profiler = profiler
         ## Set up printer
         self._printer = Printer(self, verbosity = verbosity, bar_mode = printer_bar_mode)
+        ## CPUs and memory of the machine available for local jobs, determined on first use
+        self._local_capacity = None
+        ## Limiter of the batch submission rate
+        self._rate_limiter = RateLimiter(self.config.submit_rate)
+        ## Tags of the jobs processed in the current submission cycle (None if all jobs are processed)
+        self._cycle_tags = None
+        ## Names of the jobs outside of the current submission cycle, whose status was already evaluated in the cycle
+        self._cycle_checked = set()
 
     def __getitem__(self, key):
         return self.jobs[key]
@@ -183,11 +231,11 @@ class JobHandler(object):
         remove_content(self.config.output_dir)
         if not skip_jobs:
             ## Reset jobs
-            for job in self.jobs.values():
-                job.reset()
+            with self._snapshot_store.batch():
+                for job in self.jobs.values():
+                    job.reset()
             ## Reset job states bookkeeping:
-            for status in self.jobs._states:
-                self.jobs._states[status].clear()
+            self.jobs._update_job_states(skip_eval = True)
         ## Make snapshots
         self.update_snapshot()
 
@@ -201,8 +249,9 @@ class JobHandler(object):
         if not self.config.do_snapshot: return
         if not skip_jobs:
             log.debug('Update job snapshots')
-            for job in self.jobs.values():
-                job.update_snapshot()
+            with self._snapshot_store.batch():
+                for job in self.jobs.values():
+                    job.update_snapshot()
         ## If JobHandler config is not tagged for an update, do nothing
         if not self.config.update:
             log.debug('No changes made, skip JobHandler snapshot update')
@@ -213,13 +262,41 @@ class JobHandler(object):
         ## Reset update flag
         self.config.update = False
 
+    def migrate_snapshot(self, snapshot_store, remove_old = True):
+        """@SLURMY
+        Migrate the job snapshots of the session to another snapshot store, e.g. from one pickle file per job to a single SQLite file.
+
+        * `snapshot_store` Snapshot store (SnapshotStore) to migrate to.
+        * `remove_old` Remove the job snapshots of the previous snapshot store.
+        """
+        if snapshot_store == self.config.snapshot_store:
+            log.debug('Snapshot store is already {}, nothing to migrate'.format(snapshot_store.name))
+            return
+        log.debug('Migrate job snapshots from {} to {}'.format(self.config.snapshot_store.name, snapshot_store.name))
+        old_store = self._snapshot_store
+        new_store = get_snapshot_store(snapshot_store, self.config.snapshot_dir)
+        with new_store.batch():
+            for job in self.jobs.values():
+                new_store.write(job.config)
+                job.config.update = False
+                job._snapshot_store = new_store
+        self._snapshot_store = new_store
+        self.config.snapshot_store = snapshot_store
+        ## Write the JobHandler snapshot, which defines the snapshot store to be used when loading the session
+        self.update_snapshot(skip_jobs = True)
+        if remove_old:
+            old_store.remove(self.config.job_config_paths)
+
     def _add_job_with_config(self, job_config):
         log.debug('Add job {}'.format(job_config.name))
-        job = Job(config = job_config)
+        job = Job(config = job_config, snapshot_store = self._snapshot_store)
         ## Add the job to the JobContainer
         self.jobs.add(job)
-        ## Ensure that a first snapshot is made
-        if self.config.do_snapshot: job.update_snapshot()
+        ## Ensure that a first snapshot is made, or defer it if we are in bulk registration mode
+        if self._deferred_jobs is not None:
+            self._deferred_jobs.append(job)
+        elif self.config.do_snapshot:
+            job.update_snapshot()
         ## If job is a batch job, store job id if it already has one
         if job.type == Type.BATCH and job.id is not None:
             self.jobs.add_id(job.id, job.name)
@@ -329,11 +406,48 @@ class JobHandler(object):
                 job_config.set_mode(Status.FINISHED, Mode.PASSIVE)
         ## Add job config snapshot path to list in JobHandlerConfig
         self.config.add_job_path(config_path)
-        ## Update snapshot to make sure job config paths list is properly updated
-        self.update_snapshot(skip_jobs = True)
+        ## Update snapshot to make sure job config paths list is properly updated, unless we are in bulk registration mode
+        if self._deferred_jobs is None:
+            self.update_snapshot(skip_jobs = True)
 
         return self._add_job_with_config(job_config)
 
+    def add_jobs(self, job_args_list):
+        """@SLURMY
+        Add a list of jobs to the list of jobs to be processed by the JobHandler. Jobs are registered in bulk (see JobHandler.bulk_registration), so snapshots are only written once after all jobs are added.
+
+        * `job_args_list` List of dictionaries, each holding the keyword arguments passed to JobHandler.add_job for one job.
+
+        Returns the list of jobs ([Job]).
+        """
+        with self.bulk_registration():
+            jobs = [self.add_job(**job_args) for job_args in job_args_list]
+
+        return jobs
+
+    @contextmanager
+    def bulk_registration(self):
+        """@SLURMY
+        Context manager for bulk job registration. Inside the context, JobHandler.add_job doesn't update the JobHandler and job snapshots on disk. All deferred snapshots are written at once when leaving the context.
+        """
+        ## If we are already in bulk registration mode, the outermost context takes care of the snapshots
+        if self._deferred_jobs is not None:
+            yield
+            return
+        log.debug('Start bulk job registration')
+        self._deferred_jobs = []
+        try:
+            yield
+        finally:
+            jobs = self._deferred_jobs
+            self._deferred_jobs = None
+            log.debug('Finish bulk job registration, write snapshots of {} jobs'.format(len(jobs)))
+            if self.config.do_snapshot:
+                with self._snapshot_store.batch():
+                    for job in jobs:
+                        job.update_snapshot()
+            self.update_snapshot(skip_jobs = True)
+
     def _job_ready(self, job):
         """@SLURMY
         Check if job is ready to be submitted. Checks if all associated parent jobs are finished and in status SUCCESS. For local job, checks if local job queue is full.
@@ -342,27 +456,28 @@ class JobHandler(object):
 
         Returns if the job is ready or not (bool).
         """
-        ## Check if parent jobs are finished
+        ## Check if parent jobs are finished, using the per tag status bookkeeping
         parent_tags = job.parent_tags
         for tag in parent_tags:
             if tag not in self.jobs._tags:
                 log.error('Parent tag "{}" is not registered in jobs list!'.format(tag))
                 raise Exception
-            for tagged_job in self.jobs._tags[tag]:
-                status = tagged_job.get_status()
-                if status == Status.SUCCESS:
-                    log.debug('Parent job "{0}" of job "{1}" is in SUCCESS, all good'.format(tagged_job.name, job.name))
-                    continue
-                ## If a parent job is unrecoverably failed/cancelled, cancel this job as well
-                if (status == Status.FAILED or status == Status.CANCELLED) and not tagged_job._do_retry():
-                    log.warning('Parent job "{0}" of job "{1}" unrecoverably failed, cancelling job "{1}"'.format(tagged_job.name, job.name))
-                    job.cancel(clear_retry = True)
-                log.debug('Parent job "{0}" of job "{1}" is NOT in SUCCESS, wait for next submission cycle'.format(tagged_job.name, job.name))
-                return False
+            if self._cycle_tags is not None: self._check_outside_cycle(tag)
+            if self.jobs._is_tag_success(tag):
+                log.debug('Parent jobs with tag "{0}" of job "{1}" are in SUCCESS, all good'.format(tag, job.name))
+                continue
+            ## If a parent job is unrecoverably failed/cancelled, cancel this job and all its descendants as well
+            for tagged_job in self.jobs._get_tag_failed(tag):
+                if tagged_job._do_retry(): continue
+                log.warning('Parent job "{0}" of job "{1}" unrecoverably failed, cancelling job "{1}"'.format(tagged_job.name, job.name))
+                self._cancel_descendants(job)
+                break
+            log.debug('Parent jobs with tag "{0}" of job "{1}" are NOT in SUCCESS, wait for next submission cycle'.format(tag, job.name))
+            return False
         ## Check if local job queue is full
         if job.type == Type.LOCAL:
-            if len(self.jobs._local) >= self.config.local_max:
-                log.debug('Maximum number of local jobs running reached, wait for next submission cycle for local job "{}"'.format(job.name))
+            if not self._local_slot_free(job):
+                log.debug('Maximum number of local jobs or local resources reached, wait for next submission cycle for local job "{}"'.format(job.name))
                 return False
         ## Check if the job starttime is reached
         if job.starttime is not None:
@@ -372,6 +487,67 @@ class JobHandler(object):
 
         return True
 
+    def _check_outside_cycle(self, tag):
+        """@SLURMY
+        Evaluate the status of the unfinished jobs with the tag, which are not processed in the current submission cycle since it is restricted to other tags. Each job is only evaluated once per cycle.
+
+        * `tag` Parent tag.
+        """
+        tag_states = self.jobs._tag_states[tag]
+        for name in tag_states[Status.CONFIGURED] | tag_states[Status.RUNNING] | tag_states[Status.FINISHED]:
+            if name in self._cycle_checked: continue
+            self._cycle_checked.add(name)
+            parent_job = self.jobs[name]
+            if parent_job.has_tags(self._cycle_tags): continue
+            self.jobs._update_job_status(parent_job)
+
+    def _local_slot_free(self, job):
+        """@SLURMY
+        Check if a job can be run locally next to the currently running local jobs.
+
+        * `job` Job to check.
+
+        Returns if the job can be run locally (bool).
+        """
+        n_local = len(self.jobs._local)
+        if n_local >= self.config.local_max: return False
+        ## If there are no local jobs running, always run the job, so that it doesn't wait forever
+        if not self.config.local_resources or n_local == 0: return True
+        if self._local_capacity is None:
+            self._local_capacity = (len(LocalExecutor.get_available_cpus()), LocalExecutor.get_available_memory())
+        max_cpus, max_mem = self._local_capacity
+        ## Jobs without memory request are counted with zero memory
+        cpus, mem = job.config.backend.get_resources()
+        mem = mem or 0.
+        for name in self.jobs._local:
+            local_cpus, local_mem = self[name].config.backend.get_resources()
+            cpus += local_cpus
+            mem += local_mem or 0.
+        if cpus > max_cpus: return False
+        if max_mem is not None and mem > max_mem: return False
+
+        return True
+
+    def _cancel_descendants(self, job):
+        """@SLURMY
+        Cancel a job, which can't be processed since a parent job unrecoverably failed, together with all its descendants.
+
+        * `job` Job to be cancelled.
+        """
+        jobs = [job]
+        visited = set([job.name])
+        while jobs:
+            job = jobs.pop()
+            if job.status == Status.CONFIGURED:
+                log.debug('Cancel job "{}" because of an unrecoverably failed ancestor'.format(job.name))
+                job.cancel(clear_retry = True)
+                self._check_job(job, skip_eval = True)
+            for tag in job.tags:
+                for name in self.jobs._children.get(tag, []):
+                    if name in visited: continue
+                    visited.add(name)
+                    jobs.append(self.jobs[name])
+
     def _wait_for_jobs(self, tags = None):
         for job in self.jobs.get(tags):
             if job.type != Type.LOCAL: continue
@@ -392,17 +568,26 @@ class JobHandler(object):
             ## Get list of defined job backend bids
             bid_list = set([job.config.backend.bid for job in self.jobs.values()])
             log.debug('List of backend bids: {}'.format(bid_list))
+            ## Restrict the listeners to the submission window of the session, i.e. the earliest submission of jobs which are still running
+            starttime = time.time()
+            for name in self.jobs._states[Status.RUNNING]:
+                starttime = min(starttime, self.jobs[name].config.timestamps.get(Status.RUNNING, starttime))
+            ## Names of the jobs in the session (array jobs are submitted with the session name)
+            names = set([job.name for job in self.jobs.values()])
+            names.add(self.config.name)
             ## Add listener for each backend
             for bid in bid_list:
                 log.debug('Set up FINISHED listener for bid "{}"'.format(bid))
                 ## Get backend class according to bid
                 backend_class = get_backend_class(bid)
                 ## This function also sets the exitcode of the job, so the success evaluation can be done by itself.
-                listen_func = backend_class.get_listen_func()
+                ## The log directory is always passed on purpose, backends which can follow the job logs written in it (e.g. the job event logs of HTCondor) use them instead of querying the batch system
+                listen_func = backend_class.get_listen_func(starttime = starttime, names = names, log_dir = self.config.log_dir)
                 listener = Listener(self, listen_func, Status.RUNNING, 'id')
                 listeners.append(listener)
 
         ## Get list of defined output files
+        self.jobs._update_job_outputs()
         file_list = [l.output for l in self.jobs.values() if l.output is not None]
         ## Set up output file listener, if any are defined
         if file_list:
@@ -412,18 +597,20 @@ class JobHandler(object):
             log.debug('Set up output listener')
             log.debug('--folder list: {}'.format(folder_list))
             log.debug('--file list: {}'.format(file_list))
-            listen_success = get_listen_files(file_list, folder_list, Status.SUCCESS)
+            listen_success = get_listen_files(file_list, folder_list, Status.SUCCESS, watch = self.config.inotify)
             listener_success = Listener(self, listen_success, Status.FINISHED, 'output', max_attempts = self.config.output_max_attempts, fail_results = {'status': Status.FAILED})
             listeners.append(listener_success)
 
         return listeners
 
-    def run_jobs(self, interval = 1, retry = False):
+    def run_jobs(self, interval = 1, retry = False, event_driven = False, concurrency = None):
         """@SLURMY
         Run the job submission routine. Jobs will be submitted continuously until all of them have been processed.
 
         * `interval` The interval at which the job submission will be done (in seconds). Can also be set to -1 to start every submission cycle manually (will not work if Listeners are used).
         * `retry` Retry jobs in status FAILED or CANCELLED. This will attempt one cycle of job retrying.
+        * `event_driven` Run the event-driven submission routine. Instead of processing all jobs every interval, the submission cycle is woken up by listener updates, exiting local jobs and reached job starttimes, and only the jobs affected by these events are processed. Running jobs are still checked every interval.
+        * `concurrency` Run the asyncio-based submission routine, in which the submission and status query commands of the backends are executed asynchronously, with at most this number of commands running at a time. Only available in python 3.
         """
         ## If a profiler is set, start profiling
         if self._profiler is not None:
@@ -434,6 +621,25 @@ class JobHandler(object):
         if listeners and interval == -1:
             log.warning('Interval of run_jobs was set to -1 but Listeners are used for the job status evaluation, setting interval to 1')
             interval = 1
+        ## Failsafe if interval is set to -1 for the event-driven routine
+        if event_driven and interval == -1:
+            log.warning('Interval of run_jobs was set to -1, which is not supported by the event-driven routine, switch it off')
+            event_driven = False
+        if concurrency is not None:
+            if version_info.major == 2:
+                log.warning('The asyncio-based submission routine is not available in python 2, switch it off')
+                concurrency = None
+            elif event_driven:
+                log.warning('The asyncio-based submission routine can not be combined with the event-driven routine, switch the event-driven routine off')
+                event_driven = False
+        if concurrency is not None and interval == -1:
+            log.warning('Interval of run_jobs was set to -1, which is not supported by the asyncio-based routine, setting interval to 1')
+            interval = 1
+        wakeup = None
+        if event_driven:
+            ## Only exiting local job processes wake up the loop, not e.g. the status queries of the backends
+            wakeup = Wakeup(local_executor.has_exited)
+            wakeup.start()
         try:
             ## Start printer
             self._printer.start()
@@ -442,31 +648,28 @@ class JobHandler(object):
             ## Start listeners, the interval of the listeners MUST be set to same interval as run_jobs
             ##TODO: check if manual mode even works with listeners
             for listener in listeners:
-                listener.start(interval = interval)
+                listener.start(interval = interval, wakeup_fd = wakeup and wakeup.fd)
             ## If retry is set to True, for the relevant jobs (FAILED and CANCELLED) set maximum number of retries to 1 and number of attempted retries to 0
             ## This will trigger the automatic retry routine for these jobs
             if retry:
                 job_states = set([Status.FAILED, Status.CANCELLED])
                 self.set_jobs_config_attr('max_retries', 1, states = job_states)
                 self.set_jobs_config_attr('n_retries', 0, states = job_states)
-            n_all = len(self.jobs)
-            running = True
+            running = not event_driven and concurrency is None
+            if event_driven:
+                self._run_events(listeners, interval, wakeup, retry = retry)
+            if concurrency is not None:
+                ## Imported here, since the module is not compatible with python 2
+                from .asyncdriver import AsyncDriver
+                AsyncDriver(self, concurrency = concurrency).run_loop(listeners, interval, retry = retry)
             while running:
                 ## Update jobs with listeners
                 for listener in listeners:
                     listener.update_jobs()
-                self.submit_jobs(wait = False)
-                n_success = len(self.jobs._states[Status.SUCCESS])
-                n_failed = len(self.jobs._states[Status.FAILED])
-                n_cancelled = len(self.jobs._states[Status.CANCELLED])
-                if (n_success+n_failed+n_cancelled) == n_all:
+                self.submit_jobs(wait = False, make_snapshot = False)
+                if self._finish_cycle():
                     running = False
                 else:
-                    if not self._debug:
-                        ## Update printer output
-                        self._printer.update()
-                    else:
-                        log.debug(self._printer._get_print_string()+'\n')
                     if interval == -1:
                         get_input_func()()
                     else:
@@ -492,6 +695,10 @@ class JobHandler(object):
             ## Stop listeners
             for listener in listeners:
                 listener.stop()
+            if wakeup is not None:
+                wakeup.stop()
+            ## Stop handling SIGCHLD for local jobs until the next submission
+            local_executor.close()
             ## Final snapshot
             self.update_snapshot()
             ## Print final summary and close printer
@@ -500,9 +707,161 @@ class JobHandler(object):
             if self._profiler is not None:
                 self._profiler.stop()
 
+    def _run_events(self, listeners, interval, wakeup, retry = False):
+        """@SLURMY
+        Event-driven job submission routine. Each submission cycle only processes the jobs which are affected by events: jobs updated by the listeners, running jobs, jobs whose starttime is reached, children of jobs which changed their status and jobs waiting for free slots if slots were freed.
+
+        * `listeners` Started listeners.
+        * `interval` Maximum time between two submission cycles while jobs are running (in seconds).
+        * `wakeup` Wakeup channel (Wakeup) used to wait for events.
+        * `retry` Retry jobs in status FAILED or CANCELLED.
+        """
+        ## In the first cycle, all jobs which can still be processed are considered
+        affected = set(job.name for job in self.jobs._get_actionable(retry = retry))
+        ## Jobs which are ready or to be retried, but wait for a free slot (run_max or local_max)
+        waiting = set()
+        ## Starttimes of jobs which are not reached yet
+        starttimes = []
+        now = time.time()
+        for job in self.jobs.values():
+            if job.starttime is not None and job.starttime > now:
+                heapq.heappush(starttimes, (job.starttime, job.name))
+        woken = False
+        while True:
+            self.jobs._changed = set()
+            try:
+                ## Update jobs with listeners, wait shortly for results if the wakeup might come from a listener
+                for listener in listeners:
+                    for job in listener.update_jobs(timeout = 0.1 if woken else None):
+                        affected.add(job.name)
+                ## Running jobs are always checked
+                affected.update(self.jobs._states[Status.RUNNING])
+                affected.update(self.jobs._states[Status.FINISHED])
+                ## Jobs whose starttime is reached
+                now = time.time()
+                while starttimes and starttimes[0][0] <= now:
+                    affected.add(heapq.heappop(starttimes)[1])
+                n_running = len(self.jobs._states[Status.RUNNING])
+                n_local = len(self.jobs._local)
+                batch_jobs = []
+                with self._status_polling():
+                    for job in self.jobs._get_ordered(affected):
+                        self._process_job(job, batch_jobs, retry = retry)
+                        ## Register status changes of the processing (e.g. cancellation due to failed parent jobs)
+                        self._check_job(job, skip_eval = True)
+                        if self._job_waiting(job, retry = retry): waiting.add(job.name)
+                self._submit_batch_jobs(batch_jobs)
+                changed = self.jobs._changed
+            finally:
+                self.jobs._changed = None
+            ## Only the processed jobs need a snapshot
+            if self._finish_cycle(snapshot_jobs = self.jobs._get_ordered(affected)): break
+            ## Jobs affected in the next cycle: jobs which changed their status (e.g. for the retry routine) and their children
+            affected = set(changed)
+            for name in changed:
+                for tag in self.jobs[name].tags:
+                    affected.update(self.jobs._children.get(tag, []))
+            ## If slots were freed, process the jobs waiting for them
+            if waiting and (len(self.jobs._states[Status.RUNNING]) < n_running or len(self.jobs._local) < n_local):
+                affected.update(waiting)
+                waiting = set()
+            ## Wait for the next event, running jobs are checked at least every interval
+            timeout = interval
+            if affected:
+                timeout = 0
+            elif starttimes:
+                time_to_start = max(0., starttimes[0][0] - time.time())
+                if self.jobs._states[Status.RUNNING] or self.jobs._states[Status.FINISHED]:
+                    timeout = min(timeout, time_to_start)
+                else:
+                    timeout = time_to_start
+            woken = wakeup.wait(timeout)
+
+    def _finish_cycle(self, snapshot_jobs = None):
+        """@SLURMY
+        Finish a cycle of the submission routines (run_jobs, event-driven and asyncio-based). Makes the snapshot update, checks if all jobs have been processed and refreshes the printer output otherwise.
+
+        * `snapshot_jobs` Jobs whose snapshots are updated. If None, the snapshots of all jobs are updated.
+
+        Returns if all jobs have been processed (bool).
+        """
+        if snapshot_jobs is None:
+            self.update_snapshot()
+        elif self.config.do_snapshot:
+            with self._snapshot_store.batch():
+                for job in snapshot_jobs:
+                    job.update_snapshot()
+            self.update_snapshot(skip_jobs = True)
+        n_success = len(self.jobs._states[Status.SUCCESS])
+        n_failed = len(self.jobs._states[Status.FAILED])
+        n_cancelled = len(self.jobs._states[Status.CANCELLED])
+        if (n_success+n_failed+n_cancelled) == len(self.jobs): return True
+        if not self._debug:
+            ## Update printer output
+            self._printer.update()
+        else:
+            log.debug(self._printer._get_print_string()+'\n')
+
+        return False
+
+    def _job_waiting(self, job, retry = False):
+        """@SLURMY
+        Check if a processed job only waits for a free slot. This is the case for jobs in status CONFIGURED whose parent jobs are all in SUCCESS and whose starttime is reached, and for jobs in FAILED and CANCELLED which are still to be retried (the retry is only done if a slot is free).
+
+        * `job` Job to be checked.
+        * `retry` Consider all jobs in FAILED and CANCELLED, regardless of their retry configuration.
+
+        Returns if the job is waiting for a free slot (bool).
+        """
+        if job.status in (Status.FAILED, Status.CANCELLED): return (retry or job._do_retry())
+        if job.status != Status.CONFIGURED: return False
+        if job.starttime is not None and job.starttime > time.time(): return False
+        for tag in job.parent_tags:
+            if tag in self.jobs._tags and not self.jobs._is_tag_success(tag): return False
+
+        return True
+
+    def _get_polled_backends(self):
+        """@SLURMY
+        Get the backends of the running batch jobs whose status is evaluated by their backend, grouped by backend.
+
+        Returns the backends per backend id (OrderedDict).
+        """
+        backends = OrderedDict()
+        for name in self.jobs._states[Status.RUNNING]:
+            job = self.jobs[name]
+            ## Only consider batch jobs in ACTIVE mode without custom finished_func, since only these query the backend status
+            if job.type != Type.BATCH or job.mode != Mode.ACTIVE or job.config.finished_func is not None: continue
+            bid = job.config.backend.bid
+            if bid not in backends: backends[bid] = []
+            backends[bid].append(job.config.backend)
+
+        return backends
+
+    @contextmanager
+    def _status_polling(self, backends = None):
+        """@SLURMY
+        Context manager for one status polling cycle. The status of all running batch jobs, whose status is evaluated by their backend, is queried in bulk per backend and cached until the end of the cycle. Starts a new cycle of the directory cache used by the file triggers.
+
+        * `backends` Backends per backend id whose status caches were already filled (see JobHandler._get_polled_backends). If None, the status is queried here.
+        """
+        ## Directory listings used by the file triggers are scanned again in each cycle
+        _directory_cache.set_watch(self.config.inotify)
+        _directory_cache.new_cycle()
+        if backends is None:
+            backends = self._get_polled_backends()
+            for bid, bid_backends in backends.items():
+                get_backend_class(bid).update_status_cache(bid_backends)
+        try:
+            yield
+        finally:
+            ## Clear status caches, so that status evaluations outside of the polling cycle are not served with outdated information
+            for bid in backends:
+                get_backend_class(bid).update_status_cache([])
+
     def submit_jobs(self, tags = None, make_snapshot = True, wait = True, retry = False, skip_eval = False):
         """@SLURMY
-        Submit jobs according to the JobHandler configuration.
+        Submit jobs according to the JobHandler configuration. Only jobs which can still be processed according to the status bookkeeping (CONFIGURED, RUNNING, FINISHED, or FAILED and CANCELLED to be retried) are considered, JobHandler.check() evaluates the status of all jobs.
 
         * `tags` Tags of jobs that will be submitted.
         * `make_snapshot` Make a snapshot of the jobs and the JobHandler after the submission cycle.
@@ -510,39 +869,17 @@ class JobHandler(object):
         * `retry` Retry jobs in status FAILED or CANCELLED. This circumvents the automatic retry routine.
         * `skip_eval` Skip job status evaluation everywhere.
         """
+        ## Parent jobs outside of a cycle which is restricted to tags are evaluated on demand
+        self._cycle_tags = _get_set(tags) if tags is not None else None
+        self._cycle_checked = set()
         try:
-            for job in self.jobs.get(tags):
-                ## Check job status and tags
-                self._check_job(job)
-                ## Check local job status, skip status evaluation since this was already done
-                self._check_local_job(job, skip_eval = True)
-                ## Submit new jobs only if current number of running jobs is below maximum, if set
-                if self.config.run_max and not (len(self.jobs._states[Status.RUNNING]) < self.config.run_max):
-                    log.debug('Maximum number of running jobs ({}) reached, skip job submission'.format(self.config.run_max))
-                    log.debug('Jobs in RUNNING state: {}'.format(self.jobs._states[Status.RUNNING]))
-                    continue
-                ## Current job status
-                status = job.status
-                ## If jobs are in FAILED or CANCELLED state, do retry routine. Ignore maximum number of retries if requested.
-                if (status == Status.FAILED or status == Status.CANCELLED):
-                    status = job._retry(submit = False, ignore_max_retries = retry)
-                ## If job is not in Configured state there is nothing to do
-                if status != Status.CONFIGURED: continue
-                ## Check if job is ready to be submitted --> parent jobs succeeded? local job and local_max is reached?
-                if not self._job_ready(job): continue
-                ## If dynamic local job allocation is active, set job type to local  if maximum number of local jobs is not reached yet
-                if self.config.local_dynamic and len(self.jobs._local) < self.config.local_max:
-                    job.type = Type.LOCAL
-                ## If job is type LOCAL, add job name to list of currently running local jobs
-                if job.type == Type.LOCAL:
-                    self.jobs._local.add(job.name)
-                ## Submit the job
-                status = job.submit()
-                ### If job is a batch job, store the job id with job name
-                if job.type == Type.BATCH:
-                    self.jobs.add_id(job.id, job.name)
-                ## Check job status and tags again, skip status evaluation since this was already done
-                self._check_job(job, skip_eval = True)
+            ## Batch jobs which are ready for submission, they are submitted together after all jobs were checked
+            batch_jobs = []
+            with self._status_polling():
+                ## Only jobs which can still be processed are considered, jobs e.g. in SUCCESS are skipped
+                for job in self.jobs._get_actionable(tags, retry = retry):
+                    self._process_job(job, batch_jobs, retry = retry)
+            self._submit_batch_jobs(batch_jobs)
             if wait: self._wait_for_jobs(tags)
             ## Make JobHandler snapshot update
             if make_snapshot: self.update_snapshot()
@@ -553,6 +890,141 @@ class JobHandler(object):
         except:
             self.cancel_jobs(make_snapshot = False)
             raise
+        finally:
+            self._cycle_tags = None
+
+    def _process_job(self, job, batch_jobs, retry = False):
+        """@SLURMY
+        Process a job in the submission cycle. Checks the job status and submits the job if it is ready. Batch jobs are not submitted directly but added to the list of batch jobs to be submitted.
+
+        * `job` Job to be processed.
+        * `batch_jobs` List of batch jobs to be submitted at the end of the submission cycle.
+        * `retry` Retry jobs in status FAILED or CANCELLED. This circumvents the automatic retry routine.
+        """
+        ## Check job status and tags
+        self._check_job(job)
+        ## Check local job status, skip status evaluation since this was already done
+        self._check_local_job(job, skip_eval = True)
+        ## Submit new jobs only if current number of running jobs (including batch jobs which are about to be submitted) is below maximum, if set
+        if self.config.run_max and not ((len(self.jobs._states[Status.RUNNING]) + len(batch_jobs)) < self.config.run_max):
+            log.debug('Maximum number of running jobs ({}) reached, skip job submission'.format(self.config.run_max))
+            log.debug('Jobs in RUNNING state: {}'.format(self.jobs._states[Status.RUNNING]))
+            return
+        ## Current job status
+        status = job.status
+        ## If jobs are in FAILED or CANCELLED state, do retry routine. Ignore maximum number of retries if requested.
+        if (status == Status.FAILED or status == Status.CANCELLED):
+            status = job._retry(submit = False, ignore_max_retries = retry)
+        ## If job is not in Configured state there is nothing to do
+        if status != Status.CONFIGURED: return
+        ## Check if job is ready to be submitted --> parent jobs succeeded? local job and local_max is reached?
+        if not self._job_ready(job): return
+        ## If dynamic local job allocation is active, set job type to local  if maximum number of local jobs is not reached yet
+        if self.config.local_dynamic and self._local_slot_free(job):
+            job.type = Type.LOCAL
+        ## If job is type LOCAL, add job name to list of currently running local jobs and submit it directly
+        if job.type == Type.LOCAL:
+            self.jobs._local.add(job.name)
+            self._submit_job(job)
+        else:
+            batch_jobs.append(job)
+
+    def _submit_job(self, job):
+        ## Submit the job, local jobs are pinned to free CPUs if requested
+        n_cpus = None
+        if job.type == Type.LOCAL and self.config.local_affinity:
+            if self.config.local_resources:
+                ## As many CPUs as the job requests, which is what the local jobs are scheduled by
+                n_cpus = job.config.backend.get_resources()[0]
+            else:
+                ## Equal share of the available CPUs
+                n_cpus = max(1, len(LocalExecutor.get_available_cpus()) // self.config.local_max)
+        job.submit(n_cpus = n_cpus)
+        ## Finish the submission bookkeeping
+        self._set_submitted(job)
+
+    def _set_submitted(self, job):
+        ## If job is a batch job, store the job id with job name
+        if job.type == Type.BATCH:
+            self.jobs.add_id(job.id, job.name)
+        ## Check job status and tags again, skip status evaluation since this was already done
+        self._check_job(job, skip_eval = True)
+
+    def _submit_batch_jobs(self, jobs):
+        """@SLURMY
+        Submit batch jobs which are ready for submission. If array submission is activated, jobs which share the same array key of their backend are submitted together as array jobs.
+
+        * `jobs` List of batch jobs to be submitted.
+        """
+        ## Group jobs according to backend and array key
+        groups = OrderedDict()
+        ## Jobs which are submitted individually
+        single_jobs = []
+        for job in jobs:
+            array_key = None
+            if self.config.array_submission:
+                array_key = job.config.backend.get_array_key()
+            if array_key is None:
+                single_jobs.append(job)
+                continue
+            group_key = (job.config.backend.bid, array_key)
+            if group_key not in groups: groups[group_key] = []
+            groups[group_key].append(job)
+        ## Nothing to gain from an array job with a single job
+        for group_key in list(groups.keys()):
+            if len(groups[group_key]) > 1: continue
+            single_jobs.append(groups.pop(group_key)[0])
+        self._submit_single_jobs(single_jobs)
+        for (bid, array_key), group in groups.items():
+            backend_class = get_backend_class(bid)
+            array_max = backend_class._array_max or len(group)
+            for i in range(0, len(group), array_max):
+                array_jobs = group[i:i+array_max]
+                log.debug('Submit {} jobs as array job with backend "{}"'.format(len(array_jobs), bid))
+                self._rate_limiter.wait()
+                job_ids = backend_class.submit_array([job.config.backend for job in array_jobs], self.config.name)
+                for job, job_id in zip(array_jobs, job_ids):
+                    job._set_submitted(job_id)
+                    self._set_submitted(job)
+
+    def _submit_single_jobs(self, jobs):
+        """@SLURMY
+        Submit batch jobs individually, honouring the submission rate limit. If several submission threads are configured, the jobs are submitted concurrently. The bookkeeping is done in the calling thread after the submissions.
+
+        * `jobs` List of batch jobs to be submitted.
+        """
+        if self.config.submit_threads > 1 and len(jobs) > 1:
+            try:
+                from concurrent.futures import ThreadPoolExecutor
+            except ImportError:
+                log.warning('concurrent.futures is not available, submit jobs one after the other')
+                ThreadPoolExecutor = None
+            if ThreadPoolExecutor is not None:
+                self._submit_jobs_concurrently(jobs, ThreadPoolExecutor)
+                return
+        for job in jobs:
+            self._rate_limiter.wait()
+            self._submit_job(job)
+
+    def _submit_jobs_concurrently(self, jobs, executor_class):
+        def submit(backend):
+            self._rate_limiter.wait()
+            return backend.submit()
+        log.debug('Submit {} batch jobs with {} threads'.format(len(jobs), self.config.submit_threads))
+        error = None
+        with executor_class(max_workers = self.config.submit_threads) as executor:
+            futures = [executor.submit(submit, job.config.backend) for job in jobs]
+            ## Register all successful submissions before raising, so that these jobs are cancelled as well
+            for job, future in zip(jobs, futures):
+                try:
+                    job_id = future.result()
+                except Exception as e:
+                    log.error('({}) Submission failed: {}'.format(job.name, e))
+                    error = error or e
+                    continue
+                job._set_submitted(job_id)
+                self._set_submitted(job)
+        if error is not None: raise error
 
     def cancel_jobs(self, tags = None, only_local = False, only_batch = False, make_snapshot = True):
         """@SLURMY
@@ -563,12 +1035,31 @@ class JobHandler(object):
         * `only_batch` Cancel only batch jobs.
         * `make_snapshot` Make a snapshot after cancelling jobs.
         """
-        for job in self.jobs.get(tags):
-            ## Nothing to do when job is not in Running state
-            if job.get_status() != Status.RUNNING: continue
-            if only_local and job.type != Type.LOCAL: continue
-            if only_batch and job.type == Type.LOCAL: continue
-            job.cancel()
+        local_jobs = []
+        batch_jobs = OrderedDict()
+        ## The status of the running batch jobs is queried in bulk
+        with self._status_polling():
+            for job in self.jobs.get(tags, states = Status.RUNNING):
+                if only_local and job.type != Type.LOCAL: continue
+                if only_batch and job.type == Type.LOCAL: continue
+                ## Nothing to do when job is not in Running state anymore
+                if job.get_status() != Status.RUNNING: continue
+                if job.type == Type.LOCAL:
+                    local_jobs.append(job)
+                    continue
+                bid = job.config.backend.bid
+                if bid not in batch_jobs: batch_jobs[bid] = []
+                batch_jobs[bid].append(job)
+        ## Cancel batch jobs in bulk per backend and local process groups in one sweep
+        for bid, bid_jobs in batch_jobs.items():
+            log.debug('Cancel {} jobs with backend "{}"'.format(len(bid_jobs), bid))
+            get_backend_class(bid).cancel_jobs([job.config.backend for job in bid_jobs])
+        if local_jobs:
+            local_executor.terminate_all([job._local_process for job in local_jobs if job._local_process is not None])
+        for job in local_jobs + [job for bid_jobs in batch_jobs.values() for job in bid_jobs]:
+            job._set_cancelled()
+            self._check_job(job, skip_eval = True)
+            self._check_local_job(job, skip_eval = True)
         if make_snapshot: self.update_snapshot()
 
     def check(self, force_success_check = False, skip_eval = False, print_summary = True):
@@ -578,8 +1069,9 @@ class JobHandler(object):
         * `force_success_check` Force the success routine to be run, even if the job is already in a post-finished state.
         * `print_summary` Print the job processing summary.
         """
-        for job in self.jobs.values():
-            self._check_job(job, force_success_check = force_success_check, skip_eval = skip_eval)
+        with self._status_polling():
+            for job in self.jobs.values():
+                self._check_job(job, force_success_check = force_success_check, skip_eval = skip_eval)
         if print_summary:
             self._printer.print_summary()
 
@@ -1,7 +1,12 @@
 
 import multiprocessing
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 import glob
 import time
+from collections import OrderedDict
 from .defs import Status, Mode
 import logging
 
@@ -37,54 +42,121 @@ class Listener(object):
         self._process = None
         ## Mapping property
         self._map_property = map_property
+        ## Collected updates, the listen_func only reports changes so they are kept until the job left the listen status
+        self._updates = OrderedDict()
+        ## Metrics of the last update
+        self._metrics = {'n_results': 0, 'lag': 0., 'n_updates': 0, 'last_result': None}
 
-    def start(self, interval = 1):
+    def start(self, interval = 1, wakeup_fd = None):
         """@SLURMY
         Spawn subprocess which continuously collects information by configurable mechanism and match any updates in the output to a state change decision of jobs.
 
         * `interval` Interval at which information is collected by subprocess.
+        * `wakeup_fd` File descriptor which is written to whenever the subprocess reports job updates, used to wake up the event-driven submission loop.
         """
         log.debug('(Listener {}) Start listening'.format(self._listen_status.name))
-        args = (self._results, interval)
+        args = (_TimestampQueue(self._results, wakeup_fd), interval)
         self._process = multiprocessing.Process(target = self._listen_func, args = args)
         self._process.start()
 
-    def update_jobs(self):
+    def _drain(self, timeout = None):
         """@SLURMY
-        Update jobs associated to parent JobHandler with the collected information.
+        Collect all results which are available in the queue and merge them into the collected updates.
+
+        * `timeout` Time (in seconds) to wait for the first result, if none is available. If None, don't wait.
+
+        Returns number of results collected (int).
+        """
+        n_results = 0
+        lag = 0.
+        while True:
+            try:
+                if n_results == 0 and timeout:
+                    put_time, results = self._results.get(timeout = timeout)
+                else:
+                    put_time, results = self._results.get_nowait()
+            except queue.Empty:
+                break
+            n_results += 1
+            lag = max(lag, time.time() - put_time)
+            self._updates.update(results)
+            self._metrics['last_result'] = put_time
+        self._metrics['n_results'] = n_results
+        self._metrics['lag'] = lag
+        self._metrics['n_updates'] = len(self._updates)
+        if n_results > 1:
+            log.debug('(Listener {}) Merged {} results, lag of the oldest result is {:.2f}s'.format(self._listen_status.name, n_results, lag))
+
+        return n_results
+
+    def get_metrics(self):
+        """@SLURMY
+        Get metrics of the last job update.
+
+        Returns dictionary with the number of results collected from the queue ("n_results"), the maximum time these results spent in the queue in seconds ("lag"), the number of pending updates ("n_updates") and the timestamp of the latest result ("last_result").
+        """
+        return dict(self._metrics)
+
+    def update_jobs(self, timeout = None):
+        """@SLURMY
+        Update jobs associated to parent JobHandler with the collected information. Never blocks longer than timeout, if no new results are available the pending updates are applied.
+
+        * `timeout` Time (in seconds) to wait for new results, if none are available. If None, don't wait.
+
+        Returns list of jobs which were updated ([Job]).
         """
         log.debug('(Listener {}) Update jobs'.format(self._listen_status.name))
-        results = self._results.get()
+        ## Attempts are only counted if the listen_func made a new check
+        new_results = self._drain(timeout) > 0
+        results = self._updates
         if self._parent._debug:
             from pprint import pprint
             ## Print the last 10 entries of the results OrderedDict
             pprint(list(results.items())[-10:])
-        for job in self._parent.jobs.values():
-            ## If job is not in status which the listener should consider, skip
+        updated_jobs = []
+        ## Apply the collected updates to the jobs they are mapped to
+        for key in list(results.keys()):
+            pending = False
+            for job in self._parent.jobs._get_mapped_jobs(self._map_property, key):
+                ## If the result belongs to a previous submission of the job (e.g. before a retry), skip
+                if getattr(job, self._map_property) != key: continue
+                ## If job didn't reach the status which the listener should consider yet, keep the result
+                if job.status.value < self._listen_status.value:
+                    pending = True
+                    continue
+                ## If job is not in status which the listener should consider, skip
+                if job.status != self._listen_status: continue
+                ## If job is in ACTIVE mode, skip
+                if job.mode == Mode.ACTIVE: continue
+                log.debug('(Listener {}) Found results for job "{}"'.format(self._listen_status.name, job.name))
+                self._update_job(job, results[key])
+                updated_jobs.append(job)
+                ## Keep the result until it was accepted by the job (the status change can be delayed, e.g. by the job's delaytimes)
+                if job.status == self._listen_status: pending = True
+            if not pending: results.pop(key)
+        ## Count attempts of jobs without results, if required
+        if self._max_attempts is None or not new_results: return updated_jobs
+        for name in list(self._parent.jobs._states[self._listen_status]):
+            job = self._parent.jobs[name]
             if job.status != self._listen_status: continue
-            ## If job is in ACTIVE mode, skip
             if job.mode == Mode.ACTIVE: continue
-            ## Get result key relevant for this job
             key = getattr(job, self._map_property)
-            ## Count attempt, if required
-            if self._max_attempts is not None:
-                if key not in self._attempts: self._attempts[key] = 0
-                self._attempts[key] += 1
-                log.debug('(Listener {}) Job "{}" is now at {} attempts'.format(self._listen_status.name, job.name, self._attempts[key]))
-            update_dict = None
-            if key in results:
-                ## If key is in results, set update_dict to results
-                log.debug('(Listener {}) Found results for job "{}"'.format(self._listen_status.name, job.name))
-                update_dict = results[key]
-            elif (self._max_attempts is not None) and (self._attempts[key] >= self._max_attempts):
-                ## Else if maximum number of attempts is reached, set update_dict to fail results
+            if key in results: continue
+            if key not in self._attempts: self._attempts[key] = 0
+            self._attempts[key] += 1
+            log.debug('(Listener {}) Job "{}" is now at {} attempts'.format(self._listen_status.name, job.name, self._attempts[key]))
+            ## If maximum number of attempts is reached, set fail results
+            if self._attempts[key] >= self._max_attempts:
                 log.debug('(Listener {}) Job "{}" reached maximum amount of attempts, setting fail results'.format(self._listen_status.name, job.name))
-                update_dict = self._fail_results
-            ## If we have results, update job properties
-            if update_dict is not None:
-                for up_key, up_val in update_dict.items():
-                    log.debug('(Listener {}) Update {} of job "{}" to {}'.format(self._listen_status.name, up_key, job.name, up_val))
-                    setattr(job, up_key, up_val)
+                self._update_job(job, self._fail_results)
+                updated_jobs.append(job)
+
+        return updated_jobs
+
+    def _update_job(self, job, update_dict):
+        for up_key, up_val in update_dict.items():
+            log.debug('(Listener {}) Update {} of job "{}" to {}'.format(self._listen_status.name, up_key, job.name, up_val))
+            setattr(job, up_key, up_val)
 
     def stop(self):
         """@SLURMY
@@ -92,3 +164,23 @@ class Listener(object):
         """
         log.debug('(Listener {}) Stop listening'.format(self._listen_status.name))
         self._process.terminate()
+
+class _TimestampQueue(object):
+    """@SLURMY
+    Wrapper of the listener result queue, which adds the time the results were put in the queue.
+
+    * `results` Result queue of the listener.
+    * `wakeup_fd` File descriptor which is written to if the results are not empty.
+    """
+    def __init__(self, results, wakeup_fd = None):
+        self._results = results
+        self._wakeup_fd = wakeup_fd
+
+    def put(self, res_dict):
+        self._results.put((time.time(), res_dict))
+        if res_dict and self._wakeup_fd is not None:
+            import os
+            try:
+                os.write(self._wakeup_fd, b'x')
+            except OSError:
+                pass
@@ -0,0 +1,120 @@
+
+import os
+import pickle
+import logging
+from contextlib import contextmanager
+from .defs import SnapshotStore
+
+log = logging.getLogger('slurmy')
+
+
+class PickleStore(object):
+    """@SLURMY
+    Snapshot store which writes every job config into its own pickle file, located at the path defined in the job config.
+    """
+
+    def write(self, config):
+        with open(config.path, 'wb') as out_file:
+            pickle.dump(config, out_file)
+
+    def load(self, paths):
+        """@SLURMY
+        Load job configs from the store.
+
+        * `paths` List of job config paths, in the order they should be loaded.
+
+        Returns list of job configs ([JobConfig]).
+        """
+        configs = []
+        for path in paths:
+            with open(path, 'rb') as in_file:
+                configs.append(pickle.load(in_file))
+
+        return configs
+
+    @contextmanager
+    def batch(self):
+        yield
+
+    def remove(self, paths):
+        for path in paths:
+            if os.path.isfile(path): os.remove(path)
+
+
+class SQLiteStore(object):
+    """@SLURMY
+    Snapshot store which keeps all job configs of a session in a single SQLite file, indexed by the job config path. Writes inside a batch context are committed at once when leaving the context.
+
+    * `snapshot_dir` Snapshot directory of the JobHandler session.
+    """
+    _file_name = 'JobConfigs.db'
+
+    def __init__(self, snapshot_dir):
+        import sqlite3
+        self._path = os.path.join(snapshot_dir, SQLiteStore._file_name)
+        self._connection = sqlite3.connect(self._path)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS job_configs (id INTEGER PRIMARY KEY AUTOINCREMENT, path TEXT UNIQUE, config BLOB)')
+        self._connection.commit()
+        ## Nesting depth of batch contexts
+        self._batch_depth = 0
+
+    def write(self, config):
+        import sqlite3
+        blob = sqlite3.Binary(pickle.dumps(config, pickle.HIGHEST_PROTOCOL))
+        ## Update in place to keep the insertion order of the jobs
+        cursor = self._connection.execute('UPDATE job_configs SET config = ? WHERE path = ?', (blob, config.path))
+        if cursor.rowcount == 0:
+            self._connection.execute('INSERT INTO job_configs (path, config) VALUES (?, ?)', (config.path, blob))
+        if self._batch_depth == 0:
+            self._connection.commit()
+
+    def load(self, paths):
+        """@SLURMY
+        Load job configs from the store.
+
+        * `paths` List of job config paths, in the order they should be loaded.
+
+        Returns list of job configs ([JobConfig]).
+        """
+        blobs = {}
+        for path, blob in self._connection.execute('SELECT path, config FROM job_configs'):
+            blobs[path] = blob
+        configs = []
+        for path in paths:
+            if path not in blobs:
+                log.error('Could not find job config "{}" in {}'.format(path, self._path))
+                raise Exception
+            configs.append(pickle.loads(bytes(blobs[path])))
+
+        return configs
+
+    @contextmanager
+    def batch(self):
+        self._batch_depth += 1
+        try:
+            yield
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._connection.commit()
+
+    def remove(self, paths):
+        self._connection.close()
+        if os.path.isfile(self._path): os.remove(self._path)
+
+def get_snapshot_store(snapshot_store, snapshot_dir):
+    """@SLURMY
+    Get the snapshot store instance.
+
+    * `snapshot_store` Type of the snapshot store (SnapshotStore).
+    * `snapshot_dir` Snapshot directory of the JobHandler session.
+
+    Returns the snapshot store.
+    """
+    if snapshot_store == SnapshotStore.PICKLE:
+        return PickleStore()
+    elif snapshot_store == SnapshotStore.SQLITE:
+        return SQLiteStore(snapshot_dir)
+    else:
+        log.error('Unknown snapshot store "{}"'.format(snapshot_store))
+        raise Exception
@@ -6,62 +6,253 @@ log = logging.getLogger('slurmy')
 
 
 ## Success classes/functions
+class _DirectoryCache(object):
+    """@SLURMY
+    Cache of directory listings, shared by the SuccessTriggers, FinishedTriggers and the output listener. Each directory is scanned once per submission cycle (at most once per refresh interval) and files are looked up in the resulting set of names, instead of checking each file separately. If watching is activated, directories on local file systems are scanned only once and their listings are kept up to date with inotify events.
+    """
+    ## Minimum time between two scans of the same directory (in seconds)
+    _refresh_interval = 1.
+    ## Minimum time between two explicit "ls" calls on the same directory (in seconds)
+    _ls_interval = 5.
+
+    def __init__(self):
+        self._cycle = 0
+        ## Directory listings ({folder: (cycle, timestamp, set(file names))})
+        self._listings = {}
+        ## Timestamps of the last "ls" call ({folder: timestamp})
+        self._ls_times = {}
+        ## Inotify watcher, if watching is activated and available
+        self._watcher = None
+        ## Directories checked for watching ({folder: watched or not})
+        self._watched = {}
+
+    def set_watch(self, watch):
+        """@SLURMY
+        Activate or deactivate watching of directories on local file systems with inotify. Falls back to scanning if inotify is not available.
+
+        * `watch` Activate watching.
+        """
+        from .inotify import is_available, InotifyWatcher
+        if watch and self._watcher is None:
+            if not is_available():
+                log.debug('Inotify is not available, fall back to scanning directories')
+                return
+            try:
+                self._watcher = InotifyWatcher()
+            except OSError as e:
+                log.debug('Could not set up inotify watcher ({}), fall back to scanning directories'.format(e))
+        elif not watch and self._watcher is not None:
+            self._watcher.close()
+            self._watcher = None
+            for folder, watched in self._watched.items():
+                if watched: self._listings.pop(folder, None)
+            self._watched = {}
+
+    def _watch(self, folder):
+        if self._watcher is None: return False
+        if folder in self._watched: return self._watched[folder]
+        from .inotify import is_local_fs
+        if not is_local_fs(folder):
+            log.debug('Folder {} is not on a local file system, scan it instead of watching'.format(folder))
+            self._watched[folder] = False
+            return False
+        ## If the folder doesn't exist yet, try again next time
+        if not self._watcher.add_folder(folder): return False
+        self._watched[folder] = True
+        ## Scan the folder once after the watch was added
+        self._listings.pop(folder, None)
+
+        return True
+
+    def _process_events(self):
+        from .inotify import IN_DELETE, IN_MOVED_FROM, IN_DELETE_SELF, IN_MOVE_SELF
+        for folder, name, mask in self._watcher.read():
+            ## Event queue overflow, scan all watched folders again
+            if folder is None:
+                for watched_folder, watched in self._watched.items():
+                    if watched: self._listings.pop(watched_folder, None)
+                continue
+            ## Watched folder itself is gone
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                self._watched.pop(folder, None)
+                self._listings.pop(folder, None)
+                continue
+            if folder not in self._listings: continue
+            names = self._listings[folder][2]
+            if mask & (IN_DELETE | IN_MOVED_FROM):
+                names.discard(name)
+            else:
+                names.add(name)
+
+    def wait(self, timeout):
+        """@SLURMY
+        Wait for the given time, or until inotify events arrive for watched folders.
+
+        * `timeout` Maximum time to wait (in seconds).
+        """
+        import time
+        if self._watcher is not None and any(self._watched.values()):
+            self._watcher.wait(timeout)
+        else:
+            time.sleep(timeout)
+
+    def new_cycle(self):
+        """@SLURMY
+        Start a new cycle, directory listings of the previous cycles are scanned again when requested.
+        """
+        self._cycle += 1
+
+    def _force_update(self, folder, now):
+        import subprocess
+        if (now - self._ls_times.get(folder, 0.)) < _DirectoryCache._ls_interval: return
+        self._ls_times[folder] = now
+        ## Make an explicit ls on the folders where the output files are written to
+        ## This avoids problems with delayed updates in the underlying file system
+        try:
+            subprocess.check_output(['ls', folder], universal_newlines = True, stderr = subprocess.STDOUT)
+        except subprocess.CalledProcessError:
+            log.debug('Output folder {} does not exist, please check'.format(folder))
+
+    def get_listing(self, folder, refresh = False):
+        """@SLURMY
+        Get the names of the files in a directory.
+
+        * `folder` Path of the directory.
+        * `refresh` Scan the directory again if the listing is older than the refresh interval, even if it was made in the current cycle.
+
+        Returns the timestamp of the directory scan (float) and the file names (set(str)).
+        """
+        import time
+        watched = self._watch(folder)
+        if watched: self._process_events()
+        cycle, timestamp, names = self._listings.get(folder, (None, None, None))
+        now = time.time()
+        if timestamp is not None and ((cycle == self._cycle and not refresh) or (now - timestamp) < _DirectoryCache._refresh_interval):
+            return timestamp, names
+        ## Listings of watched folders are kept up to date by the events
+        if watched and names is not None:
+            self._listings[folder] = (self._cycle, now, names)
+            return now, names
+        if not watched: self._force_update(folder, now)
+        names = _scan_dir(folder)
+        self._listings[folder] = (self._cycle, now, names)
+
+        return now, names
+
+    def exists(self, file_name, refresh = False):
+        """@SLURMY
+        Check if a file exists, according to the listing of its directory.
+
+        * `file_name` Path of the file.
+        * `refresh` Scan the directory again if the listing is older than the refresh interval, even if it was made in the current cycle.
+
+        Returns if the file exists (bool) and the timestamp of the directory scan (float).
+        """
+        import os
+        folder, name = os.path.split(file_name)
+        timestamp, names = self.get_listing(folder, refresh = refresh)
+
+        return (name in names), timestamp
+
+def _scan_dir(folder):
+    import os
+    try:
+        ## os.scandir is only available in python 3
+        if hasattr(os, 'scandir'):
+            return set(entry.name for entry in os.scandir(folder))
+        return set(os.listdir(folder))
+    except OSError:
+        return set()
+
+_directory_cache = _DirectoryCache()
+
 class SuccessTrigger:
     """@SLURMY
-    Callable class which can be used as success_func of a slurmy job. It checks if the success_file is present in the underlying file system, once a second. If the maximum number of attempts are reached without finding the file, it returns FAILED.
+    Callable class which can be used as success_func of a slurmy job. It checks if the success_file is present in the underlying file system, once a second, using the shared directory cache. If the maximum number of attempts are reached without finding the file, it returns FAILED. In the submission cycle of the JobHandler the attempts don't block, if the file is not found yet the job stays FINISHED and the next attempt is made in a later cycle.
 
     * `success_file` The file which is created if the job is successful.
     * `max_attempts` Maximum number of attempts that will be tried to find the success_file.
     """
+    ## Attempts of the pending checks, created on first use to be compatible with older snapshots ({job name: (finished timestamp, listing timestamp, attempts)})
+    _pending = None
+
     def __init__(self, success_file, max_attempts):
         self._success_file = success_file
         self._max_attempts = max_attempts
 
     def __call__(self, config):
-        import os, time, subprocess
-        ## Make an explicit ls on the folders where the output files are written to
-        ## This avoids problems with delayed updates in the underlying file system
-        folder = os.path.dirname(self._success_file)
-        try:
-            subprocess.check_output(['ls', folder], universal_newlines = True, stderr = subprocess.STDOUT)
-        except subprocess.CalledProcessError:
-            log.debug('Output folder {} does not exist, please check'.format(folder))
-        ## Atempt to find success file
+        import time
         for i in range(self._max_attempts):
             log.debug('Checking success file, attempt #{}'.format(i))
-            if os.path.isfile(self._success_file):
+            ## Consecutive attempts are at least the refresh interval apart, so each one gets a new directory scan
+            if _directory_cache.exists(self._success_file, refresh = True)[0]:
                 return True
-            time.sleep(1)
+            if i < self._max_attempts - 1: time.sleep(_DirectoryCache._refresh_interval)
 
         return False
 
-def get_listen_files(file_list, folder_list, status):
+    def _check_pending(self, config):
+        ## Non-blocking check, returns None while the attempts are not exhausted
+        from slurmy import Status
+        if self._pending is None: self._pending = {}
+        found, listing_time = _directory_cache.exists(self._success_file)
+        if found:
+            self._pending.pop(config.name, None)
+            return True
+        finished_time = config.timestamps.get(Status.FINISHED)
+        last_finished_time, last_listing_time, attempts = self._pending.get(config.name, (None, None, 0))
+        ## Restart counting attempts if the job finished again, e.g. after a retry
+        if finished_time != last_finished_time:
+            last_listing_time, attempts = None, 0
+        ## Only count an attempt for a new directory listing
+        if listing_time != last_listing_time:
+            attempts += 1
+            log.debug('({}) Checking success file, attempt #{}'.format(config.name, attempts))
+        if attempts >= self._max_attempts:
+            self._pending.pop(config.name, None)
+            return False
+        self._pending[config.name] = (finished_time, listing_time, attempts)
+
+        return None
+
+def get_listen_files(file_list, folder_list, status, watch = False):
     def listen_files(results, interval = 1):
-        import os, time, subprocess
+        import time
         from slurmy import Status
         from collections import OrderedDict
+        ## Output files which were already reported
+        reported = set()
+        ## Own directory cache of the listener process
+        directory_cache = _DirectoryCache()
+        directory_cache.set_watch(watch)
+        last_put = 0.
         while True:
-            ## Make an explicit ls on the folders where the output files are written to
-            ## This avoids problems with delayed updates in the underlying file system
+            ## Scan each folder once per cycle
+            directory_cache.new_cycle()
             for folder in folder_list:
-                try:
-                    subprocess.check_output(['ls', folder], universal_newlines = True, stderr = subprocess.STDOUT)
-                except subprocess.CalledProcessError:
-                    log.debug('Output folder {} does not exist, please check'.format(folder))
-            ## Collect the information and put in results
+                directory_cache.get_listing(folder)
+            ## Collect the information and put in results, only newly found files are reported
             res_dict = OrderedDict()
             for file_name in file_list:
-                if not os.path.isfile(file_name): continue
+                if not directory_cache.exists(file_name)[0]:
+                    reported.discard(file_name)
+                    continue
+                if file_name in reported: continue
+                reported.add(file_name)
                 res_dict[file_name] = {'status': status}
-            results.put(res_dict)
-            time.sleep(interval)
+            ## Results are put at every interval, or directly if new files were found by the watcher
+            now = time.time()
+            if res_dict or (now - last_put) >= interval:
+                results.put(res_dict)
+                last_put = now
+            directory_cache.wait(max(0., interval - (time.time() - last_put)))
 
     return listen_files
 
 ## Finished classes
 class FinishedTrigger:
     """@SLURMY
-    Callable class which can be used as finished_func of a slurmy job. It checks if finished_file is present in the underlying file system.
+    Callable class which can be used as finished_func of a slurmy job. It checks if finished_file is present in the underlying file system, using the shared directory cache.
 
     * `finished_file` The file which is created if the job is finished.
     """
@@ -69,19 +260,46 @@ class FinishedTrigger:
         self._finished_file = finished_file
 
     def __call__(self, config):
-        import os, subprocess
-        ## Make an explicit ls on the folders where the output files are written to
-        ## This avoids problems with delayed updates in the underlying file system
-        folder = os.path.dirname(self._finished_file)
-        try:
-            subprocess.check_output(['ls', folder], universal_newlines = True, stderr = subprocess.STDOUT)
-        except subprocess.CalledProcessError:
-            log.debug('Output folder {} does not exist, please check'.format(folder))
-
-        finished = os.path.isfile(self._finished_file)
+        finished = _directory_cache.exists(self._finished_file)[0]
 
         return finished
 
+## Submission utils
+class RateLimiter(object):
+    """@SLURMY
+    Thread-safe limiter of the rate of batch submissions, to protect the scheduler of the batch system. Submissions are spread out evenly, each one reserves the next free time slot.
+
+    * `rate` Maximum number of submissions per second. If None or 0, the rate is not limited.
+    """
+    def __init__(self, rate = None):
+        import threading
+        self._interval = (1. / rate) if rate else 0.
+        self._next = 0.
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """@SLURMY
+        Reserve the next submission time slot.
+
+        Returns the time to wait until the time slot is reached (float).
+        """
+        import time
+        if not self._interval: return 0.
+        with self._lock:
+            now = time.time()
+            slot = max(now, self._next)
+            self._next = slot + self._interval
+
+        return slot - now
+
+    def wait(self):
+        """@SLURMY
+        Reserve the next submission time slot and wait until it is reached.
+        """
+        import time
+        delay = self.reserve()
+        if delay > 0: time.sleep(delay)
+
 ## Post-function classes
 class LogMover:
     """@SLURMY
@@ -279,6 +497,19 @@ def find_between(s, first, last):
     else:
         return results[0]
 
+## Memory units relative to MB, as used by slurm and htcondor (memory without unit is given in MB)
+_mem_units = {'K': 1./1024, 'M': 1., 'G': 1024., 'T': 1024.*1024}
+
+def parse_mem(mem):
+    """Convert memory specification mem (e.g. 2000, "500M", "4G") to MB. Returns None if mem is not set or can't be parsed."""
+    if mem is None or mem == '': return None
+    match = re.match(r'^\s*([0-9]*\.?[0-9]+)\s*([KMGT]?)B?\s*$', str(mem), re.IGNORECASE)
+    if match is None:
+        log.warning('Could not parse memory specification "{}"'.format(mem))
+        return None
+
+    return float(match.group(1)) * _mem_units[match.group(2).upper() or 'M']
+
 ## Command utils
 def check_return(command):
     split_command = shlex.split(command)
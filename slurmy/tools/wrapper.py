@@ -17,7 +17,7 @@ class Wrapper(object):
         command = self._condition.format(command = command)
         ## Recursive function to scan script and find proper position for the command
         def add_command(tail, head = ''):
-            line, tail = tail.split('\n', 1)
+            line, _, tail = tail.partition('\n')
             line = line.strip()
             ## When line is not empty and is not commented out, command must be inserted before here in any case
             if line and not line.startswith('#'):
@@ -25,6 +25,9 @@ class Wrapper(object):
             ## If tail doesn't contain the backend options identifier, command can be inserted here
             elif script_options_identifier and '#{}'.format(script_options_identifier) not in tail:
                 return head + '{}\n'.format(line) + command + tail
+            ## End of the script reached
+            elif not tail:
+                return head + '{}\n'.format(line) + command
             else:
                 head += '{}\n'.format(line)
                 return add_command(tail, head)